@@ -3,7 +3,7 @@ from seafevents.tasks import IndexUpdater, SeahubEmailSender, LdapSyncer,\
         VirusScanner, Statistics, CountUserActivity, CountTrafficInfo, ContentScanner,\
         WorkWinxinNoticeSender, FileUpdatesSender, RepoOldFileAutoDelScanner,\
         DeletedFilesCountCleaner, FaceClusterTaskPublisher, ESWikiIndexUpdater, FaceClusterUpdater, \
-        QuotaAlertEmailSender, AIStatsManager, RiskControlStatistics
+        QuotaAlertEmailSender, AIStatsManager, RiskControlStatistics, EventRetentionManager
 
 from seafevents.repo_metadata.metadata_manager import MetadataManager
 from seafevents.seafevent_server.seafevent_server import SeafEventServer
@@ -16,6 +16,8 @@ from seafevents.events.metrics import MetricsManager
 from seafevents.statistics.quota_usage_manager import QuotaUsageManager
 from seafevents.webhook.webhook import Webhooker
 from seafevents.tasks.repo_storage_task import RepoStorageTask
+from seafevents.utils.diff_cache import diff_cache
+from seafevents.utils.extract_cache import extract_cache
 
 class App(object):
     def __init__(self, config, seafile_config,
@@ -24,6 +26,9 @@ class App(object):
         self._fg_tasks_enabled = foreground_tasks_enabled
         self._bg_tasks_enabled = background_tasks_enabled
 
+        diff_cache.init(config)
+        extract_cache.init(config)
+
         if self._fg_tasks_enabled:
             init_message_handlers(config)
             self._events_handler = EventsHandler(config)
@@ -44,8 +49,9 @@ class App(object):
             self._file_updates_sender = FileUpdatesSender()
             self._repo_old_file_auto_del_scanner = RepoOldFileAutoDelScanner(config)
             self._deleted_files_count_cleaner = DeletedFilesCountCleaner()
+            self._event_retention_manager = EventRetentionManager(config)
             self._metrics_manager = MetricsManager()
-            self._quota_usage_manager = QuotaUsageManager()
+            self._quota_usage_manager = QuotaUsageManager(config)
             self._repo_storage_task = RepoStorageTask()
 
             self._webhooker = Webhooker()
@@ -60,7 +66,7 @@ class App(object):
             if ENABLE_QUOTA_ALERT:
                 self._quota_alert_email_sender = QuotaAlertEmailSender()
             if ENABLE_SEAFILE_AI:
-                self.ai_stats_manager = AIStatsManager()
+                self.ai_stats_manager = AIStatsManager(config)
             if ENABLE_MULTI_STORAGE:
                 self._repo_storage_task = RepoStorageTask()
             if ENABLE_RISK_CONTROL:
@@ -85,6 +91,7 @@ class App(object):
             self._content_scanner.start()
             self._repo_old_file_auto_del_scanner.start()
             self._deleted_files_count_cleaner.start()
+            self._event_retention_manager.start()
             if ENABLE_METADATA_MANAGEMENT:
                 self._metadata_manager.start()
                 self._face_cluster_updater.start()
@@ -1,4 +1,6 @@
 import time
+import zlib
+import queue
 import logging
 import json
 from threading import Thread
@@ -8,8 +10,13 @@ from seaserv import seafile_api
 import seafevents.events.handlers as events_handlers
 import seafevents.events_publisher.handlers as publisher_handlers
 import seafevents.statistics.handlers as stats_handlers
+from seafevents.statistics.counter import init_stats_journal
 from seafevents.db import init_db_session_class
 from seafevents.app.event_redis import RedisClient
+from seafevents.events.metrics import publish_metric
+from seafevents.events.activity_aggregator import activity_aggregator
+from seafevents.events.repo_context_cache import repo_context_cache, org_last_activity_time_writer
+from seafevents.utils import get_opt_from_conf_or_env
 import seafevents.repo_metadata.handlers as metadata_handler
 
 logger = logging.getLogger(__name__)
@@ -25,6 +32,10 @@ class MessageHandler(object):
         # A (channel, List<handler>) map. For a given channel, there may be
         # multiple handlers
         self._handlers = {}
+        # A (handler, batch handler) map. A batch handler receives all the
+        # messages of one msg_type popped in a cycle and saves them in one
+        # transaction.
+        self._batch_handlers = {}
 
     def add_handler(self, msg_type, func):
         if msg_type in self._handlers:
@@ -36,29 +47,67 @@ class MessageHandler(object):
         if func not in funcs:
             funcs.append(func)
 
-    def handle_message(self, config, session, redis_connection, channel, msg):
+    def add_batch_handler(self, func, batch_func):
+        self._batch_handlers[func] = batch_func
+
+    def _get_msg_type(self, channel, msg):
         try:
             content = json.loads(msg.get('content'))
         except:
             logger.warning("invalid message format: %s", msg)
-            return
+            return None
 
         if not content.get('msg_type'):
-            return
+            return None
+
+        return channel + ':' + content.get('msg_type')
 
-        msg_type = channel + ':' + content.get('msg_type')
+    def _call_handler(self, func, config, session, redis_connection, msg):
+        try:
+            if func.__name__ == 'RepoUpdatePublishHandler' or func.__name__ == 'RepoMetadataUpdateHandler':
+                func(config, redis_connection, msg)
+            else:
+                func(config, session, msg)
+        except Exception as e:
+            logger.exception("error when handle msg: %s", e)
+
+    def handle_message(self, config, session, redis_connection, channel, msg):
+        msg_type = self._get_msg_type(channel, msg)
         if msg_type not in self._handlers:
             return
 
         funcs = self._handlers.get(msg_type)
         for func in funcs:
-            try:
-                if func.__name__ == 'RepoUpdatePublishHandler' or func.__name__ == 'RepoMetadataUpdateHandler':
-                    func(config, redis_connection, msg)
-                else:
-                    func(config, session, msg)
-            except Exception as e:
-                logger.exception("error when handle msg: %s", e)
+            self._call_handler(func, config, session, redis_connection, msg)
+
+    def handle_messages(self, config, session, redis_connection, channel, msgs):
+        """Dispatch a batch of messages popped from one channel.
+
+        Messages are grouped by msg_type, keeping their original order inside a
+        group. Handlers which registered a batch handler get the whole group at
+        once, the others are called message by message. If a batch handler fails,
+        the group is handled again one message at a time.
+        """
+        groups = {}
+        for msg in msgs:
+            msg_type = self._get_msg_type(channel, msg)
+            if msg_type not in self._handlers:
+                continue
+            groups.setdefault(msg_type, []).append(msg)
+
+        for msg_type, group in groups.items():
+            for func in self._handlers[msg_type]:
+                batch_func = self._batch_handlers.get(func)
+                if batch_func is not None:
+                    try:
+                        batch_func(config, session, group)
+                        continue
+                    except Exception as e:
+                        logger.exception("error when handle %d msgs of %s in batch: %s", len(group), msg_type, e)
+                        session.rollback()
+
+                for msg in group:
+                    self._call_handler(func, config, session, redis_connection, msg)
 
     def get_channels(self):
         channels = set()
@@ -86,6 +135,10 @@ def init_message_handlers(config):
     else:
         enable_audit = False
 
+    repo_context_cache.init(config)
+    org_last_activity_time_writer.init(config)
+    init_stats_journal(config)
+
     events_handlers.register_handlers(message_handler, enable_audit)
     stats_handlers.register_handlers(message_handler)
     publisher_handlers.register_handlers(message_handler)
@@ -98,8 +151,45 @@ class EventsHandler(object):
         self._config = config
         self._db_session_class = init_db_session_class()
         self._redis_connection = RedisClient().connection
+        self._batch_size = 1
+        self._workers = 1
+        self._shard_queue_size = 1000
+        self._metric_interval = 60
+
+        self._parse_config(config)
+        activity_aggregator.init(config)
+
+    def _parse_config(self, config):
+        section_name = 'EVENTS HANDLER'
+        batch_size = get_opt_from_conf_or_env(config, section_name, 'batch_size', default=1)
+        try:
+            batch_size = int(batch_size)
+        except ValueError:
+            logger.warning('invalid events handler batch_size "%s"', batch_size)
+            batch_size = 1
+
+        if batch_size < 1:
+            logger.warning('insane events handler batch_size "%s"', batch_size)
+            batch_size = 1
+        self._batch_size = batch_size
+
+        workers = get_opt_from_conf_or_env(config, section_name, 'workers', default=1)
+        try:
+            workers = int(workers)
+        except ValueError:
+            logger.warning('invalid events handler workers "%s"', workers)
+            workers = 1
+
+        if workers < 1:
+            logger.warning('insane events handler workers "%s"', workers)
+            workers = 1
+        self._workers = workers
 
     def handle_event(self, channel):
+        if self._batch_size > 1:
+            self.handle_event_batch(channel)
+            return
+
         config = self._config
         session = self._db_session_class()
         redis_connection = self._redis_connection
@@ -120,9 +210,154 @@ class EventsHandler(object):
             else:
                 time.sleep(0.5)
 
+    def pop_events(self, channel):
+        """Pop at most batch_size messages. Messages popped before an error are
+        returned, as they are already removed from the channel.
+        """
+        msgs = []
+        while len(msgs) < self._batch_size:
+            try:
+                msg = seafile_api.pop_event(channel)
+            except Exception as e:
+                if not msgs:
+                    raise
+                logger.error('Failed to get event: %s' % e)
+                break
+            if not msg:
+                break
+            msgs.append(msg)
+        return msgs
+
+    def handle_event_batch(self, channel):
+        config = self._config
+        session = self._db_session_class()
+        redis_connection = self._redis_connection
+        metric_prefix = channel.replace('.', '_').replace('-', '_')
+
+        handled_count = 0
+        batch_count = 0
+        batch_duration = 0
+        metric_start = time.time()
+        while 1:
+            try:
+                msgs = self.pop_events(channel)
+            except Exception as e:
+                logger.error('Failed to get event: %s' % e)
+                time.sleep(3)
+                continue
+
+            if msgs:
+                start = time.time()
+                try:
+                    message_handler.handle_messages(config, session, redis_connection, channel, msgs)
+                except Exception as e:
+                    logger.error(e)
+                finally:
+                    session.close()
+                handled_count += len(msgs)
+                batch_count += 1
+                batch_duration += time.time() - start
+            else:
+                time.sleep(0.5)
+
+            elapsed = time.time() - metric_start
+            if elapsed >= self._metric_interval:
+                publish_metric('%s_messages_per_second' % metric_prefix,
+                               round(handled_count / elapsed, 3),
+                               'Messages handled per second on channel %s' % channel)
+                publish_metric('%s_batch_latency_seconds' % metric_prefix,
+                               round(batch_duration / batch_count, 3) if batch_count else 0,
+                               'Average time to handle one batch of messages on channel %s' % channel)
+                handled_count = 0
+                batch_count = 0
+                batch_duration = 0
+                metric_start = time.time()
+
+    def get_shard(self, msg):
+        """Events of the same repo always go to the same shard so they are
+        handled in order, events without repo go by user.
+        """
+        try:
+            content = json.loads(msg.get('content'))
+        except Exception:
+            return 0
+
+        key = content.get('repo_id') or content.get('user_name') or ''
+        return zlib.crc32(key.encode('utf-8')) % self._workers
+
+    def handle_shard(self, channel, shard, shard_queue, shard_lags):
+        config = self._config
+        session = self._db_session_class()
+        redis_connection = self._redis_connection
+        while 1:
+            items = [shard_queue.get()]
+            while len(items) < self._batch_size:
+                try:
+                    items.append(shard_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            shard_lags[shard] = time.time() - items[0][1]
+            msgs = [msg for msg, _ in items]
+            try:
+                if self._batch_size > 1:
+                    message_handler.handle_messages(config, session, redis_connection, channel, msgs)
+                else:
+                    message_handler.handle_message(config, session, redis_connection, channel, msgs[0])
+            except Exception as e:
+                logger.error(e)
+            finally:
+                session.close()
+
+    def dispatch_event(self, channel):
+        metric_prefix = channel.replace('.', '_').replace('-', '_')
+        shard_queues = [queue.Queue(self._shard_queue_size) for _ in range(self._workers)]
+        shard_lags = [0] * self._workers
+        for shard, shard_queue in enumerate(shard_queues):
+            worker = Thread(target=self.handle_shard, args=(channel, shard, shard_queue, shard_lags))
+            worker.start()
+
+        metric_start = time.time()
+        while 1:
+            try:
+                msg = seafile_api.pop_event(channel)
+            except Exception as e:
+                logger.error('Failed to get event: %s' % e)
+                time.sleep(3)
+                continue
+
+            if msg:
+                # blocks when the shard is full, so a slow repo slows down reading
+                # the channel instead of growing memory without limit
+                shard_queues[self.get_shard(msg)].put((msg, time.time()))
+            else:
+                time.sleep(0.5)
+
+            if time.time() - metric_start >= self._metric_interval:
+                queue_depth = 0
+                for shard, shard_queue in enumerate(shard_queues):
+                    qsize = shard_queue.qsize()
+                    queue_depth += qsize
+                    if qsize == 0:
+                        shard_lags[shard] = 0
+                    publish_metric('%s_shard_%s_lag_seconds' % (metric_prefix, shard),
+                                   round(shard_lags[shard], 3),
+                                   'Time the last message waited in shard %s of channel %s' % (shard, channel))
+                publish_metric('%s_queue_depth' % metric_prefix, queue_depth,
+                               'Messages waiting in the shard queues of channel %s' % channel)
+                metric_start = time.time()
+
     def start(self):
+        activity_aggregator.start()
+        org_last_activity_time_writer.start()
         channels = message_handler.get_channels()
         logger.info('Subscribe to channels: %s', channels)
+        if self._batch_size > 1:
+            logger.info('Handle events in batches of at most %s messages', self._batch_size)
         for channel in channels:
-            event_handler = Thread(target=self.handle_event, args=(channel, ))
+            if self._workers > 1:
+                logger.info('Handle events of channel %s with %s workers', channel, self._workers)
+                event_handler = Thread(target=self.dispatch_event, args=(channel, ))
+            else:
+                event_handler = Thread(target=self.handle_event, args=(channel, ))
             event_handler.start()
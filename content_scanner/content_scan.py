@@ -11,6 +11,7 @@ from seafobj import CommitDiffer, commit_mgr, fs_mgr
 
 from .models import ContentScanRecord, ContentScanResult
 from seafevents.db import SeafBase, init_db_session_class
+from seafevents.utils.diff_cache import diff_cache
 
 ZERO_OBJ_ID = '0000000000000000000000000000000000000000'
 
@@ -152,7 +153,8 @@ class ContentScan(object):
         differ = CommitDiffer(repo_id, version, last_root_id, new_root_id,
                               True, False)
         added_files, deleted_files, added_dirs, deleted_dirs, modified_files,\
-        renamed_files, moved_files, renamed_dirs, moved_dirs = differ.diff()
+        renamed_files, moved_files, renamed_dirs, moved_dirs = \
+            diff_cache.get_or_diff('seafobj_rename', repo_id, last_root_id, new_root_id, differ.diff)
 
         # Handle renamed, moved and deleted files.
         stmt = select(ContentScanResult).where(ContentScanResult.repo_id == repo_id)
@@ -0,0 +1,174 @@
+import time
+import logging
+from threading import Thread, Event, Lock
+
+from seafevents.db import init_db_session_class
+from seafevents.events.db import save_user_activity, save_user_activities_bulk, BATCH_AGGREGATE_OP_TYPES, \
+    BATCH_AGGREGATE_TIME_THRESHOLD, ACTIVITY_MAX_AGGREGATE_ITEMS
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+from seafevents.utils.journal import Journal, parse_journal_datetime
+
+logger = logging.getLogger(__name__)
+
+# Failed saves of a buffer before its records are saved one by one
+ACTIVITY_FLUSH_MAX_TRIES = 5
+
+
+class ActivityAggregator(object):
+    """Aggregate create/delete activities in memory instead of in MySQL.
+
+    Records are buffered by (repo_id, op_user, obj_type, op_type) and every
+    buffer is saved as one (batch) activity once it is older than
+    BATCH_AGGREGATE_TIME_THRESHOLD minutes or holds ACTIVITY_MAX_AGGREGATE_ITEMS
+    items. Buffered records are journaled on local disk and loaded back on
+    startup, so a restart does not lose them.
+
+    A buffer which fails ACTIVITY_FLUSH_MAX_TRIES times is saved record by
+    record, and the records which still fail are moved to the
+    ``activity_aggregator.failed`` journal.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._buffers = {}
+        self._seq = 0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._journal = None
+        self._flusher = None
+
+    def init(self, config):
+        self._parse_config(config)
+        if not self.enabled:
+            return
+
+        self._journal = Journal('activity_aggregator')
+        records = self._journal.load()
+        for record in records:
+            record['timestamp'] = parse_journal_datetime(record['timestamp'])
+            self._buffer_record(record)
+        if records:
+            logger.info('Loaded %d buffered activities from %s', len(records), self._journal.path)
+
+    def _parse_config(self, config):
+        section_name = 'USER ACTIVITY'
+        enabled = get_opt_from_conf_or_env(config, section_name, 'aggregate_in_memory', default=False)
+        self.enabled = parse_bool(enabled)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._flusher = ActivityAggregateFlusher(self)
+        self._flusher.start()
+
+    def _set_aside(self, key, buffer):
+        """Keep ``buffer`` under a key of its own, so it is saved without
+        taking new records.
+        """
+        self._seq += 1
+        self._buffers[key + (self._seq,)] = buffer
+
+    def _buffer_record(self, record):
+        key = (record['repo_id'], record['op_user'], record['obj_type'], record['op_type'])
+        buffer = self._buffers.get(key)
+        if buffer is not None and len(buffer['records']) >= ACTIVITY_MAX_AGGREGATE_ITEMS:
+            # full after a replay of the journal or a failed save
+            self._set_aside(key, buffer)
+            buffer = None
+        if buffer is None:
+            buffer = {'start': time.time(), 'records': [], 'tries': 0}
+            self._buffers[key] = buffer
+        buffer['records'].append(record)
+        return key, len(buffer['records'])
+
+    def add(self, session, record):
+        """Buffer ``record``, return False if it can not be aggregated."""
+        if not self.enabled or record.get('op_type') not in BATCH_AGGREGATE_OP_TYPES:
+            return False
+
+        with self._lock:
+            self._journal.append(record)
+            key, count = self._buffer_record(record)
+
+        if count >= ACTIVITY_MAX_AGGREGATE_ITEMS:
+            self.flush(session, [key])
+        return True
+
+    def flush(self, session, keys):
+        with self._flush_lock:
+            with self._lock:
+                buffers = [(key, self._buffers.pop(key)) for key in keys if key in self._buffers]
+
+            failed = []
+            for key, buffer in buffers:
+                try:
+                    save_user_activities_bulk(session, buffer['records'])
+                except Exception as e:
+                    buffer['tries'] += 1
+                    logger.warning('Failed to save %d aggregated activities (try %d): %s',
+                                   len(buffer['records']), buffer['tries'], e)
+                    if buffer['tries'] >= ACTIVITY_FLUSH_MAX_TRIES:
+                        self._save_one_by_one(session, buffer['records'])
+                    else:
+                        failed.append((key, buffer))
+
+            with self._lock:
+                for key, buffer in failed:
+                    if key in self._buffers:
+                        # records were added while saving
+                        self._set_aside(key, buffer)
+                    else:
+                        self._buffers[key] = buffer
+                remaining = [r for b in self._buffers.values() for r in b['records']]
+                self._journal.rewrite(remaining)
+
+    def _save_one_by_one(self, session, records):
+        failed = []
+        for record in records:
+            try:
+                save_user_activity(session, record)
+            except Exception as e:
+                session.rollback()
+                logger.warning('Failed to save activity of %s: %s', record.get('path'), e)
+                failed.append(record)
+        if failed:
+            journal = Journal('activity_aggregator.failed')
+            try:
+                journal.append_many(failed)
+            finally:
+                journal.close()
+            logger.error('Moved %d activities which can not be saved to the failed journal', len(failed))
+
+    def flush_expired(self, session):
+        deadline = time.time() - BATCH_AGGREGATE_TIME_THRESHOLD * 60
+        with self._lock:
+            keys = [key for key, buffer in self._buffers.items() if buffer['start'] <= deadline]
+        if keys:
+            self.flush(session, keys)
+
+
+class ActivityAggregateFlusher(Thread):
+    def __init__(self, aggregator, interval=30):
+        Thread.__init__(self)
+        self._aggregator = aggregator
+        self._interval = interval
+        self._db_session_class = init_db_session_class()
+        self.finished = Event()
+
+    def run(self):
+        while not self.finished.is_set():
+            self.finished.wait(self._interval)
+            if self.finished.is_set():
+                break
+            session = self._db_session_class()
+            try:
+                self._aggregator.flush_expired(session)
+            except Exception as e:
+                logger.exception('Failed to flush aggregated activities: %s', e)
+            finally:
+                session.close()
+
+    def cancel(self):
+        self.finished.set()
+
+
+activity_aggregator = ActivityAggregator()
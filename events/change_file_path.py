@@ -24,6 +24,77 @@ class ChangeFilePathHandler(object):
         self.change_upload_share_file_path(dst_repo_id, path, new_path, is_dir, src_repo_id)
         self.change_starred_file_path(dst_repo_id, path, new_path, is_dir, src_repo_id)
 
+    def update_db_records_in_bulk(self, repo_id, entries, src_repo_id=None):
+        """Rewrite the paths of all renamed/moved entries of one commit in one transaction.
+
+        ``entries`` is a list of (path, new_path, is_dir). Every table is updated with
+        one prefix-replacing UPDATE per entry instead of one UPDATE per matching row.
+        Falls back to update_db_records if the bulk rewrite fails.
+        """
+        merged = []
+        seen = set()
+        for path, new_path, is_dir in entries:
+            if not path or not new_path or path == new_path or path in seen:
+                continue
+            seen.add(path)
+            merged.append((path, new_path, is_dir))
+        if not repo_id or not merged:
+            return
+
+        try:
+            for path, new_path, is_dir in merged:
+                self._rewrite_file_uuid_map(repo_id, path, new_path, is_dir, src_repo_id)
+                for table in ('share_fileshare', 'share_uploadlinkshare', 'base_userstarredfiles'):
+                    self._rewrite_path(table, repo_id, path, new_path, src_repo_id)
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            logger.warning('Failed to rewrite paths of %d entries in bulk for repo %s, %s.' % (len(merged), repo_id, e))
+            for path, new_path, is_dir in merged:
+                self.update_db_records(repo_id, path, new_path, is_dir, src_repo_id)
+
+    def _escape_like(self, value):
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def _rewrite_path(self, table, repo_id, path, new_path, src_repo_id=None):
+        # update old path and subdir records, e.g.
+        # old_path: /old_path/t, new_path: /new_path/t
+        # /old_path/t -> /new_path/t, /old_path/t/q -> /new_path/t/q, /old_path/t1 is not changed
+        self.session.execute(text('update %s set repo_id=:new_repo_id, '
+                                  'path=concat(:new_path, substring(path, :path_len + 1)) '
+                                  'where repo_id=:old_repo_id and (path=:path or path like :sub_path)' % table),
+                             {'new_repo_id': repo_id, 'new_path': new_path, 'path_len': len(path),
+                              'old_repo_id': src_repo_id if src_repo_id else repo_id, 'path': path,
+                              'sub_path': self._escape_like(path + '/') + '%'})
+
+    def _rewrite_file_uuid_map(self, repo_id, path, new_path, is_dir, src_repo_id=None):
+        old_dir, old_file = os.path.split(path)
+        new_dir, new_file = os.path.split(new_path)
+        old_repo_id = src_repo_id if src_repo_id else repo_id
+
+        # update old path itself
+        self.session.execute(text('update tags_fileuuidmap set repo_id=:new_repo_id, parent_path=:new_dir, filename=:new_file, '
+                                  'repo_id_parent_path_md5=:new_md5 where '
+                                  'repo_id_parent_path_md5=:old_md5 and filename=:filename and is_dir=:is_dir'),
+                             {'new_repo_id': repo_id, 'new_dir': new_dir, 'new_file': new_file,
+                              'new_md5': self.md5_repo_id_parent_path(repo_id, new_dir),
+                              'old_md5': self.md5_repo_id_parent_path(old_repo_id, old_dir),
+                              'filename': old_file, 'is_dir': is_dir})
+
+        # sub-dir #
+        # MySQL evaluates the assignments from left to right, so the md5 is computed
+        # from the old parent_path before parent_path is changed.
+        if is_dir:
+            self.session.execute(text('update tags_fileuuidmap set '
+                                      'repo_id_parent_path_md5=md5(concat(:new_repo_id, trim(trailing \'/\' from '
+                                      'concat(:new_path, substring(parent_path, :path_len + 1))))), '
+                                      'parent_path=concat(:new_path, substring(parent_path, :path_len + 1)), '
+                                      'repo_id=:new_repo_id '
+                                      'where repo_id=:old_repo_id and (parent_path=:path or parent_path like :sub_path)'),
+                                 {'new_repo_id': repo_id, 'new_path': new_path, 'path_len': len(path),
+                                  'old_repo_id': old_repo_id, 'path': path,
+                                  'sub_path': self._escape_like(path + '/') + '%'})
+
     def change_share_file_path(self, repo_id, path, new_path, is_dir, src_repo_id=None):
         try:
             self._change_share_file_path(repo_id, path, new_path, is_dir, src_repo_id)
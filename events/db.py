@@ -5,7 +5,7 @@ import datetime
 from datetime import timedelta
 import hashlib
 
-from sqlalchemy import desc, select, update, func, and_, delete, join
+from sqlalchemy import desc, select, update, func, and_, delete, join, insert
 from sqlalchemy.sql import exists
 
 from .models import FileAudit, FileUpdate, PermAudit, \
@@ -317,10 +317,12 @@ def _extract_detail_item(detail_dict):
             item[key] = detail_dict[key]
     return item
     
-def _update_batch_activity(session, activity, new_record):
-    """Append new operation to existing aggregated record"""
+def _append_batch_activity(session, activity, new_records):
+    """Append operations to an existing aggregated record without committing,
+    return how many of ``new_records`` fit into it.
+    """
     # 1. Determine op_type (convert to batch type if not already)
-    base_op_type = new_record['op_type']
+    base_op_type = new_records[0]['op_type']
     new_op_type = f'batch_{base_op_type}' if not activity.op_type.startswith('batch_') else activity.op_type
     
     # 2. Parse existing detail field
@@ -331,10 +333,11 @@ def _update_batch_activity(session, activity, new_record):
 
     # 3. Convert to array format (if not already)
     detail_array = [_extract_detail_item(current_detail)] if isinstance(current_detail, dict) else current_detail
-    if len(detail_array) >= ACTIVITY_MAX_AGGREGATE_ITEMS:
-        raise Exception(f"Too many items aggregated in Activity.detail")
-    new_detail_item = _extract_detail_item(new_record)
-    detail_array.append(new_detail_item)
+    new_records = new_records[:ACTIVITY_MAX_AGGREGATE_ITEMS - len(detail_array)]
+    if not new_records:
+        return 0
+    detail_array.extend(_extract_detail_item(r) for r in new_records)
+    timestamp = new_records[-1]['timestamp']
     
     # 5. Update database record
     stmt = (
@@ -342,7 +345,7 @@ def _update_batch_activity(session, activity, new_record):
         .where(Activity.id == activity.id)
         .values(
             op_type=new_op_type,
-            timestamp=new_record['timestamp'],
+            timestamp=timestamp,
             detail=json.dumps(detail_array)
         )
     )
@@ -352,10 +355,16 @@ def _update_batch_activity(session, activity, new_record):
     user_activity_stmt = (
         update(UserActivity)
         .where(UserActivity.activity_id == activity.id)
-        .values(timestamp=new_record['timestamp'])
+        .values(timestamp=timestamp)
     )
     session.execute(user_activity_stmt)
-    
+    return len(new_records)
+
+
+def _update_batch_activity(session, activity, new_record):
+    """Append new operation to existing aggregated record"""
+    if not _append_batch_activity(session, activity, [new_record]):
+        raise Exception(f"Too many items aggregated in Activity.detail")
     session.commit()
 
 
@@ -387,6 +396,165 @@ def save_user_activity(session, record):
         session.add(user_activity)
     session.commit()
 
+ACTIVITY_BULK_INSERT_CHUNK = 500
+USER_ACTIVITY_BULK_INSERT_CHUNK = 1000
+
+
+def _insert_rows_get_ids(session, model, rows):
+    """Insert rows of one repo and commit with a multi-row INSERT, return their ids
+    in the order of ``rows``.
+
+    The rows are found again by repo_id and commit_id from the first inserted
+    id, so the activities of a commit must not be saved by two workers at the
+    same time. Events are sharded by repo_id (see EventsHandler), and a commit
+    saved again later only has ids lower than the new rows. The rows found are
+    checked against ``rows`` so an overlapping save fails instead of fanning
+    out to the activities of the other one.
+    """
+    result = session.execute(insert(model.__table__).values(rows))
+
+    # MySQL reports the id of the first row of a multi-row INSERT, the
+    # ids of one statement are increasing in VALUES order.
+    stmt = (
+        select(model.id, model.op_type, model.path)
+        .where(
+            model.id >= result.lastrowid,
+            model.repo_id == rows[0]['repo_id'],
+            model.commit_id == rows[0]['commit_id']
+        )
+        .order_by(model.id)
+        .limit(len(rows))
+    )
+    found = session.execute(stmt).all()
+    if len(found) != len(rows):
+        raise RuntimeError('inserted %d rows into %s but found %d' % (len(rows), model.__tablename__, len(found)))
+    for row, (_, op_type, path) in zip(rows, found):
+        if (row['op_type'], row['path']) != (op_type, path):
+            raise RuntimeError('rows of commit %s were inserted into %s concurrently' %
+                               (rows[0]['commit_id'], model.__tablename__))
+    return [row_id for row_id, _, _ in found]
+
+
+def _split_rows_by_commit(rows, chunk_size):
+    """Return the (start, end) of the runs of ``rows`` of the same repo and
+    commit, at most ``chunk_size`` long, as _insert_rows_get_ids needs.
+    """
+    ranges = []
+    start = 0
+    for i in range(1, len(rows) + 1):
+        if i == len(rows) or i - start >= chunk_size or \
+                (rows[i]['repo_id'], rows[i]['commit_id']) != (rows[start]['repo_id'], rows[start]['commit_id']):
+            ranges.append((start, i))
+            start = i
+    return ranges
+
+
+def _merge_recent_batch_activities(session, records):
+    """Append create/delete records to the batch activities saved in the last
+    BATCH_AGGREGATE_TIME_THRESHOLD minutes, as save_user_activity does, and
+    return the records left to insert.
+    """
+    keys = {}
+    for record in records:
+        op_type = record.get('op_type', '')
+        if op_type in BATCH_AGGREGATE_OP_TYPES:
+            keys.setdefault((record['op_user'], record['obj_type'], op_type), []).append(record)
+
+    merged = set()
+    for (op_user, obj_type, op_type), key_records in keys.items():
+        recent_activity = _find_recent_batch_activity(session, key_records[0]['repo_id'],
+                                                      op_user, obj_type, op_type)
+        if not recent_activity:
+            continue
+        try:
+            count = _append_batch_activity(session, recent_activity, key_records)
+        except Exception as e:
+            logger.warning('Failed to aggregate activity, creating new record: %s', e)
+            continue
+        merged.update(id(r) for r in key_records[:count])
+
+    return [r for r in records if id(r) not in merged]
+
+
+def _build_bulk_activities(records):
+    """Build Activity rows for records of one commit.
+
+    Create/delete records of the same user and object type are aggregated into
+    batch activities of at most ACTIVITY_MAX_AGGREGATE_ITEMS items, the same way
+    save_user_activity would aggregate them one by one.
+    """
+    groups = []
+    open_batches = {}
+    for record in records:
+        op_type = record.get('op_type', '')
+        if op_type in BATCH_AGGREGATE_OP_TYPES:
+            key = (record['op_user'], record['obj_type'], op_type)
+            batch = open_batches.get(key)
+            if batch is None or len(batch) >= ACTIVITY_MAX_AGGREGATE_ITEMS:
+                batch = []
+                open_batches[key] = batch
+                groups.append(batch)
+            batch.append(record)
+        else:
+            groups.append([record])
+
+    rows = []
+    for group in groups:
+        activity = Activity(group[0])
+        if len(group) > 1:
+            activity.op_type = f'batch_{group[0]["op_type"]}'
+            activity.timestamp = group[-1]['timestamp']
+            activity.detail = json.dumps([_extract_detail_item(r) for r in group])
+        rows.append({
+            'op_type': activity.op_type,
+            'op_user': activity.op_user,
+            'obj_type': activity.obj_type,
+            'timestamp': activity.timestamp,
+            'repo_id': activity.repo_id,
+            'commit_id': activity.commit_id,
+            'path': activity.path,
+            'detail': activity.detail,
+        })
+
+    return rows, [group[0]['related_users'] for group in groups]
+
+
+def save_user_activities_bulk(session, records):
+    """Save activity records in one transaction, usually the ones generated
+    from one commit. Records of several commits are inserted commit by commit.
+
+    Create/delete records are first appended to a recent batch activity of the
+    same user like save_user_activity does. The other Activity rows are written
+    with multi-row INSERTs and the UserActivity fan-out with chunked executemany
+    batches.
+    """
+    if not records:
+        return
+
+    user_activity_rows = []
+    try:
+        records = _merge_recent_batch_activities(session, records)
+        rows, related_users = _build_bulk_activities(records)
+        for i, j in _split_rows_by_commit(rows, ACTIVITY_BULK_INSERT_CHUNK):
+            chunk = rows[i: j]
+            activity_ids = _insert_rows_get_ids(session, Activity, chunk)
+            for k, activity_id in enumerate(activity_ids):
+                row = chunk[k]
+                for username in related_users[i + k][:USER_ACTIVITIES_GENERATE_LIMIT]:
+                    user_activity_rows.append({
+                        'username': username,
+                        'activity_id': activity_id,
+                        'timestamp': row['timestamp'],
+                    })
+
+        for i in range(0, len(user_activity_rows), USER_ACTIVITY_BULK_INSERT_CHUNK):
+            session.execute(insert(UserActivity.__table__),
+                            user_activity_rows[i: i + USER_ACTIVITY_BULK_INSERT_CHUNK])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
 def save_repo_trash(session, record):
     repo_trash = FileTrash(record)
     session.add(repo_trash)
@@ -488,6 +656,118 @@ def save_filehistory(session, fh_threshold, record):
     session.commit()
 
 
+FILE_HISTORY_QUERY_CHUNK = 1000
+
+
+def _path_md5(repo_id, path):
+    return hashlib.md5((repo_id + path).encode('utf8')).hexdigest()
+
+def _prev_record_key(record):
+    if record['op_type'] in ['rename', 'move']:
+        return _path_md5(record['repo_id'], record['old_path'])
+    return _path_md5(record['repo_id'], record['path'])
+
+def _query_latest_file_histories(session, column, values):
+    """Return {value: item} of the latest FileHistory row for each value of ``column``,
+    by timestamp like query_prev_record.
+    """
+    items = {}
+    values = list(values)
+    for i in range(0, len(values), FILE_HISTORY_QUERY_CHUNK):
+        latest = select(column.label('value'), func.max(FileHistory.timestamp).label('timestamp')).\
+            where(column.in_(values[i: i + FILE_HISTORY_QUERY_CHUNK])).group_by(column).subquery()
+        stmt = select(FileHistory.id, FileHistory.op_type, FileHistory.op_user, FileHistory.timestamp,
+                      FileHistory.path, FileHistory.file_uuid, FileHistory.repo_id_path_md5).\
+            join(latest, and_(column == latest.c.value, FileHistory.timestamp == latest.c.timestamp))
+        for row in session.execute(stmt).all():
+            value = row.file_uuid if column is FileHistory.file_uuid else row.repo_id_path_md5
+            # rows of the same timestamp, keep the last inserted one
+            if value in items and items[value]['id'] > row.id:
+                continue
+            items[value] = {'id': row.id, 'op_type': row.op_type, 'op_user': row.op_user,
+                            'timestamp': row.timestamp, 'path': row.path, 'file_uuid': row.file_uuid}
+    return items
+
+def save_filehistories(session, fh_threshold, records):
+    """Save the file history records of one commit, same as calling
+    save_filehistory for each record, with a constant number of queries.
+    """
+    if not records:
+        return
+
+    # resolve the previous records of all paths at once
+    keys = set(_prev_record_key(r) for r in records if r['op_type'] != 'create')
+    latest = _query_latest_file_histories(session, FileHistory.repo_id_path_md5, keys) if keys else {}
+
+    # The restore operation may not be the last record to be restored, so you need to switch to the last record
+    latest_by_uuid = {}
+    recover_uuids = set()
+    for record in records:
+        if record['op_type'] == 'recover':
+            prev_item = latest.get(_prev_record_key(record))
+            if prev_item:
+                recover_uuids.add(prev_item['file_uuid'])
+    if recover_uuids:
+        latest_by_uuid = _query_latest_file_histories(session, FileHistory.file_uuid, recover_uuids)
+
+    dt = datetime.datetime.utcnow()
+    delta = timedelta(minutes=fh_threshold)
+    new_rows = []
+    updates = []
+    for record in records:
+        prev_item = None
+        if record['op_type'] != 'create':
+            prev_item = latest.get(_prev_record_key(record))
+            if prev_item and record['op_type'] == 'recover':
+                prev_item = latest_by_uuid.get(prev_item['file_uuid'], prev_item)
+
+        if prev_item:
+            # If a file was edited many times in a few minutes, just update timestamp.
+            if record['op_type'] == 'edit' and prev_item['op_type'] == 'edit' \
+                                           and prev_item['op_user'] == record['op_user'] \
+                                           and prev_item['timestamp'] > dt - delta:
+                values = {'timestamp': record['timestamp'], 'file_id': record['obj_id'],
+                          'commit_id': record['commit_id'], 'size': record['size']}
+                if prev_item['id'] is None:
+                    prev_item['row'].update(values)
+                else:
+                    updates.append(dict(values, id=prev_item['id']))
+                prev_item['timestamp'] = record['timestamp']
+                continue
+
+            if record['path'] != prev_item['path'] and record['op_type'] == 'recover':
+                pass
+            else:
+                record['file_uuid'] = prev_item['file_uuid']
+
+        if 'file_uuid' not in record:
+            # uuid4 collisions are not a practical concern, no need to probe the table
+            record['file_uuid'] = str(uuid.uuid4())
+
+        history = FileHistory(record)
+        row = {'op_type': history.op_type, 'op_user': history.op_user, 'timestamp': history.timestamp,
+               'repo_id': history.repo_id, 'commit_id': history.commit_id, 'file_id': history.file_id,
+               'file_uuid': history.file_uuid, 'path': history.path,
+               'repo_id_path_md5': history.repo_id_path_md5, 'size': history.size,
+               'old_path': history.old_path}
+        item = {'id': None, 'op_type': history.op_type, 'op_user': history.op_user,
+                'timestamp': history.timestamp, 'path': history.path, 'file_uuid': history.file_uuid,
+                'row': row}
+        new_rows.append(row)
+        latest[history.repo_id_path_md5] = item
+        latest_by_uuid[history.file_uuid] = item
+
+    try:
+        if updates:
+            session.execute(update(FileHistory), updates)
+        for i in range(0, len(new_rows), FILE_HISTORY_QUERY_CHUNK):
+            session.execute(insert(FileHistory.__table__).values(new_rows[i: i + FILE_HISTORY_QUERY_CHUNK]))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
 def save_file_update_event(session, timestamp, user, org_id, repo_id,
                            commit_id, file_oper):
     if timestamp is None:
@@ -497,17 +777,18 @@ def save_file_update_event(session, timestamp, user, org_id, repo_id,
     session.add(event)
     session.commit()
 
-def get_events(session, obj, username, org_id, repo_id, file_path, start, limit):
-    if start < 0:
-        logger.error('start must be non-negative')
-        raise RuntimeError('start must be non-negative')
+def save_file_update_events(session, events):
+    """Save a batch of file update events in one transaction.
 
-    if limit <= 0:
-        logger.error('limit must be positive')
-        raise RuntimeError('limit must be positive')
+    ``events`` is a list of (timestamp, user, org_id, repo_id, commit_id, file_oper).
+    """
+    if not events:
+        return
 
-    stmt = select(obj)
+    session.add_all([FileUpdate(*event) for event in events])
+    session.commit()
 
+def _filter_events(stmt, obj, username, org_id, repo_id, file_path):
     if username is not None:
         if hasattr(obj, 'user'):
             stmt = stmt.where(obj.user == username)
@@ -525,12 +806,64 @@ def get_events(session, obj, username, org_id, repo_id, file_path, start, limit)
     elif org_id < 0:
         stmt = stmt.where(obj.org_id == -1)
 
+    return stmt
+
+def get_events(session, obj, username, org_id, repo_id, file_path, start, limit):
+    if start < 0:
+        logger.error('start must be non-negative')
+        raise RuntimeError('start must be non-negative')
+
+    if limit <= 0:
+        logger.error('limit must be positive')
+        raise RuntimeError('limit must be positive')
+
+    stmt = _filter_events(select(obj), obj, username, org_id, repo_id, file_path)
     stmt = stmt.order_by(desc(obj.eid)).slice(start, start + limit)
 
     events = session.scalars(stmt).all()
 
     return events
 
+def _get_page_by_cursor(session, stmt, obj, cursor, limit):
+    if cursor is not None:
+        stmt = stmt.where(obj.eid < cursor)
+    stmt = stmt.order_by(desc(obj.eid)).limit(limit)
+
+    events = session.scalars(stmt).all()
+    next_cursor = events[-1].eid if len(events) == limit else None
+
+    return events, next_cursor
+
+def get_events_by_cursor(session, obj, username, org_id, repo_id, file_path, cursor, limit):
+    """Keyset pagination of the events, newest first.
+
+    ``cursor`` is None for the first page, then the ``next_cursor`` returned
+    by the previous page, which is None after the last page. Unlike ``start``
+    of get_events, the cost does not grow with the page depth.
+    """
+    if cursor is not None and cursor <= 0:
+        logger.error('cursor must be positive')
+        raise RuntimeError('cursor must be positive')
+
+    if limit <= 0:
+        logger.error('limit must be positive')
+        raise RuntimeError('limit must be positive')
+
+    stmt = _filter_events(select(obj), obj, username, org_id, repo_id, file_path)
+    return _get_page_by_cursor(session, stmt, obj, cursor, limit)
+
+def get_file_update_events_by_cursor(session, user, org_id, repo_id, cursor, limit):
+    return get_events_by_cursor(session, FileUpdate, user, org_id, repo_id, None, cursor, limit)
+
+def get_file_audit_events_by_cursor(session, user, org_id, repo_id, cursor, limit):
+    return get_events_by_cursor(session, FileAudit, user, org_id, repo_id, None, cursor, limit)
+
+def get_file_audit_events_by_path_and_cursor(session, user, org_id, repo_id, file_path, cursor, limit):
+    return get_events_by_cursor(session, FileAudit, user, org_id, repo_id, file_path, cursor, limit)
+
+def get_perm_audit_events_by_cursor(session, from_user, org_id, repo_id, cursor, limit):
+    return get_events_by_cursor(session, PermAudit, from_user, org_id, repo_id, None, cursor, limit)
+
 def get_file_update_events(session, user, org_id, repo_id, start, limit):
     return get_events(session, FileUpdate, user, org_id, repo_id, None, start, limit)
 
@@ -562,6 +895,28 @@ def save_perm_audit_event(session, timestamp, etype, from_user, to,
     session.add(perm_audit)
     session.commit()
 
+def save_file_audit_events(session, events):
+    """Save a batch of file audit events in one transaction.
+
+    ``events`` is a list of (timestamp, etype, user, ip, device, org_id, repo_id, file_path).
+    """
+    if not events:
+        return
+
+    session.add_all([FileAudit(*event) for event in events])
+    session.commit()
+
+def save_perm_audit_events(session, events):
+    """Save a batch of permission audit events in one transaction.
+
+    ``events`` is a list of (timestamp, etype, from_user, to, org_id, repo_id, file_path, perm).
+    """
+    if not events:
+        return
+
+    session.add_all([PermAudit(*event) for event in events])
+    session.commit()
+
 def get_perm_audit_events(session, from_user, org_id, repo_id, start, limit):
     return get_events(session, PermAudit, from_user, org_id, repo_id, None, start, limit)
 
@@ -581,13 +936,14 @@ def get_events_by_time(session, log_type, tstart, tend):
     else:
         obj = PermAudit
 
+    # a plain range on timestamp, so only the partitions of these months are read
     stmt = select(obj).where(obj.timestamp.between(datetime.datetime.utcfromtimestamp(tstart),
                                                    datetime.datetime.utcfromtimestamp(tend)))
     res = session.scalars(stmt).all()
 
     return res
 
-def get_events_by_users_and_repos(session, log_type, emails, repo_ids, start, limit):
+def _filter_events_by_users_and_repos(log_type, emails, repo_ids):
     if log_type not in ('file_update', 'file_audit', 'perm_audit'):
         logger.error('Invalid log_type parameter')
         raise RuntimeError('Invalid log_type parameter')
@@ -611,8 +967,23 @@ def get_events_by_users_and_repos(session, log_type, emails, repo_ids, start, li
     
     if repo_ids:
         stmt = stmt.where(obj.repo_id.in_(repo_ids))
-    
+
+    return obj, stmt
+
+def get_events_by_users_and_repos(session, log_type, emails, repo_ids, start, limit):
+    obj, stmt = _filter_events_by_users_and_repos(log_type, emails, repo_ids)
     stmt = stmt.order_by(desc(obj.eid)).slice(start, start + limit)
     res = session.scalars(stmt).all()
 
     return res
+
+def get_events_by_users_and_repos_by_cursor(session, log_type, emails, repo_ids, cursor, limit):
+    """Keyset pagination version of get_events_by_users_and_repos, see
+    get_events_by_cursor. Return (events, next_cursor).
+    """
+    if limit <= 0:
+        logger.error('limit must be positive')
+        raise RuntimeError('limit must be positive')
+
+    obj, stmt = _filter_events_by_users_and_repos(log_type, emails, repo_ids)
+    return _get_page_by_cursor(session, stmt, obj, cursor, limit)
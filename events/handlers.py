@@ -12,19 +12,23 @@ from os.path import splitext
 
 from seafevents.app.cache_provider import cache
 from sqlalchemy import select, text, desc, func
-from sqlalchemy.exc import NoResultFound
 import pymysql
 
 from seaserv import get_org_id_by_repo_id, seafile_api, get_commit
 from seafobj import CommitDiffer, commit_mgr, fs_mgr
 from seafobj.commit_differ import DiffEntry
 from seafevents.events.db import save_file_audit_event, save_file_update_event, \
-        save_perm_audit_event, save_user_activity, save_filehistory, update_user_activity_timestamp, \
-        save_repo_trash, restore_repo_trash
+        save_perm_audit_event, save_file_audit_events, save_file_update_events, \
+        save_perm_audit_events, save_user_activity, save_user_activities_bulk, \
+        save_filehistory, save_filehistories, update_user_activity_timestamp, save_repo_trash, \
+        restore_repo_trash
 from seafevents.app.config import TIME_ZONE
-from seafevents.utils import get_opt_from_conf_or_env
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+from seafevents.utils.diff_cache import diff_cache
 from .change_file_path import ChangeFilePathHandler
-from .models import Activity, FileTrash, OrgLastActivityTime
+from .activity_aggregator import activity_aggregator
+from .repo_context_cache import repo_context_cache, org_last_activity_time_writer
+from .models import Activity, FileTrash
 from seafevents.batch_delete_files_notice.utils import get_deleted_files_count, save_deleted_files_msg
 from seafevents.batch_delete_files_notice.db import get_deleted_files_total_count, save_deleted_files_count
 
@@ -65,12 +69,24 @@ def RepoUpdateEventHandler(config, session, msg):
             description = commit.description
             if description.startswith('Deleted') and 'more' in description:
                 differ = CommitDiffer(repo_id, commit.version, parent.root_id, commit.root_id, False, False)
+                diff_kind = 'seafobj'
             else:
                 differ = CommitDiffer(repo_id, commit.version, parent.root_id, commit.root_id, True, True)
+                diff_kind = 'seafobj_rename_fold'
             added_files, deleted_files, added_dirs, deleted_dirs, modified_files, \
-            renamed_files, moved_files, renamed_dirs, moved_dirs = differ.diff()
+            renamed_files, moved_files, renamed_dirs, moved_dirs = \
+                diff_cache.get_or_diff(diff_kind, repo_id, parent.root_id, commit.root_id, differ.diff)
 
-            if renamed_files or renamed_dirs or moved_files or moved_dirs:
+            bulk_update = False
+            if config.has_option('CHANGE FILE PATH', 'bulk_update'):
+                bulk_update = config.getboolean('CHANGE FILE PATH', 'bulk_update')
+
+            if (renamed_files or renamed_dirs or moved_files or moved_dirs) and bulk_update:
+                changer = ChangeFilePathHandler(session)
+                entries = [(de.path, de.new_path, 0) for de in renamed_files + moved_files] + \
+                          [(de.path, de.new_path, 1) for de in renamed_dirs + moved_dirs]
+                changer.update_db_records_in_bulk(repo_id, entries)
+            elif renamed_files or renamed_dirs or moved_files or moved_dirs:
                 changer = ChangeFilePathHandler(session)
                 for r_file in renamed_files:
                     changer.update_db_records(repo_id, r_file.path, r_file.new_path, 0)
@@ -81,21 +97,9 @@ def RepoUpdateEventHandler(config, session, msg):
                 for m_dir in moved_dirs:
                     changer.update_db_records(repo_id, m_dir.path, m_dir.new_path, 1)
 
-            users = []
-            org_id = get_org_id_by_repo_id(repo_id)
+            org_id, owner, users = repo_context_cache.get_repo_context(repo_id)
             if org_id > 0:
-                try:
-                    org_last_activity_time = session.query(OrgLastActivityTime).filter_by(org_id=org_id).one()
-                    org_last_activity_time.timestamp = datetime.datetime.now()
-                except NoResultFound:
-                    org_last_activity_time = OrgLastActivityTime(org_id, datetime.datetime.now())
-                    session.add(org_last_activity_time)
-                session.commit()
-                users = seafile_api.org_get_shared_users_by_repo(org_id, repo_id)
-                owner = seafile_api.get_org_repo_owner(repo_id)
-            else:
-                users = seafile_api.get_shared_users_by_repo(repo_id)
-                owner = seafile_api.get_repo_owner(repo_id)
+                org_last_activity_time_writer.update(session, org_id)
 
             if owner not in users:
                 users = users + [owner]
@@ -121,7 +125,10 @@ def RepoUpdateEventHandler(config, session, msg):
                         moved_files, renamed_dirs, moved_dirs, commit, repo_id,
                         parent, users, time)
 
-                save_user_activities(session, records)
+                bulk_insert = False
+                if config.has_option('USER ACTIVITY', 'bulk_insert'):
+                    bulk_insert = config.getboolean('USER ACTIVITY', 'bulk_insert')
+                save_user_activities(session, records, bulk_insert)
                 save_repo_trashs(session, trash_records)
                 # save repo monitor recodes
                 records = generate_repo_monitor_records(repo_id, commit,
@@ -572,9 +579,14 @@ def save_message_to_user_notification(session, records):
         session.execute(text(sql))
         session.commit()
 
-def save_user_activities(session, records):
+def save_user_activities(session, records, bulk_insert=False):
+    if activity_aggregator.enabled:
+        records = [r for r in records if not activity_aggregator.add(session, r)]
     if not records:
         return
+    if bulk_insert and len(records) > 1:
+        save_user_activities_bulk(session, records)
+        return
     # If a file was edited many times by same user in 30 minutes, just update timestamp.
     if len(records) == 1 and records[0]['op_type'] == 'edit':
         record = records[0]
@@ -917,9 +929,13 @@ def generate_filehistory_records(added_files, deleted_files, added_dirs,
 def save_file_histories(config, session, records):
     if not isinstance(records, list):
         return
+    fh_threshold = int(get_opt_from_conf_or_env(config, 'FILE HISTORY', 'threshold', default=5))
+    batch_write = parse_bool(get_opt_from_conf_or_env(config, 'FILE HISTORY', 'batch_write', default=False))
+    if batch_write:
+        save_filehistories(session, fh_threshold, [r for r in records if should_record(config, r)])
+        return
     for record in records:
         if should_record(config, record):
-            fh_threshold = int(get_opt_from_conf_or_env(config, 'FILE HISTORY', 'threshold', default=5))
             save_filehistory(session, fh_threshold, record)
 
 
@@ -935,18 +951,18 @@ def should_record(config, record):
     return False
 
 
-def FileUpdateEventHandler(config, session, msg):
+def _parse_file_update_event(msg):
     try:
         elements = json.loads(msg['content'])
     except:
         logging.warning("got bad message: %s", msg)
-        return
+        return None
 
     repo_id = elements.get('repo_id')
     commit_id = elements.get('commit_id')
     if not repo_id or not commit_id:
         logging.debug("repo_id: %s, or commit_id: %s invalid.", repo_id, commit_id)
-        return
+        return None
 
     org_id = get_org_id_by_repo_id(repo_id)
 
@@ -954,21 +970,30 @@ def FileUpdateEventHandler(config, session, msg):
     if commit is None:
         commit = get_commit(repo_id, 0, commit_id)
         if commit is None:
-            return
+            return None
 
     time = datetime.datetime.utcfromtimestamp(msg['ctime'])
     creator_name = getattr(commit, 'creator_name', '')
     if creator_name is None:
         creator_name = ''
-    save_file_update_event(session, time, creator_name, org_id,
-                           repo_id, commit_id, commit.desc)
+    return (time, creator_name, org_id, repo_id, commit_id, commit.desc)
 
-def FileAuditEventHandler(config, session, msg):
+def FileUpdateEventHandler(config, session, msg):
+    event = _parse_file_update_event(msg)
+    if event is None:
+        return
+    save_file_update_event(session, *event)
+
+def FileUpdateEventBatchHandler(config, session, msgs):
+    events = [_parse_file_update_event(msg) for msg in msgs]
+    save_file_update_events(session, [e for e in events if e is not None])
+
+def _parse_file_audit_event(msg):
     try:
         elements = json.loads(msg['content'])
     except:
         logging.warning("got bad message: %s", msg)
-        return
+        return None
 
     timestamp = datetime.datetime.utcfromtimestamp(msg['ctime'])
     msg_type = elements.get('msg_type')
@@ -982,15 +1007,24 @@ def FileAuditEventHandler(config, session, msg):
 
     org_id = get_org_id_by_repo_id(repo_id)
 
-    save_file_audit_event(session, timestamp, msg_type, user_name, ip,
-                          user_agent, org_id, repo_id, file_path)
+    return (timestamp, msg_type, user_name, ip, user_agent, org_id, repo_id, file_path)
 
-def PermAuditEventHandler(config, session, msg):
+def FileAuditEventHandler(config, session, msg):
+    event = _parse_file_audit_event(msg)
+    if event is None:
+        return
+    save_file_audit_event(session, *event)
+
+def FileAuditEventBatchHandler(config, session, msgs):
+    events = [_parse_file_audit_event(msg) for msg in msgs]
+    save_file_audit_events(session, [e for e in events if e is not None])
+
+def _parse_perm_audit_event(msg):
     try:
         elements = json.loads(msg['content'])
     except:
         logging.warning("got bad message: %s", msg)
-        return
+        return None
 
     timestamp = datetime.datetime.utcfromtimestamp(msg['ctime'])
     etype = elements.get('etype')
@@ -1002,12 +1036,35 @@ def PermAuditEventHandler(config, session, msg):
 
     org_id = get_org_id_by_repo_id(repo_id)
 
-    save_perm_audit_event(session, timestamp, etype, from_user, to,
-                          org_id, repo_id, file_path, perm)
+    return (timestamp, etype, from_user, to, org_id, repo_id, file_path, perm)
+
+def PermAuditEventHandler(config, session, msg):
+    event = _parse_perm_audit_event(msg)
+    if event is None:
+        return
+    save_perm_audit_event(session, *event)
+
+def PermAuditEventBatchHandler(config, session, msgs):
+    events = [_parse_perm_audit_event(msg) for msg in msgs]
+    save_perm_audit_events(session, [e for e in events if e is not None])
+
+
+def RepoContextInvalidateHandler(config, session, msg):
+    try:
+        elements = json.loads(msg['content'])
+    except:
+        logging.warning("got bad message: %s", msg)
+        return
+
+    repo_id = elements.get('repo_id')
+    if repo_id:
+        repo_context_cache.invalidate(repo_id)
 
 
 def register_handlers(handlers, enable_audit):
     handlers.add_handler('seaf_server.event:repo-update', RepoUpdateEventHandler)
+    if repo_context_cache.enabled:
+        handlers.add_handler('seahub.audit:perm-change', RepoContextInvalidateHandler)
     if enable_audit:
         handlers.add_handler('seaf_server.event:repo-update', FileUpdateEventHandler)
         handlers.add_handler('seaf_server.event:repo-download-sync', FileAuditEventHandler)
@@ -1018,3 +1075,7 @@ def register_handlers(handlers, enable_audit):
         handlers.add_handler('seahub.audit:file-download-api', FileAuditEventHandler)
         handlers.add_handler('seahub.audit:file-download-share-link', FileAuditEventHandler)
         handlers.add_handler('seahub.audit:perm-change', PermAuditEventHandler)
+
+        handlers.add_batch_handler(FileUpdateEventHandler, FileUpdateEventBatchHandler)
+        handlers.add_batch_handler(FileAuditEventHandler, FileAuditEventBatchHandler)
+        handlers.add_batch_handler(PermAuditEventHandler, PermAuditEventBatchHandler)
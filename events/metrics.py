@@ -12,6 +12,23 @@ local_metric = {'metrics': {}}
 NODE_NAME = os.environ.get('NODE_NAME', 'default')
 METRIC_CHANNEL_NAME = "metric_channel"
 
+
+def publish_metric(metric_name, metric_value, metric_help='', metric_type='gauge'):
+    metric = {
+        "metric_name": metric_name,
+        "metric_type": metric_type,
+        "metric_help": metric_help,
+        "component_name": "seafevents",
+        "node_name": NODE_NAME,
+        "details": {},
+        "metric_value": metric_value,
+    }
+    try:
+        redis_cache.publish(METRIC_CHANNEL_NAME, json.dumps(metric))
+    except Exception as e:
+        logging.warning('Failed to publish metric %s: %s', metric_name, e)
+
+
 ### metrics decorator
 def handle_metric_timing(metric_name):
     def decorator(func):
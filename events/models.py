@@ -124,7 +124,12 @@ class FileAudit(Base):
                       Index('idx_file_audit_user_orgid_eid',
                             'user', 'org_id', 'eid'),
                       Index('idx_file_audit_repo_org_eid',
-                            'repo_id', 'org_id', 'eid'))
+                            'repo_id', 'org_id', 'eid'),
+                      # pagination without org filter, see get_events_by_cursor
+                      Index('idx_file_audit_user_eid',
+                            'user', 'eid'),
+                      Index('idx_file_audit_repo_eid',
+                            'repo_id', 'eid'))
 
     def __init__(self, timestamp, etype, user, ip, device,
                  org_id, repo_id, file_path):
@@ -166,7 +171,12 @@ class FileUpdate(Base):
                       Index('idx_file_update_user_orgid_eid',
                             'user', 'org_id', 'eid'),
                       Index('idx_file_update_repo_org_eid',
-                            'repo_id', 'org_id', 'eid'))
+                            'repo_id', 'org_id', 'eid'),
+                      # pagination without org filter, see get_events_by_cursor
+                      Index('idx_file_update_user_eid',
+                            'user', 'eid'),
+                      Index('idx_file_update_repo_eid',
+                            'repo_id', 'eid'))
 
     def __init__(self, timestamp, user, org_id, repo_id, commit_id, file_oper):
         super().__init__()
@@ -205,7 +215,14 @@ class PermAudit(Base):
                       Index('idx_perm_audit_user_orgid_eid',
                             'from_user', 'org_id', 'eid'),
                       Index('idx_perm_audit_repo_org_eid',
-                            'repo_id', 'org_id', 'eid'))
+                            'repo_id', 'org_id', 'eid'),
+                      # pagination without org filter, see get_events_by_cursor
+                      Index('idx_perm_audit_user_eid',
+                            'from_user', 'eid'),
+                      Index('idx_perm_audit_repo_eid',
+                            'repo_id', 'eid'),
+                      Index('idx_perm_audit_to_eid',
+                            'to', 'eid'))
 
     def __init__(self, timestamp, etype, from_user, to, org_id, repo_id,
                  file_path, permission):
@@ -0,0 +1,205 @@
+import time
+import logging
+import datetime
+from collections import OrderedDict
+from threading import Thread, Event, Lock
+
+from sqlalchemy.exc import NoResultFound
+from seaserv import get_org_id_by_repo_id, seafile_api
+
+from seafevents.db import init_db_session_class
+from seafevents.events.metrics import publish_metric
+from seafevents.utils import get_opt_from_conf_or_env
+from .models import OrgLastActivityTime
+
+logger = logging.getLogger(__name__)
+
+
+def load_repo_context(repo_id):
+    """Return (org_id, owner, shared users) of a repo."""
+    org_id = get_org_id_by_repo_id(repo_id)
+    if org_id > 0:
+        users = seafile_api.org_get_shared_users_by_repo(org_id, repo_id)
+        owner = seafile_api.get_org_repo_owner(repo_id)
+    else:
+        users = seafile_api.get_shared_users_by_repo(repo_id)
+        owner = seafile_api.get_repo_owner(repo_id)
+    return org_id, owner, users
+
+
+class RepoContextCache(object):
+    """TTL + LRU cache of load_repo_context results.
+
+    Entries are dropped when the repo's permissions change, see
+    RepoContextInvalidateHandler. Owner transfers and group member changes
+    have no message, so they are seen after at most ``repo_cache_ttl``
+    seconds.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._ttl = 300
+        self._max_size = 10000
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._metric_interval = 60
+        self._metric_time = time.time()
+
+    def init(self, config):
+        section_name = 'EVENTS HANDLER'
+        ttl = get_opt_from_conf_or_env(config, section_name, 'repo_cache_ttl', default=0)
+        max_size = get_opt_from_conf_or_env(config, section_name, 'repo_cache_size', default=self._max_size)
+        try:
+            self._ttl = int(ttl)
+            self._max_size = int(max_size)
+        except ValueError:
+            logger.warning('invalid repo cache config: ttl "%s", size "%s"', ttl, max_size)
+            return
+        self.enabled = self._ttl > 0 and self._max_size > 0
+
+    def get_repo_context(self, repo_id):
+        if not self.enabled:
+            return load_repo_context(repo_id)
+
+        now = time.time()
+        with self._lock:
+            item = self._items.get(repo_id)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(repo_id)
+                self._hits += 1
+                self._publish_hit_rate(now)
+                return item[1]
+            self._misses += 1
+            self._publish_hit_rate(now)
+
+        context = load_repo_context(repo_id)
+        with self._lock:
+            self._items[repo_id] = (now + self._ttl, context)
+            self._items.move_to_end(repo_id)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+        return context
+
+    def invalidate(self, repo_id):
+        with self._lock:
+            self._items.pop(repo_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def _publish_hit_rate(self, now):
+        if now - self._metric_time < self._metric_interval:
+            return
+        total = self._hits + self._misses
+        publish_metric('repo_context_cache_hit_rate', round(self._hits / total, 3) if total else 0,
+                       'Hit rate of the repo context cache used by repo update events')
+        self._hits = 0
+        self._misses = 0
+        self._metric_time = now
+
+
+class OrgLastActivityTimeWriter(object):
+    """Coalesce OrgLastActivityTime writes to at most one per org per interval.
+
+    An update within the interval of the last write is kept as pending, and
+    written by the next update after the interval or by
+    OrgLastActivityTimeFlusher, so the latest activity time always reaches
+    the database.
+    """
+    def __init__(self):
+        self._interval = 0
+        self._last_write = {}
+        self._pending = {}
+        self._lock = Lock()
+        self._flusher = None
+
+    def init(self, config):
+        interval = get_opt_from_conf_or_env(config, 'EVENTS HANDLER', 'org_activity_interval', default=0)
+        try:
+            self._interval = int(interval)
+        except ValueError:
+            logger.warning('invalid org_activity_interval "%s"', interval)
+
+    def start(self):
+        if self._interval <= 0:
+            return
+        self._flusher = OrgLastActivityTimeFlusher(self, self._interval)
+        self._flusher.start()
+
+    def update(self, session, org_id):
+        with self._lock:
+            self._pending[org_id] = datetime.datetime.now()
+            due = time.time() - self._last_write.get(org_id, 0) >= self._interval
+        if due:
+            self._write(session, [org_id])
+
+    def flush(self, session):
+        """Write the pending activity times of the orgs whose interval has ended."""
+        now = time.time()
+        with self._lock:
+            org_ids = [org_id for org_id in self._pending
+                       if now - self._last_write.get(org_id, 0) >= self._interval]
+        if org_ids:
+            self._write(session, org_ids)
+
+    def _write(self, session, org_ids):
+        with self._lock:
+            pending = {org_id: self._pending.pop(org_id) for org_id in org_ids if org_id in self._pending}
+        if not pending:
+            return
+
+        try:
+            for org_id, timestamp in pending.items():
+                try:
+                    org_last_activity_time = session.query(OrgLastActivityTime).filter_by(org_id=org_id).one()
+                    org_last_activity_time.timestamp = timestamp
+                except NoResultFound:
+                    org_last_activity_time = OrgLastActivityTime(org_id, timestamp)
+                    session.add(org_last_activity_time)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning('Failed to update last activity time of %d orgs: %s', len(pending), e)
+            with self._lock:
+                for org_id, timestamp in pending.items():
+                    # keep a newer update made while writing
+                    self._pending.setdefault(org_id, timestamp)
+            return
+
+        now = time.time()
+        with self._lock:
+            for org_id in pending:
+                self._last_write[org_id] = now
+
+
+class OrgLastActivityTimeFlusher(Thread):
+    def __init__(self, writer, interval):
+        Thread.__init__(self)
+        self.daemon = True
+        self._writer = writer
+        self._interval = interval
+        self._db_session_class = init_db_session_class()
+        self.finished = Event()
+
+    def run(self):
+        while not self.finished.is_set():
+            self.finished.wait(self._interval)
+            if self.finished.is_set():
+                break
+            session = self._db_session_class()
+            try:
+                self._writer.flush(session)
+            except Exception as e:
+                logger.exception('Failed to flush org last activity times: %s', e)
+            finally:
+                session.close()
+
+    def cancel(self):
+        self.finished.set()
+
+
+repo_context_cache = RepoContextCache()
+org_last_activity_time_writer = OrgLastActivityTimeWriter()
@@ -0,0 +1,241 @@
+import re
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text, select, delete
+
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+from .models import Activity, UserActivity, FileHistory, FileAudit, FileUpdate, PermAudit
+
+logger = logging.getLogger(__name__)
+
+# option in [RETENTION] -> (model, primary key, timestamp column)
+RETENTION_TABLES = [
+    ('file_audit', FileAudit, FileAudit.eid, FileAudit.timestamp),
+    ('file_update', FileUpdate, FileUpdate.eid, FileUpdate.timestamp),
+    ('perm_audit', PermAudit, PermAudit.eid, PermAudit.timestamp),
+    ('activity', Activity, Activity.id, Activity.timestamp),
+    ('user_activity', UserActivity, UserActivity.id, UserActivity.timestamp),
+    ('file_history', FileHistory, FileHistory.id, FileHistory.timestamp),
+]
+
+# Monthly partitions created ahead of the current month
+RETENTION_PREMAKE_MONTHS = 2
+# Rows removed per statement from tables which are not partitioned
+RETENTION_DELETE_CHUNK = 1000
+
+# MySQL TO_DAYS() of a date is its python ordinal plus 365
+_TO_DAYS_OFFSET = 365
+_partition_re = re.compile(r'^p(\d{4})(\d{2})$')
+
+
+class RetentionPolicy(object):
+    def __init__(self, option, model, pk, timestamp, keep_days):
+        self.option = option
+        self.model = model
+        self.table = model.__tablename__
+        self.pk = pk
+        self.timestamp = timestamp
+        self.keep_days = keep_days
+
+    def get_cutoff(self, now=None):
+        """Rows before the returned day are out of retention."""
+        now = now or datetime.utcnow()
+        return (now - timedelta(days=self.keep_days)).date()
+
+
+def get_retention_policies(config):
+    """Return the policies of the tables with a retention in [RETENTION],
+    the number of days to keep, 0 or no option keeps them forever.
+    """
+    policies = []
+    for option, model, pk, timestamp in RETENTION_TABLES:
+        keep_days = get_opt_from_conf_or_env(config, 'RETENTION', option, default=0)
+        try:
+            keep_days = int(keep_days)
+        except ValueError:
+            logger.warning('Invalid retention "%s" of %s, keep it forever', keep_days, option)
+            continue
+        if keep_days > 0:
+            policies.append(RetentionPolicy(option, model, pk, timestamp, keep_days))
+    return policies
+
+
+def is_archive_enabled(config):
+    archive = get_opt_from_conf_or_env(config, 'RETENTION', 'archive', default=False)
+    return parse_bool(archive)
+
+
+def _to_days(day):
+    return day.toordinal() + _TO_DAYS_OFFSET
+
+
+def _from_days(days):
+    return date.fromordinal(days - _TO_DAYS_OFFSET)
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+
+
+def get_monthly_partitions(session, table):
+    """Return [(name, end_day)] of the monthly partitions of ``table`` ordered
+    by day, None if it is not partitioned by range of TO_DAYS(timestamp).
+
+    ``end_day`` is the first day which is not in the partition.
+    """
+    sql = """SELECT PARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION
+             FROM information_schema.PARTITIONS
+             WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+             ORDER BY PARTITION_ORDINAL_POSITION"""
+    rows = session.execute(text(sql), {'table': table}).fetchall()
+    if not rows or rows[0][0] is None:
+        return None
+    method, expression = rows[0][1], (rows[0][2] or '').replace('`', '').lower()
+    if method != 'RANGE' or expression != 'to_days(timestamp)':
+        logger.warning('Table %s is not partitioned by month of timestamp, partitions are not managed', table)
+        return None
+
+    partitions = []
+    for name, _, _, description in rows:
+        if _partition_re.match(name or '') and description and description.isdigit():
+            partitions.append((name, _from_days(int(description))))
+    return partitions
+
+
+def ensure_partitions(session, table, partitions, today=None):
+    """Split the catch-all ``pmax`` partition into monthly partitions up to
+    RETENTION_PREMAKE_MONTHS months after this one.
+
+    New partitions always start at the end of the last monthly partition, so
+    ``pmax`` only holds rows of the last few days and is cheap to split. The
+    partitions of the months before the upgrade are made by
+    sql/mysql/upgrade_partition_event_tables.sql.
+    """
+    today = today or datetime.utcnow().date()
+    month = partitions[-1][1]
+    if month < _month_start(today):
+        # seafevents was stopped for a while, pmax holds rows since then
+        logger.warning('Last monthly partition of %s ends at %s, catching up', table, month)
+
+    last_month = _month_start(today)
+    for _ in range(RETENTION_PREMAKE_MONTHS):
+        last_month = _next_month(last_month)
+
+    new_partitions = []
+    while month <= last_month:
+        end_day = _next_month(month)
+        new_partitions.append('PARTITION p%s VALUES LESS THAN (%d)' % (month.strftime('%Y%m'), _to_days(end_day)))
+        month = end_day
+    if not new_partitions:
+        return
+
+    sql = 'ALTER TABLE `%s` REORGANIZE PARTITION pmax INTO (%s, PARTITION pmax VALUES LESS THAN MAXVALUE)' % \
+          (table, ', '.join(new_partitions))
+    session.execute(text(sql))
+    logger.info('Added %d monthly partitions to %s', len(new_partitions), table)
+
+
+def _table_exists(session, table):
+    sql = """SELECT 1 FROM information_schema.TABLES
+             WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"""
+    return session.execute(text(sql), {'table': table}).first() is not None
+
+
+def _is_empty(session, table, partition=None):
+    sql = 'SELECT 1 FROM `%s`%s LIMIT 1' % (table, ' PARTITION (%s)' % partition if partition else '')
+    return session.execute(text(sql)).first() is None
+
+
+def _archive_partition(session, table, name):
+    """Move the rows of partition ``name`` to the table
+    ``<table>_archive_<YYYYMM>``, return False if the partition must be kept.
+
+    The archive table is only created and made unpartitioned here. If it
+    already exists, a previous run failed after the exchange, so the rows are
+    only moved when the archive table is still empty.
+    """
+    archive_table = '%s_archive_%s' % (table, name[1:])
+    if not _table_exists(session, archive_table):
+        session.execute(text('CREATE TABLE `%s` LIKE `%s`' % (archive_table, table)))
+        session.execute(text('ALTER TABLE `%s` REMOVE PARTITIONING' % archive_table))
+    elif not _is_empty(session, archive_table):
+        if _is_empty(session, table, name):
+            # exchanged by a previous run which failed to drop the partition
+            return True
+        logger.warning('Archive table %s of partition %s of %s is not empty, partition is kept',
+                       archive_table, name, table)
+        return False
+    elif get_monthly_partitions(session, archive_table) is not None:
+        logger.warning('Archive table %s of partition %s of %s is partitioned, partition is kept',
+                       archive_table, name, table)
+        return False
+
+    session.execute(text('ALTER TABLE `%s` EXCHANGE PARTITION %s WITH TABLE `%s`' %
+                         (table, name, archive_table)))
+    logger.info('Archived partition %s of %s to %s', name, table, archive_table)
+    return True
+
+
+def drop_expired_partitions(session, table, partitions, cutoff, archive=False):
+    """Drop the monthly partitions which only hold rows before ``cutoff``.
+
+    With ``archive``, every partition is first exchanged with an empty table
+    named ``<table>_archive_<YYYYMM>``, which keeps its rows out of the live
+    table without copying them.
+    """
+    dropped = 0
+    for name, end_day in partitions:
+        if end_day > cutoff:
+            break
+        if archive and not _archive_partition(session, table, name):
+            continue
+        session.execute(text('ALTER TABLE `%s` DROP PARTITION %s' % (table, name)))
+        logger.info('Dropped partition %s of %s', name, table)
+        dropped += 1
+    return dropped
+
+
+def delete_expired_rows(session, policy, cutoff):
+    """Delete rows before ``cutoff`` in small chunks for tables which are
+    not partitioned, so no statement holds locks for long.
+    """
+    cutoff = datetime(cutoff.year, cutoff.month, cutoff.day)
+    deleted = 0
+    while True:
+        stmt = select(policy.pk).where(policy.timestamp < cutoff).limit(RETENTION_DELETE_CHUNK)
+        ids = session.scalars(stmt).all()
+        if not ids:
+            break
+        session.execute(delete(policy.model).where(policy.pk.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+        if len(ids) < RETENTION_DELETE_CHUNK:
+            break
+    return deleted
+
+
+def apply_retention(session, policy, archive=False):
+    """Apply the retention of one table, return the number of dropped
+    partitions and deleted rows.
+    """
+    cutoff = policy.get_cutoff()
+    partitions = get_monthly_partitions(session, policy.table)
+    if partitions == []:
+        # splitting a pmax which holds every row would copy the whole table
+        logger.warning('Table %s has no monthly partitions, run upgrade_partition_event_tables.sql '
+                       'to create them', policy.table)
+        partitions = None
+    if partitions is None:
+        if archive:
+            logger.warning('Table %s has no monthly partitions, rows out of retention are deleted without archive',
+                           policy.table)
+        return 0, delete_expired_rows(session, policy, cutoff)
+
+    ensure_partitions(session, policy.table, partitions)
+    partitions = get_monthly_partitions(session, policy.table)
+    return drop_expired_partitions(session, policy.table, partitions, cutoff, archive), 0
@@ -102,6 +102,39 @@ class RepoData(object):
         finally:
             session.close()
 
+    def _get_repos_id_commit_id(self, repo_ids):
+        session = self._db_session_class()
+        if not repo_ids:
+            return []
+        try:
+            cmd = """SELECT RepoInfo.repo_id, Branch.commit_id, RepoInfo.type
+                     FROM RepoInfo
+                     INNER JOIN Branch ON RepoInfo.repo_id = Branch.repo_id
+                     WHERE Branch.name = :name
+                     AND RepoInfo.repo_id IN :repo_ids"""
+            res = session.execute(text(cmd), {'name': 'master',
+                                              'repo_ids': tuple(repo_ids)}).fetchall()
+            return res
+        except Exception as e:
+            raise e
+        finally:
+            session.close()
+
+    def _get_repos_mtime_size(self, repo_ids):
+        session = self._db_session_class()
+        if not repo_ids:
+            return []
+        try:
+            cmd = """SELECT RepoInfo.repo_id, RepoInfo.update_time, RepoSize.size
+                     FROM RepoInfo LEFT JOIN RepoSize ON RepoInfo.repo_id = RepoSize.repo_id
+                     WHERE RepoInfo.repo_id IN :repo_ids"""
+            res = session.execute(text(cmd), {'repo_ids': tuple(repo_ids)}).fetchall()
+            return res
+        except Exception as e:
+            raise e
+        finally:
+            session.close()
+
     def _get_virtual_repo_in_repos(self, repo_ids):
         session = self._db_session_class()
         if not repo_ids:
@@ -181,6 +214,20 @@ class RepoData(object):
             logger.error(e)
             return self._get_virtual_repo_in_repos(repo_ids)
 
+    def get_repos_id_commit_id(self, repo_ids):
+        try:
+            return self._get_repos_id_commit_id(repo_ids)
+        except Exception as e:
+            logger.error(e)
+            return self._get_repos_id_commit_id(repo_ids)
+
+    def get_repos_mtime_size(self, repo_ids):
+        try:
+            return self._get_repos_mtime_size(repo_ids)
+        except Exception as e:
+            logger.error(e)
+            return self._get_repos_mtime_size(repo_ids)
+
     def get_mtime_by_repo_ids(self, repo_ids):
         try:
             return self._get_mtime_by_repo_ids(repo_ids)
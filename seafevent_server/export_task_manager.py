@@ -21,6 +21,8 @@ class EventExportTaskManager(object):
         self._db_session_class = None
         self.tasks_map = {}
         self.task_results_map = {}
+        # number of rows exported by running export tasks
+        self.task_progress_map = {}
         self.tasks_queue = queue.Queue(10)
         self.current_task_info = {}
         self.threads = []
@@ -50,18 +52,25 @@ class EventExportTaskManager(object):
         }
         redis_cache.publish(METRIC_CHANNEL_NAME, json.dumps(publish_metric))
 
-    def add_export_logs_task(self, start_time, end_time, log_type):
+    def _progress_setter(self, task_id):
+        def set_progress(row_num):
+            self.task_progress_map[task_id] = row_num
+        return set_progress
+
+    def add_export_logs_task(self, start_time, end_time, log_type, file_format='xlsx'):
         task_id = str(uuid.uuid4())
-        task = (export_event_log_to_excel, (self._db_session_class, start_time, end_time, log_type, task_id))
+        task = (export_event_log_to_excel, (self._db_session_class, start_time, end_time, log_type, task_id,
+                                            file_format, self._progress_setter(task_id)))
 
         self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
         self.publish_io_qsize_metric(self.tasks_queue.qsize())
         return task_id
 
-    def add_org_export_logs_task(self, start_time, end_time, log_type, org_id):
+    def add_org_export_logs_task(self, start_time, end_time, log_type, org_id, file_format='xlsx'):
         task_id = str(uuid.uuid4())
-        task = (export_org_event_log_to_excel, (self._db_session_class, start_time, end_time, log_type, task_id, org_id))
+        task = (export_org_event_log_to_excel, (self._db_session_class, start_time, end_time, log_type, task_id, org_id,
+                                                file_format, self._progress_setter(task_id)))
 
         self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
@@ -78,8 +87,13 @@ class EventExportTaskManager(object):
         self.publish_io_qsize_metric(self.tasks_queue.qsize())
         return task_id
 
+    def query_progress(self, task_id):
+        return self.task_progress_map.get(task_id, 0)
+
     def query_status(self, task_id):
         task_result = self.task_results_map.pop(task_id, None)
+        if task_result is not None:
+            self.task_progress_map.pop(task_id, None)
         if task_result == 'success':
             return True, None
         if isinstance(task_result, str) and task_result.startswith('error_'):
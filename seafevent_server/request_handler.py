@@ -77,8 +77,9 @@ def get_sys_logs_task():
     start_time = request.args.get('start_time')
     end_time = request.args.get('end_time')
     log_type = request.args.get('log_type')
+    file_format = request.args.get('file_format', 'xlsx')
     try:
-        task_id = event_export_task_manager.add_export_logs_task(start_time, end_time, log_type)
+        task_id = event_export_task_manager.add_export_logs_task(start_time, end_time, log_type, file_format)
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -102,8 +103,10 @@ def get_org_logs_task():
     end_time = request.args.get('end_time')
     log_type = request.args.get('log_type')
     org_id = request.args.get('org_id')
+    file_format = request.args.get('file_format', 'xlsx')
     try:
-        task_id = event_export_task_manager.add_org_export_logs_task(start_time, end_time, log_type, org_id)
+        task_id = event_export_task_manager.add_org_export_logs_task(start_time, end_time, log_type, org_id,
+                                                                     file_format)
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -122,6 +125,7 @@ def query_status():
         return make_response(('task_id not found.', 404))
 
     try:
+        exported_count = event_export_task_manager.query_progress(task_id)
         is_finished, error = event_export_task_manager.query_status(task_id)
     except Exception as e:
         logger.debug(e)
@@ -129,7 +133,7 @@ def query_status():
 
     if error:
         return make_response((error, 500))
-    return make_response(({'is_finished': is_finished}, 200))
+    return make_response(({'is_finished': is_finished, 'exported_count': exported_count}, 200))
 
 
 @app.route('/query-import-status', methods=['GET'])
@@ -1,5 +1,7 @@
 import os
 import ast
+import csv
+import gzip
 import logging
 import time
 
@@ -14,7 +16,7 @@ import random
 import hashlib
 import requests
 
-from sqlalchemy import desc, select, text
+from sqlalchemy import desc, select, text, or_, and_
 
 from seafevents.events.models import FileAudit, FileUpdate, PermAudit, UserLogin
 from seafevents.app.config import TIME_ZONE
@@ -72,29 +74,6 @@ def get_diff_files(repo_id, old_commit_id, new_commit_id):
     return differ.diff()
 
 
-def write_xls(sheet_name, head, data_list):
-    """write listed data into excel
-    """
-
-    try:
-        wb = openpyxl.Workbook(write_only=True)
-        ws = wb.create_sheet(sheet_name)
-    except Exception as e:
-        logger.error(e)
-        return None
-
-    ws.append(head)
-    row_num = 0
-    # write table data
-    for row in data_list:
-        row_num += 1
-        if row_num % 10000 == 0:
-            time.sleep(0.5)
-        ws.append(row)
-
-    return wb
-
-
 def utc_to_local(dt):
     # change from UTC timezone to current seahub timezone
     tz = pytz.timezone(TIME_ZONE)
@@ -120,331 +99,270 @@ def generate_file_audit_event_type(e):
     return event_type_dict[e.etype]
 
 
-def export_event_log_to_excel(session, start_time, end_time, log_type, task_id):
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FILE_FORMATS = ('xlsx', 'csv', 'csv.gz')
+
+
+class LogExportWriter(object):
+    """Write exported rows to a xlsx, csv or gzipped csv file as they come,
+    without keeping them in memory.
+    """
+    def __init__(self, target_path, sheet_name, head, file_format='xlsx'):
+        self.target_path = target_path
+        self.file_format = file_format
+        self.row_num = 0
+        self._wb = None
+        self._fp = None
+
+        if file_format == 'xlsx':
+            self._wb = openpyxl.Workbook(write_only=True)
+            self._ws = self._wb.create_sheet(sheet_name)
+            self._append = self._ws.append
+        elif file_format == 'csv':
+            # utf-8-sig makes excel detect the encoding
+            self._fp = open(target_path, 'w', newline='', encoding='utf-8-sig')
+            self._append = csv.writer(self._fp).writerow
+        elif file_format == 'csv.gz':
+            self._fp = gzip.open(target_path, 'wt', newline='', encoding='utf-8')
+            self._append = csv.writer(self._fp).writerow
+        else:
+            raise ValueError('unknown file format %s' % file_format)
+
+        self._append(head)
+
+    def append(self, row):
+        self.row_num += 1
+        if self.row_num % 10000 == 0:
+            time.sleep(0.5)
+        self._append(row)
+
+    def close(self):
+        if self._wb:
+            self._wb.save(self.target_path)
+        if self._fp:
+            self._fp.close()
+
+
+def iter_log_chunks(session, model, time_column, id_column, conditions, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield rows of ``model`` newest first, ``chunk_size`` rows at a time.
+
+    Chunks are read by keyset pagination on (time_column, id_column), so every
+    query is short and only one chunk is loaded at a time.
+    """
+    last_time = last_id = None
+    while True:
+        stmt = select(model).where(*conditions)
+        if last_id is not None:
+            stmt = stmt.where(or_(time_column < last_time,
+                                  and_(time_column == last_time, id_column < last_id)))
+        stmt = stmt.order_by(desc(time_column), desc(id_column)).limit(chunk_size)
+        rows = session.scalars(stmt).all()
+        if not rows:
+            return
+        last_time = getattr(rows[-1], time_column.key)
+        last_id = getattr(rows[-1], id_column.key)
+
+        yield rows
+        # drop the exported rows from the identity map
+        session.expunge_all()
+        if len(rows) < chunk_size:
+            return
+
+
+def _get_repos(seafile_db, repos, repo_ids):
+    """Add the info of ``repo_ids`` missing in ``repos``, deleted repos are set to None."""
+    missing_ids = {repo_id for repo_id in repo_ids if repo_id not in repos}
+    if not missing_ids:
+        return
+    found = seafile_db.get_repo_info_by_ids(missing_ids)
+    for repo_id in missing_ids:
+        repos[repo_id] = found.get(repo_id)
+
+
+def _get_groups(ccnet_db, groups, group_ids):
+    missing_ids = {group_id for group_id in group_ids if group_id not in groups}
+    if not missing_ids:
+        return
+    found = ccnet_db.get_groups_by_ids(missing_ids)
+    for group_id in missing_ids:
+        groups[group_id] = found.get(group_id)
+
+
+def _get_repo_name_owner(repos, repo_id):
+    repo = repos.get(repo_id)
+    if repo:
+        return repo['repo_name'], repo['owner']
+    return 'Deleted', '--'
+
+
+def get_file_audit_rows(events, ccnet_db, seafile_db, cache):
+    repos = cache.setdefault('repos', {})
+    _get_repos(seafile_db, repos, [ev.repo_id for ev in events])
+
+    rows = []
+    for ev in events:
+        event_type, show_device = generate_file_audit_event_type(ev)
+        repo_name, repo_owner = _get_repo_name_owner(repos, ev.repo_id)
+        username = ev.user if ev.user else 'Anonymous User'
+        date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
+        rows.append([username, event_type, ev.ip, show_device,
+                     date, repo_name, ev.repo_id, repo_owner, ev.file_path])
+    return rows
+
+
+def get_file_update_rows(events, ccnet_db, seafile_db, cache):
+    repos = cache.setdefault('repos', {})
+    _get_repos(seafile_db, repos, [ev.repo_id for ev in events])
+
+    rows = []
+    for ev in events:
+        repo_name, repo_owner = _get_repo_name_owner(repos, ev.repo_id)
+        username = ev.user if ev.user else 'Anonymous User'
+        date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
+        rows.append([username, date, repo_name, ev.repo_id, repo_owner, ev.file_oper.strip()])
+    return rows
+
+
+def get_perm_audit_rows(events, ccnet_db, seafile_db, cache):
+    repos = cache.setdefault('repos', {})
+    groups = cache.setdefault('groups', {})
+    _get_repos(seafile_db, repos, [ev.repo_id for ev in events])
+    _get_groups(ccnet_db, groups, [int(ev.to) for ev in events if ev.to.isdigit()])
+
+    rows = []
+    for ev in events:
+        repo_name, _ = _get_repo_name_owner(repos, ev.repo_id)
+
+        if '@' in ev.to:
+            to = ev.to
+        elif ev.to.isdigit():
+            group = groups.get(int(ev.to))
+            to = group['group_name'] if group else 'Deleted'
+        elif 'all' in ev.to:
+            to = 'Organization'
+        else:
+            to = '--'
+
+        if 'add' in ev.etype:
+            action = 'Add'
+        elif 'modify' in ev.etype:
+            action = 'Modify'
+        elif 'delete' in ev.etype:
+            action = 'Delete'
+        else:
+            action = '--'
+
+        if ev.permission == 'rw':
+            permission = 'Read-Write'
+        elif ev.permission == 'r':
+            permission = 'Read-Only'
+        else:
+            permission = '--'
+
+        date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
+        rows.append([ev.from_user, to, action, permission, repo_name, ev.file_path, date])
+    return rows
+
+
+def get_login_rows(logs, ccnet_db, seafile_db, cache):
+    rows = []
+    for log in logs:
+        login_time = log.login_date.strftime("%Y-%m-%d %H:%M:%S")
+        status = 'Success' if log.login_success else 'Failed'
+        rows.append([log.username, log.login_ip, status, login_time])
+    return rows
+
+
+# log_type: (file name, model, time column, id column, head, rows function)
+LOG_EXPORT_TYPES = {
+    'fileaudit': ('file-access-logs', FileAudit, FileAudit.timestamp, FileAudit.eid,
+                  ["User", "Type", "IP", "Device", "Date", "Library Name", "Library ID", "Library Owner", "File Path"],
+                  get_file_audit_rows),
+    'fileupdate': ('file-update-logs', FileUpdate, FileUpdate.timestamp, FileUpdate.eid,
+                   ["User", "Date", "Library Name", "Library ID", "Library Owner", "Action"],
+                   get_file_update_rows),
+    'permaudit': ('perm-audit-logs', PermAudit, PermAudit.timestamp, PermAudit.eid,
+                  ["From", "To", "Action", "Permission", "Library", "Folder Path", "Date"],
+                  get_perm_audit_rows),
+    'loginadmin': ('login-logs', UserLogin, UserLogin.login_date, UserLogin.id,
+                   ["Name", "IP", "Status", "Time"],
+                   get_login_rows),
+}
+
+
+def get_export_file_name(log_type, file_format='xlsx'):
+    return '%s.%s' % (LOG_EXPORT_TYPES[log_type][0], file_format)
+
+
+def export_event_log(session, start_time, end_time, log_type, task_id, org_id=None,
+                     file_format='xlsx', on_progress=None):
+    """Export the logs of ``log_type`` between start_time and end_time to
+    /tmp/seafile_events/<task_id>/, one chunk at a time.
+
+    ``on_progress`` is called with the number of exported rows after every chunk.
+    """
+    if file_format not in EXPORT_FILE_FORMATS:
+        raise RuntimeError('Invalid file_format parameter')
+
+    name, model, time_column, id_column, head, get_rows = LOG_EXPORT_TYPES[log_type]
+    conditions = [time_column.between(datetime.datetime.utcfromtimestamp(start_time),
+                                      datetime.datetime.utcfromtimestamp(end_time))]
+    if org_id is not None:
+        conditions.append(model.org_id == org_id)
+
+    target_dir = os.path.join('/tmp/seafile_events/', task_id)
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, get_export_file_name(log_type, file_format))
+
+    with session() as session, CcnetDB() as ccnet_db, SeafileDB() as seafile_db:
+        try:
+            writer = LogExportWriter(target_path, name, head, file_format)
+        except Exception as e:
+            logger.error(e)
+            raise RuntimeError('Failed to export %s to %s' % (name, file_format))
+
+        # names of repos and groups are looked up once per export
+        cache = {}
+        try:
+            for events in iter_log_chunks(session, model, time_column, id_column, conditions):
+                for row in get_rows(events, ccnet_db, seafile_db, cache):
+                    writer.append(row)
+                if on_progress:
+                    on_progress(writer.row_num)
+        finally:
+            writer.close()
+
+
+def _check_export_params(start_time, end_time):
     start_time = ast.literal_eval(start_time)
     end_time = ast.literal_eval(end_time)
 
     if not isinstance(start_time, (int, float)) or not isinstance(end_time, (int, float)):
         raise RuntimeError('Invalid time range parameter')
 
+    return start_time, end_time
+
+
+def export_event_log_to_excel(session, start_time, end_time, log_type, task_id,
+                              file_format='xlsx', on_progress=None):
+    start_time, end_time = _check_export_params(start_time, end_time)
+
     if log_type not in ['fileaudit', 'fileupdate', 'permaudit', 'loginadmin']:
         raise RuntimeError('Invalid log_type parameter')
 
-    with session() as session, CcnetDB() as ccnet_db, SeafileDB() as seafile_db:
-        if log_type == 'fileaudit':
-            stmt = select(FileAudit).where(FileAudit.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                       datetime.datetime.utcfromtimestamp(end_time)))
-            stmt = stmt.order_by(desc(FileAudit.timestamp))
-            res = session.scalars(stmt).all()
-
-            head = ["User", "Type", "IP", "Device", "Date", "Library Name", "Library ID", "Library Owner", "File Path"]
-            data_list = []
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-            for ev in res:
-                event_type, ev.show_device = generate_file_audit_event_type(ev)
-
-                repo_id = ev.repo_id
-                if repo_id in repos:
-                    repo_name = repos[repo_id]['repo_name']
-                    repo_owner = repos[repo_id]['owner']
-                else:
-                    repo_name = 'Deleted'
-                    repo_owner = '--'
-
-                username = ev.user if ev.user else 'Anonymous User'
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-
-                row = [username, event_type, ev.ip, ev.show_device,
-                       date, repo_name, ev.repo_id, repo_owner, ev.file_path]
-                data_list.append(row)
-
-            wb = write_xls('file-access-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export file-access-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'file-access-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-        elif log_type == 'fileupdate':
-            stmt = select(FileUpdate).where(FileUpdate.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                         datetime.datetime.utcfromtimestamp(end_time)))
-            stmt = stmt.order_by(desc(FileUpdate.timestamp))
-            res = session.scalars(stmt).all()
-
-            head = ["User", "Date", "Library Name", "Library ID", "Library Owner", "Action"]
-            data_list = []
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-
-            for ev in res:
-                repo_id = ev.repo_id
-                if repo_id in repos:
-                    repo_name = repos[repo_id]['repo_name']
-                    repo_owner = repos[repo_id]['owner']
-                else:
-                    repo_name = 'Deleted'
-                    repo_owner = '--'
-
-                username = ev.user if ev.user else 'Anonymous User'
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-                row = [username, date, repo_name, ev.repo_id, repo_owner, ev.file_oper.strip()]
-                data_list.append(row)
-
-            wb = write_xls('file-update-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export file-update-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'file-update-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-
-        elif log_type == 'permaudit':
-            stmt = select(PermAudit).where(PermAudit.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                       datetime.datetime.utcfromtimestamp(end_time)))
-            stmt = stmt.order_by(desc(PermAudit.timestamp))
-            res = session.scalars(stmt).all()
-
-            head = ["From", "To", "Action", "Permission", "Library", "Folder Path", "Date"]
-            data_list = []
-            group_ids = set()
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-                if row.to.isdigit():
-                    group_id = int(row.to)
-                    group_ids.add(group_id)
-            groups = ccnet_db.get_groups_by_ids(group_ids)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-            for ev in res:
-                repo_id = ev.repo_id
-                repo_name = repos[repo_id]['repo_name'] if repo_id in repos else 'Deleted'
-
-                if '@' in ev.to:
-                    to = ev.to
-                elif ev.to.isdigit():
-                    group_id = int(ev.to)
-                    group = groups[group_id] if group_id in groups else None
-                    to = group['group_name'] if group else 'Deleted'
-                elif 'all' in ev.to:
-                    to = 'Organization'
-                else:
-                    to = '--'
-
-                if 'add' in ev.etype:
-                    action = 'Add'
-                elif 'modify' in ev.etype:
-                    action = 'Modify'
-                elif 'delete' in ev.etype:
-                    action = 'Delete'
-                else:
-                    action = '--'
-
-                if ev.permission == 'rw':
-                    permission = 'Read-Write'
-                elif ev.permission == 'r':
-                    permission = 'Read-Only'
-                else:
-                    permission = '--'
-
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-                row = [ev.from_user, to, action, permission, repo_name, ev.file_path, date]
-                data_list.append(row)
-
-            wb = write_xls('perm-audit-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export perm-audit-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'perm-audit-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-        elif log_type == 'loginadmin':
-            stmt = select(UserLogin).where(UserLogin.login_date.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                        datetime.datetime.utcfromtimestamp(end_time)))
-            stmt = stmt.order_by(desc(UserLogin.login_date))
-            res = session.scalars(stmt).all()
-
-            head = ["Name", "IP", "Status", "Time"]
-            data_list = []
-            for log in res:
-                login_time = log.login_date.strftime("%Y-%m-%d %H:%M:%S")
-                status = 'Success' if log.login_success else 'Failed'
-                row = [log.username, log.login_ip, status, login_time]
-                data_list.append(row)
-
-            wb = write_xls('login-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export login-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'login-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-
-
-def export_org_event_log_to_excel(session, start_time, end_time, log_type, task_id, org_id):
-    start_time = ast.literal_eval(start_time)
-    end_time = ast.literal_eval(end_time)
+    export_event_log(session, start_time, end_time, log_type, task_id,
+                     file_format=file_format, on_progress=on_progress)
 
-    if not isinstance(start_time, (int, float)) or not isinstance(end_time, (int, float)):
-        raise RuntimeError('Invalid time range parameter')
+
+def export_org_event_log_to_excel(session, start_time, end_time, log_type, task_id, org_id,
+                                  file_format='xlsx', on_progress=None):
+    start_time, end_time = _check_export_params(start_time, end_time)
 
     if log_type not in ['fileupdate', 'permaudit', 'fileaudit']:
         raise RuntimeError('Invalid log_type parameter')
 
-    with session() as session, CcnetDB() as ccnet_db, SeafileDB() as seafile_db:
-        if log_type == 'fileupdate':
-            stmt = select(FileUpdate).where(FileUpdate.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                         datetime.datetime.utcfromtimestamp(end_time)),
-                                            FileUpdate.org_id == org_id)
-            stmt = stmt.order_by(desc(FileUpdate.timestamp))
-            res = session.scalars(stmt).all()
-
-            head = ["User", "Date", "Library Name", "Library ID", "Library Owner", "Action"]
-            data_list = []
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-
-            for ev in res:
-                repo_id = ev.repo_id
-                if repo_id in repos:
-                    repo_name = repos[repo_id]['repo_name']
-                    repo_owner = repos[repo_id]['owner']
-                else:
-                    repo_name = 'Deleted'
-                    repo_owner = '--'
-
-                username = ev.user if ev.user else 'Anonymous User'
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-                row = [username, date, repo_name, ev.repo_id, repo_owner, ev.file_oper.strip()]
-                data_list.append(row)
-
-            wb = write_xls('file-update-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export file-update-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'file-update-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-
-        elif log_type == 'permaudit':
-            stmt = select(PermAudit).where(PermAudit.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                                                       datetime.datetime.utcfromtimestamp(end_time)),
-                                           PermAudit.org_id == org_id)
-            stmt = stmt.order_by(desc(PermAudit.timestamp))
-            res = session.scalars(stmt).all()
-            head = ["From", "To", "Action", "Permission", "Library", "Folder Path", "Date"]
-            data_list = []
-            group_ids = set()
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-                if row.to.isdigit():
-                    group_id = int(row.to)
-                    group_ids.add(group_id)
-            groups = ccnet_db.get_groups_by_ids(group_ids)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-            for ev in res:
-                repo_id = ev.repo_id
-                repo_name = repos[repo_id]['repo_name'] if repo_id in repos else 'Deleted'
-                if '@' in ev.to:
-                    to = ev.to
-                elif ev.to.isdigit():
-                    group_id = int(ev.to)
-                    group = groups[group_id] if group_id in groups else None
-                    to = group['group_name'] if group else 'Deleted'
-                elif 'all' in ev.to:
-                    to = 'Organization'
-                else:
-                    to = '--'
-
-                if 'add' in ev.etype:
-                    action = 'Add'
-                elif 'modify' in ev.etype:
-                    action = 'Modify'
-                elif 'delete' in ev.etype:
-                    action = 'Delete'
-                else:
-                    action = '--'
-
-                if ev.permission == 'rw':
-                    permission = 'Read-Write'
-                elif ev.permission == 'r':
-                    permission = 'Read-Only'
-                else:
-                    permission = '--'
-
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-                row = [ev.from_user, to, action, permission, repo_name, ev.file_path, date]
-                data_list.append(row)
-
-            wb = write_xls('perm-audit-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export perm-audit-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'perm-audit-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
-
-        elif log_type == 'fileaudit':
-            stmt = select(FileAudit).where(
-                FileAudit.timestamp.between(datetime.datetime.utcfromtimestamp(start_time),
-                                            datetime.datetime.utcfromtimestamp(end_time)),
-                                            FileAudit.org_id == org_id)
-            stmt = stmt.order_by(desc(FileAudit.timestamp))
-            res = session.scalars(stmt).all()
-
-            head = ["User", "Type", "IP", "Device", "Date", "Library Name", "Library ID", "Library Owner",
-                    "File Path"]
-            data_list = []
-            repo_ids = set()
-            for row in res:
-                repo_ids.add(row.repo_id)
-            repos = seafile_db.get_repo_info_by_ids(repo_ids)
-            for ev in res:
-                event_type, ev.show_device = generate_file_audit_event_type(ev)
-
-                repo_id = ev.repo_id
-                if repo_id in repos:
-                    repo_name = repos[repo_id]['repo_name']
-                    repo_owner = repos[repo_id]['owner']
-                else:
-                    repo_name = 'Deleted'
-                    repo_owner = '--'
-
-                username = ev.user if ev.user else 'Anonymous User'
-                date = utc_to_local(ev.timestamp).strftime('%Y-%m-%d %H:%M:%S') if ev.timestamp else ''
-
-                row = [username, event_type, ev.ip, ev.show_device,
-                       date, repo_name, ev.repo_id, repo_owner, ev.file_path]
-                data_list.append(row)
-
-            wb = write_xls('file-access-logs', head, data_list)
-            if not wb:
-                raise RuntimeError('Failed to export file-access-logs to excel')
-
-            target_dir = os.path.join('/tmp/seafile_events/', task_id)
-            os.makedirs(target_dir, exist_ok=True)
-            excel_name = 'file-access-logs.xlsx'
-            target_path = os.path.join(target_dir, excel_name)
-            wb.save(target_path)
+    export_event_log(session, start_time, end_time, log_type, task_id, org_id=org_id,
+                     file_format=file_format, on_progress=on_progress)
 
 
 def save_wiki_config(repo_id, username, wiki_config):
@@ -21,7 +21,11 @@ class IndexManager(object):
         self.session = init_db_session_class()
         self.metadata_server_api = MetadataServerAPI('seafevents')
 
-    def update_library_file_index(self, repo_id, commit_id, repo_file_index, repo_status_file_index, metadata_query_time):
+    def update_library_file_index(self, repo_id, commit_id, repo_file_index, repo_status_file_index, metadata_query_time,
+                                  deadline=None):
+        """Return True if the index is up to date, False if the update is
+        stopped at ``deadline`` and checkpointed, None on error.
+        """
         try:
             new_commit_id = commit_id
             index_name = REPO_FILE_INDEX_PREFIX + repo_id
@@ -50,11 +54,20 @@ class IndexManager(object):
                 metadata_query_time = None
 
             if not rows and new_commit_id == commit_id:
-                return
+                return True
 
             if repo_status.need_recovery():
-                logger.warning('%s: repo file index inrecovery', repo_id)
-                repo_file_index.update(index_name, repo_id, commit_id, to_commit, rows, self.metadata_server_api, need_index_metadata)
+                if repo_status.checkpoint:
+                    logger.info('%s: resume repo file index from checkpoint %s', repo_id, repo_status.checkpoint)
+                else:
+                    logger.warning('%s: repo file index inrecovery', repo_id)
+                checkpoint = repo_file_index.update(index_name, repo_id, commit_id, to_commit, rows, self.metadata_server_api,
+                                                    need_index_metadata, deadline, repo_status.checkpoint)
+                if checkpoint is not None:
+                    repo_status_file_index.checkpoint_update_repo(repo_id, commit_id, to_commit,
+                                                                  metadata_last_updated_time, checkpoint)
+                    logger.info('%s: repo file index stopped by time budget at %s', repo_id, checkpoint)
+                    return False
                 commit_id = to_commit
                 time.sleep(1)
 
@@ -64,10 +77,17 @@ class IndexManager(object):
                 logger.warning('update repo_name index failed, repo_id: %s, error: %s' % (repo_id, e))
 
             repo_status_file_index.begin_update_repo(repo_id, commit_id, new_commit_id, metadata_last_updated_time)
-            repo_file_index.update(index_name, repo_id, commit_id, new_commit_id, rows, self.metadata_server_api, need_index_metadata)
+            checkpoint = repo_file_index.update(index_name, repo_id, commit_id, new_commit_id, rows, self.metadata_server_api,
+                                                need_index_metadata, deadline)
+            if checkpoint is not None:
+                repo_status_file_index.checkpoint_update_repo(repo_id, commit_id, new_commit_id,
+                                                              metadata_last_updated_time, checkpoint)
+                logger.info('%s: repo file index stopped by time budget at %s', repo_id, checkpoint)
+                return False
             repo_status_file_index.finish_update_repo(repo_id, new_commit_id, metadata_query_time)
 
             logger.info('repo: %s, update repo file index success', repo_id)
+            return True
 
         except Exception as e:
             logger.exception('repo_id: %s, update repo file index error: %s.', repo_id, e)
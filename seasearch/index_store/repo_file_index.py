@@ -1,19 +1,38 @@
 import json
 import os
+import time
 import logging
+from collections import deque
 
-from seafevents.seasearch.utils import get_library_diff_files, md5, is_sys_dir_or_file
+from seafevents.seasearch.utils import get_library_diff_files, iter_library_diff, md5, is_sys_dir_or_file
+from seafevents.seasearch.utils.commit_differ import ADDED_FILE, DELETED_FILE, MODIFIED_FILE, \
+    ADDED_DIR, DELETED_DIR
 from seafevents.seasearch.utils.constants import REPO_FILE_INDEX_PREFIX
 from seafevents.repo_metadata.constants import METADATA_TABLE
 from seafevents.repo_metadata.utils import get_metadata_by_obj_ids
-from seafevents.utils import get_opt_from_conf_or_env, parse_bool
-from seafevents.seasearch.utils.extract import ExtractorFactory
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool, parse_interval, parse_max_size
+from seafevents.seasearch.utils.extract import ExtractorFactory, is_office_pdf
+from seafevents.seasearch.utils.extract_pool import ContentExtractPool
+from seafevents.utils.extract_cache import extract_cache
 from seafevents.utils import isoformat_timestr_to_timestamp
 
 logger = logging.getLogger('seasearch')
 
 SEASEARCH_BULK_OPETATE_LIMIT = 100
 INDEX_CONTENT_LENGTH_LIMIT = 10000
+EXTRACT_WORKERS = min(os.cpu_count() or 1, 4)
+EXTRACT_TIMEOUT = 5 * 60
+EXTRACT_MAX_MEMORY = '256mb'
+
+
+class PendingContent(object):
+    """Content of a file being parsed by the extract pool."""
+    __slots__ = ('future', 'extractor', 'obj_id')
+
+    def __init__(self, future, extractor, obj_id):
+        self.future = future
+        self.extractor = extractor
+        self.obj_id = obj_id
 
 
 class RepoFileIndex(object):
@@ -111,6 +130,8 @@ class RepoFileIndex(object):
         self.text_size_limit = 1 * 1024 * 1024  # 1M
         self.office_file_size_limit = 10 * 1024 * 1024  # 10M
         self.index_office_pdf = False
+        self.stream_diff = False
+        self.extract_pool = None
 
         self.config = config
 
@@ -125,6 +146,28 @@ class RepoFileIndex(object):
         index_office_pdf = get_opt_from_conf_or_env(self.config, section_name, 'index_office_pdf', default=False)
         self.index_office_pdf = parse_bool(index_office_pdf)
 
+        stream_diff = get_opt_from_conf_or_env(self.config, section_name, 'stream_diff', default=False)
+        self.stream_diff = parse_bool(stream_diff)
+
+        # office and pdf files are parsed by a process pool, 0 parses them in the indexing threads
+        extract_workers = get_opt_from_conf_or_env(self.config, section_name, 'extract_workers',
+                                                   default=EXTRACT_WORKERS)
+        try:
+            extract_workers = int(extract_workers)
+        except ValueError:
+            logger.warning('invalid extract_workers value "%s"', extract_workers)
+            extract_workers = EXTRACT_WORKERS
+        if self.index_office_pdf and extract_workers > 0:
+            extract_timeout = get_opt_from_conf_or_env(self.config, section_name, 'extract_timeout',
+                                                       default=EXTRACT_TIMEOUT)
+            extract_max_memory = get_opt_from_conf_or_env(self.config, section_name, 'extract_max_memory',
+                                                          default=EXTRACT_MAX_MEMORY)
+            self.extract_pool = ContentExtractPool(
+                extract_workers,
+                parse_interval(extract_timeout, EXTRACT_TIMEOUT),
+                parse_max_size(extract_max_memory, parse_max_size(EXTRACT_MAX_MEMORY, 0)),
+            )
+
     def create_index_if_missing(self, index_name):
         if not self.seasearch_api.check_index_mapping(index_name).get('is_exist'):
             data = {
@@ -331,7 +374,11 @@ class RepoFileIndex(object):
             return None
 
     def add_files(self, index_name, repo_id, files, path_to_metadata_row, version):
-        bulk_add_params = []
+        """Contents of the files are parsed while the next files are loaded,
+        and the documents are sent to seasearch in the order of ``files``.
+        """
+        # (index_info, doc_info, content or a PendingContent)
+        pending = deque()
         for file_info in files:
             path = file_info[0]
             obj_id = file_info[1]
@@ -362,17 +409,25 @@ class RepoFileIndex(object):
                 'size': size,
             }
 
-            content = self.parse_content(repo_id, path, size, obj_id, version)
+            pending.append((index_info, doc_info, self.submit_content(repo_id, path, size, obj_id, version)))
+
+            # keep the pool busy with the next batch while waiting for this one
+            if len(pending) >= 2 * SEASEARCH_BULK_OPETATE_LIMIT:
+                self.bulk_add_docs(index_name, repo_id, pending, SEASEARCH_BULK_OPETATE_LIMIT)
+        while pending:
+            self.bulk_add_docs(index_name, repo_id, pending, SEASEARCH_BULK_OPETATE_LIMIT)
 
+    def bulk_add_docs(self, index_name, repo_id, pending, count):
+        bulk_add_params = []
+        for _ in range(min(count, len(pending))):
+            index_info, doc_info, content = pending.popleft()
+            if isinstance(content, PendingContent):
+                content = self.get_parsed_content(repo_id, doc_info['path'], content)
             if content:
                 content = content[:INDEX_CONTENT_LENGTH_LIMIT]
             doc_info['content'] = content
             bulk_add_params.append(index_info)
             bulk_add_params.append(doc_info)
-
-            if len(bulk_add_params) >= SEASEARCH_BULK_OPETATE_LIMIT:
-                self.seasearch_api.bulk(index_name, bulk_add_params)
-                bulk_add_params = []
         if bulk_add_params:
             self.seasearch_api.bulk(index_name, bulk_add_params)
 
@@ -397,6 +452,42 @@ class RepoFileIndex(object):
             content = extractor.extract(repo_id, version, obj_id, path) if extractor else None
         return content
 
+    def submit_content(self, repo_id, path, size, obj_id, version):
+        """Return the content, or a PendingContent for office and pdf files
+        parsed by the extract pool.
+        """
+        if not self.extract_pool or not is_office_pdf(path):
+            return self.parse_content(repo_id, path, size, obj_id, version)
+        if not self.check_file_size_limit(path, size):
+            logger.warning("repo_id: %s, file %s size exceeds limit", repo_id, path)
+            return None
+
+        extractor = ExtractorFactory.get_extractor(os.path.basename(path))
+        if not extractor:
+            return None
+        content = extract_cache.get(extractor.suffix, obj_id)
+        if content is not None:
+            return content
+        content = extractor.load(repo_id, version, obj_id)
+        if not content:
+            # An empty file
+            return None
+        future = self.extract_pool.submit(extractor.suffix, content)
+        return PendingContent(future, extractor, obj_id)
+
+    def get_parsed_content(self, repo_id, path, pending):
+        # the pool fails a file after its own timeout, this one only guards
+        # against a stuck pool, allowing for the files queued before it
+        timeout = 2 * self.extract_pool.timeout + 60
+        try:
+            content = pending.future.result(timeout)
+        except Exception as e:
+            logger.warning('failed to extract %s: %s', path, e)
+            return None
+        content = pending.extractor.fix_encoding(repo_id, path, content)
+        extract_cache.set(pending.extractor.suffix, pending.obj_id, content)
+        return content
+
     def add_dirs(self, index_name, repo_id, dirs):
         bulk_add_params = []
         for dir in dirs:
@@ -541,7 +632,27 @@ class RepoFileIndex(object):
 
         return exist_paths
 
-    def update(self, index_name, repo_id, old_commit_id, new_commit_id, metadata_rows, metadata_server_api, need_index_metadata):
+    def update(self, index_name, repo_id, old_commit_id, new_commit_id, metadata_rows, metadata_server_api,
+               need_index_metadata, deadline=None, checkpoint=0):
+        """Return the checkpoint to resume from when the update is stopped at
+        ``deadline``, None when it is finished.
+
+        Only the streamed diff can be stopped, so it is also used when a
+        deadline is given.
+        """
+        try:
+            return self._update(index_name, repo_id, old_commit_id, new_commit_id, metadata_rows, metadata_server_api,
+                                need_index_metadata, deadline, checkpoint)
+        finally:
+            if self.extract_pool:
+                self.extract_pool.publish_stats()
+
+    def _update(self, index_name, repo_id, old_commit_id, new_commit_id, metadata_rows, metadata_server_api,
+                need_index_metadata, deadline, checkpoint):
+        if (self.stream_diff or deadline) and not need_index_metadata:
+            # metadata needs all the added files at once
+            return self.update_by_stream(index_name, repo_id, old_commit_id, new_commit_id, deadline, checkpoint)
+
         added_files, deleted_files, modified_files, added_dirs, deleted_dirs, version = \
             get_library_diff_files(repo_id, old_commit_id, new_commit_id)
 
@@ -561,6 +672,50 @@ class RepoFileIndex(object):
         self.add_files(index_name, repo_id, need_added_files + need_update_metadata_files, path_to_metadata_row, version)
 
         self.add_dirs(index_name, repo_id, added_dirs)
+        return None
+
+    def update_by_stream(self, index_name, repo_id, old_commit_id, new_commit_id, deadline=None, checkpoint=0):
+        """Send the differences to seasearch while diffing, at most
+        SEASEARCH_BULK_OPETATE_LIMIT entries of each type are kept in memory.
+
+        The differences of two commits always come in the same order, so an
+        update stopped at ``deadline`` returns the number of differences sent,
+        and is resumed by skipping them.
+        """
+        entries, version = iter_library_diff(repo_id, old_commit_id, new_commit_id)
+        buffers = {ADDED_FILE: [], DELETED_FILE: [], MODIFIED_FILE: [], ADDED_DIR: [], DELETED_DIR: []}
+        count = 0
+        for entry_type, entry in entries:
+            count += 1
+            if count <= checkpoint:
+                continue
+            buffer = buffers[entry_type]
+            buffer.append(entry)
+            if len(buffer) >= SEASEARCH_BULK_OPETATE_LIMIT:
+                self.apply_diff_entries(index_name, repo_id, entry_type, buffer, version)
+                buffers[entry_type] = []
+            if deadline and time.time() >= deadline:
+                break
+        else:
+            count = None
+
+        for entry_type, buffer in buffers.items():
+            if buffer:
+                self.apply_diff_entries(index_name, repo_id, entry_type, buffer, version)
+        return count
+
+    def apply_diff_entries(self, index_name, repo_id, entry_type, entries, version):
+        if entry_type == ADDED_FILE or entry_type == MODIFIED_FILE:
+            self.add_files(index_name, repo_id, entries, {}, version)
+        elif entry_type == DELETED_FILE:
+            self.delete_files(index_name, entries)
+        elif entry_type == ADDED_DIR:
+            self.add_dirs(index_name, repo_id, entries)
+        elif entry_type == DELETED_DIR:
+            self.delete_dirs(index_name, entries)
+            # entries are not ordered by type, only match the files under the
+            # dirs so that an added file of the same name is kept
+            self.delete_files_by_deleted_dirs(index_name, [d.rstrip('/') + '/' for d in entries])
 
     def update_repo_name(self, index_name, repo_id):
         repo = self.repo_data.get_repo_name_mtime_size(repo_id)
@@ -1,9 +1,13 @@
+from threading import Lock
+
+
 class RepoStatus(object):
-    def __init__(self, repo_id, from_commit, to_commit, metadata_updated_time):
+    def __init__(self, repo_id, from_commit, to_commit, metadata_updated_time, checkpoint=0):
         self.repo_id = repo_id
         self.from_commit = from_commit
         self.to_commit = to_commit
         self.metadata_updated_time = metadata_updated_time
+        self.checkpoint = checkpoint
 
     def need_recovery(self):
         return self.to_commit is not None
@@ -20,6 +24,10 @@ class RepoStatusIndex(object):
     When error occured during updating, the status is left in case (2). So the
     next time we update that repo, we can recover the failed process again.
 
+    An update stopped by its time budget is also left in case (2), with
+    checkpoint = <number of differences already indexed>, so it is resumed
+    from there instead of from the beginning.
+
     The elasticsearch document id for each repo in repo_head index is its repo
     id.
     """
@@ -38,6 +46,9 @@ class RepoStatusIndex(object):
             'metadata_updated_time': {
                 'type': 'keyword'
             },
+            'checkpoint': {
+                'type': 'numeric'
+            },
         },
     }
 
@@ -56,12 +67,13 @@ class RepoStatusIndex(object):
     def check_repo_status(self, repo_id):
         return self.seasearch_api.check_document_by_id(self.index_name, repo_id).get('is_exist')
 
-    def add_repo_status(self, repo_id, commit_id, updatingto,  metadata_updated_time):
+    def add_repo_status(self, repo_id, commit_id, updatingto,  metadata_updated_time, checkpoint=0):
         data = {
             'repo_id': repo_id,
             'commit_id': commit_id,
             'updatingto': updatingto,
             'metadata_updated_time': metadata_updated_time,
+            'checkpoint': checkpoint,
         }
 
         doc_id = repo_id
@@ -70,6 +82,9 @@ class RepoStatusIndex(object):
     def begin_update_repo(self, repo_id, old_commit_id, new_commit_id, metadata_updated_time):
         self.add_repo_status(repo_id, old_commit_id, new_commit_id, metadata_updated_time)
 
+    def checkpoint_update_repo(self, repo_id, old_commit_id, new_commit_id, metadata_updated_time, checkpoint):
+        self.add_repo_status(repo_id, old_commit_id, new_commit_id, metadata_updated_time, checkpoint)
+
     def finish_update_repo(self, repo_id, commit_id, metadata_updated_time):
         self.add_repo_status(repo_id, commit_id, None, metadata_updated_time)
 
@@ -85,8 +100,9 @@ class RepoStatusIndex(object):
         updatingto = doc['_source']['updatingto']
         metadata_updated_time = doc['_source']['metadata_updated_time']
         repo_id = doc['_source']['repo_id']
+        checkpoint = doc['_source'].get('checkpoint') or 0
 
-        return RepoStatus(repo_id, commit_id, updatingto, metadata_updated_time)
+        return RepoStatus(repo_id, commit_id, updatingto, metadata_updated_time, int(checkpoint))
 
     def update_repo_status_by_id(self, doc_id, data):
         self.seasearch_api.update_document_by_id(self.index_name, doc_id, data)
@@ -154,14 +170,109 @@ class RepoStatusIndex(object):
             commit_id = hit.get('_source').get('commit_id')
             updatingto = hit.get('_source').get('updatingto')
             metadata_updated_time = hit.get('_source').get('metadata_updated_time')
+            checkpoint = hit.get('_source').get('checkpoint') or 0
             repo_head = {
                 'repo_id': repo_id,
                 'commit_id': commit_id,
                 'updatingto': updatingto,
-                'metadata_updated_time': metadata_updated_time
+                'metadata_updated_time': metadata_updated_time,
+                'checkpoint': int(checkpoint),
             }
             repo_heads.append(repo_head)
         return repo_heads, total
 
     def delete_index_by_index_name(self):
         self.seasearch_api.delete_index_by_name(self.index_name)
+
+
+class RepoStatusStore(object):
+    """The statuses of all repos of a RepoStatusIndex loaded by pages, and
+    written back in bulk, so a sweep makes O(repos / page_size) requests.
+
+    It has the same methods as RepoStatusIndex used by the updater. As the
+    begin status is needed to recover an interrupted update, it is written
+    at once unless the update has nothing to recover. Other changes are kept
+    until ``page_size`` of them or ``flush``, losing them only repeats some
+    indexing.
+    """
+    def __init__(self, repo_status_index, page_size=2000):
+        self.repo_status_index = repo_status_index
+        self.page_size = page_size
+        self._statuses = {}
+        self._pending = {}
+        self._lock = Lock()
+
+    def load(self):
+        statuses = {}
+        for e in self.repo_status_index.get_all_repos_from_index():
+            statuses[e['repo_id']] = RepoStatus(e['repo_id'], e['commit_id'], e['updatingto'],
+                                                e['metadata_updated_time'], e['checkpoint'])
+        with self._lock:
+            self._statuses = statuses
+            self._pending = {}
+
+    def get_all_repos_from_index(self):
+        with self._lock:
+            return [{'repo_id': status.repo_id,
+                     'commit_id': status.from_commit,
+                     'updatingto': status.to_commit,
+                     'metadata_updated_time': status.metadata_updated_time,
+                     'checkpoint': status.checkpoint} for status in self._statuses.values()]
+
+    def get_repo_status_by_id(self, repo_id):
+        with self._lock:
+            status = self._statuses.get(repo_id)
+        if status is None:
+            return RepoStatus(repo_id, None, None, None)
+        return RepoStatus(status.repo_id, status.from_commit, status.to_commit,
+                          status.metadata_updated_time, status.checkpoint)
+
+    def _set_status(self, status, write_now=False):
+        with self._lock:
+            self._statuses[status.repo_id] = status
+            self._pending[status.repo_id] = status
+            if not write_now and len(self._pending) < self.page_size:
+                return
+            pending, self._pending = self._pending, {}
+        self._write(pending.values())
+
+    def _write(self, statuses):
+        bulk_params = []
+        for status in statuses:
+            bulk_params.append({'index': {'_index': self.repo_status_index.index_name, '_id': status.repo_id}})
+            bulk_params.append({
+                'repo_id': status.repo_id,
+                'commit_id': status.from_commit,
+                'updatingto': status.to_commit,
+                'metadata_updated_time': status.metadata_updated_time,
+                'checkpoint': status.checkpoint,
+            })
+        if bulk_params:
+            self.repo_status_index.seasearch_api.bulk(self.repo_status_index.index_name, bulk_params)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        self._write(pending.values())
+
+    def begin_update_repo(self, repo_id, old_commit_id, new_commit_id, metadata_updated_time):
+        with self._lock:
+            status = self._statuses.get(repo_id)
+        if status and status.from_commit == old_commit_id and status.to_commit == new_commit_id \
+                and status.checkpoint == 0:
+            return
+        # nothing needs to be recovered for an empty diff
+        write_now = old_commit_id != new_commit_id
+        self._set_status(RepoStatus(repo_id, old_commit_id, new_commit_id, metadata_updated_time), write_now)
+
+    def checkpoint_update_repo(self, repo_id, old_commit_id, new_commit_id, metadata_updated_time, checkpoint):
+        self._set_status(RepoStatus(repo_id, old_commit_id, new_commit_id, metadata_updated_time, checkpoint))
+
+    def finish_update_repo(self, repo_id, commit_id, metadata_updated_time):
+        self._set_status(RepoStatus(repo_id, commit_id, None, metadata_updated_time))
+
+    def delete_documents_by_repo(self, repo_id):
+        with self._lock:
+            self._statuses.pop(repo_id, None)
+            self._pending.pop(repo_id, None)
+        return self.repo_status_index.delete_documents_by_repo(repo_id)
@@ -5,6 +5,7 @@ import json
 from seafevents.seasearch.utils import get_library_diff_files, is_wiki_page, md5
 from seafevents.seasearch.utils.extract import extract_sdoc_text
 from seafevents.seasearch.utils.constants import ZERO_OBJ_ID, WIKI_INDEX_PREFIX
+from seafevents.utils.extract_cache import extract_cache
 from seafevents.utils.constants import WIKI_PAGES_DIR, WIKI_CONFIG_PATH, WIKI_CONFIG_FILE_NAME
 from seafobj import fs_mgr, commit_mgr
 from seaserv import seafile_api
@@ -127,6 +128,9 @@ class WikiIndex(object):
     def get_wiki_content(self, wiki_id, obj_id):
         if obj_id == ZERO_OBJ_ID:
             return None
+        return extract_cache.get_or_extract('wiki', obj_id, lambda: self._get_wiki_content(wiki_id, obj_id))
+
+    def _get_wiki_content(self, wiki_id, obj_id):
         f = fs_mgr.load_seafile(wiki_id, 1, obj_id)
         b_content = f.get_content()
         if not b_content.strip():
@@ -1,18 +1,32 @@
+import json
 import logging
 import time
-from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+from seafevents.app.event_redis import RedisClient
 from seafevents.seasearch.index_store.index_manager import IndexManager
 from seafevents.seasearch.index_store.repo_file_index import RepoFileIndex
-from seafevents.seasearch.index_store.repo_status_index import RepoStatusIndex
-from seafevents.seasearch.utils.constants import REPO_STATUS_FILE_INDEX_NAME, SHARD_NUM, REPO_TYPE_WIKI
+from seafevents.seasearch.index_store.repo_status_index import RepoStatusIndex, RepoStatusStore
+from seafevents.seasearch.utils import get_commit_ctime
+from seafevents.seasearch.utils.constants import REPO_STATUS_FILE_INDEX_NAME, SHARD_NUM, REPO_TYPE_WIKI, \
+    ZERO_OBJ_ID
 from seafevents.seasearch.utils.seasearch_api import SeaSearchAPI
 from seafevents.repo_data import repo_data
-from seafevents.utils import parse_bool, get_opt_from_conf_or_env, parse_interval
-from seafevents.events.metrics import handle_metric_timing
+from seafevents.utils import parse_bool, get_opt_from_conf_or_env, parse_interval, parse_workers
+from seafevents.events.metrics import handle_metric_timing, publish_metric
 
 
 logger = logging.getLogger('seasearch')
 
+INDEX_WORKERS = 3
+# Time a worker spends on one library per run before checkpointing it
+REPO_TIME_BUDGET = 30 * 60
+REPO_QUERY_CHUNK = 1000
+# Event driven mode: libraries updated since the last run are indexed every
+# DIRTY_REPO_INTERVAL, all libraries are checked every RECONCILE_INTERVAL
+DIRTY_REPO_INTERVAL = 60
+RECONCILE_INTERVAL = 24 * 60 * 60
+
 
 class RepoFileIndexUpdater(object):
     def __init__(self, config):
@@ -32,6 +46,11 @@ class RepoFileIndexUpdater(object):
         key_seasearch_url = 'seasearch_url'
         key_seasearch_token = 'seasearch_token'
         key_index_interval = 'interval'
+        key_index_workers = 'index_workers'
+        key_repo_time_budget = 'repo_time_budget'
+        key_event_driven = 'event_driven'
+        key_dirty_interval = 'dirty_interval'
+        key_reconcile_interval = 'reconcile_interval'
 
         default_index_interval = 30 * 60 # 30 min
 
@@ -54,6 +73,18 @@ class RepoFileIndexUpdater(object):
         interval = get_opt_from_conf_or_env(config, section_name, key_index_interval,
                                             default=default_index_interval)
         interval = parse_interval(interval, default_index_interval)
+        workers = get_opt_from_conf_or_env(config, section_name, key_index_workers, default=INDEX_WORKERS)
+        workers = parse_workers(workers, INDEX_WORKERS)
+        time_budget = get_opt_from_conf_or_env(config, section_name, key_repo_time_budget, default=REPO_TIME_BUDGET)
+        time_budget = parse_interval(time_budget, REPO_TIME_BUDGET)
+        event_driven = get_opt_from_conf_or_env(config, section_name, key_event_driven, default=False)
+        event_driven = parse_bool(event_driven)
+        dirty_interval = get_opt_from_conf_or_env(config, section_name, key_dirty_interval,
+                                                  default=DIRTY_REPO_INTERVAL)
+        dirty_interval = parse_interval(dirty_interval, DIRTY_REPO_INTERVAL)
+        reconcile_interval = get_opt_from_conf_or_env(config, section_name, key_reconcile_interval,
+                                                      default=RECONCILE_INTERVAL)
+        reconcile_interval = parse_interval(reconcile_interval, RECONCILE_INTERVAL)
 
         self.seasearch_api = SeaSearchAPI(
             seasearch_url,
@@ -61,6 +92,11 @@ class RepoFileIndexUpdater(object):
         )
         self._repo_data = repo_data
         self._interval = interval
+        self._workers = workers
+        self._time_budget = time_budget
+        self._event_driven = event_driven
+        self._dirty_interval = dirty_interval
+        self._reconcile_interval = reconcile_interval
 
         try:
             self._repo_status_file_index = RepoStatusIndex(
@@ -86,13 +122,38 @@ class RepoFileIndexUpdater(object):
             logging.warning('Can not start seasearch file index updater: it is not enabled!')
             return
 
-        logging.info('Start to update seasearch file index, interval = %s sec', self._interval)
+        if self._event_driven:
+            redis_client = RedisClient()
+            if redis_client.connection:
+                logging.info('Start to update seasearch file index of updated repos, interval = %s sec, '
+                             'reconcile interval = %s sec, workers = %s, repo time budget = %s sec',
+                             self._dirty_interval, self._reconcile_interval, self._workers, self._time_budget)
+                dirty_repos = DirtyRepoSet()
+                RepoUpdateSubscriber(redis_client, dirty_repos).start()
+                RepoFileIndexEventUpdater(
+                    self._repo_status_file_index,
+                    self._repo_file_index,
+                    self._index_manager,
+                    self._repo_data,
+                    dirty_repos,
+                    self._dirty_interval,
+                    self._reconcile_interval,
+                    self._workers,
+                    self._time_budget
+                ).start()
+                return
+            logging.warning('Redis has not been set up, seasearch file index falls back to periodical update.')
+
+        logging.info('Start to update seasearch file index, interval = %s sec, workers = %s, repo time budget = %s sec',
+                     self._interval, self._workers, self._time_budget)
         RepoFileIndexUpdaterTimer(
             self._repo_status_file_index,
             self._repo_file_index,
             self._index_manager,
             self._repo_data,
-            self._interval
+            self._interval,
+            self._workers,
+            self._time_budget
         ).start()
 
 
@@ -111,17 +172,19 @@ def clear_deleted_repo(repo_status_file_index, repo_file_index, index_manager, r
     logger.info("file index deleted repo has been cleared")
 
 
-@handle_metric_timing('seasearch_index_duration_seconds')
-def update_repo_file_indexes(repo_status_file_index, repo_file_index, index_manager, repo_data):
+def list_repos_to_index(repo_data):
+    """Return [(repo_id, commit_id, metadata_query_time)] of the libraries to
+    index, None on error.
+    """
     start, count = 0, 1000
-    all_repos = []
+    repos = []
 
     while True:
         try:
             repo_commits = repo_data.get_repo_id_commit_id(start, count)
         except Exception as e:
             logger.error("Error: %s" % e)
-            return
+            return None
         start += 1000
 
         if len(repo_commits) == 0:
@@ -135,23 +198,205 @@ def update_repo_file_indexes(repo_status_file_index, repo_file_index, index_mana
         for repo_id, commit_id, repo_type in repo_commits:
             if repo_id in virtual_repo_set or repo_type == REPO_TYPE_WIKI:
                 continue
-            all_repos.append(repo_id)
+            repos.append((repo_id, commit_id, metadata_query_time))
+
+    return repos
+
+
+def sort_repos_by_staleness(repos, repo_status_store, repo_data):
+    """Put the libraries whose head is not indexed first, return them and
+    their number.
+
+    The library whose indexed commit is the oldest goes first, and libraries
+    as stale as each other (in the same hour) go by the size of the change,
+    the whole library for the first index, so small ones are not stuck
+    behind a huge one.
+    """
+    pending, unchanged = [], []
+    for repo in repos:
+        status = repo_status_store.get_repo_status_by_id(repo[0])
+        if status.from_commit == repo[1] and not status.need_recovery():
+            # may still have metadata to index
+            unchanged.append(repo)
+        else:
+            pending.append(repo)
+
+    mtime_sizes = {}
+    pending_ids = [repo[0] for repo in pending]
+    for i in range(0, len(pending_ids), REPO_QUERY_CHUNK):
+        for repo_id, mtime, size in repo_data.get_repos_mtime_size(pending_ids[i: i + REPO_QUERY_CHUNK]):
+            mtime_sizes[repo_id] = (mtime or 0, size or 0)
+
+    now = time.time()
+    priorities = {}
+    for repo_id, commit_id, _ in pending:
+        mtime, size = mtime_sizes.get(repo_id, (0, 0))
+        indexed_commit = repo_status_store.get_repo_status_by_id(repo_id).from_commit
+        if indexed_commit and indexed_commit != ZERO_OBJ_ID:
+            indexed_time = get_commit_ctime(repo_id, indexed_commit) or mtime
+            size = 0
+        else:
+            indexed_time = mtime
+        priorities[repo_id] = (-int((now - indexed_time) // 3600), size)
+
+    pending.sort(key=lambda repo: priorities[repo[0]])
+    return pending + unchanged, len(pending)
 
-            index_manager.update_library_file_index(repo_id, commit_id, repo_file_index, repo_status_file_index, metadata_query_time)
 
-    logger.info("Finish updating file index")
+@handle_metric_timing('seasearch_index_duration_seconds')
+def update_repo_file_indexes(repo_status_file_index, repo_file_index, index_manager, repo_data,
+                             workers=1, time_budget=None, dirty_repos=None):
+    repos = list_repos_to_index(repo_data)
+    if repos is None:
+        return
+    # the statuses are read by pages and written in bulk during the sweep
+    repo_status_store = RepoStatusStore(repo_status_file_index)
+    repo_status_store.load()
+
+    repos, backlog = sort_repos_by_staleness(repos, repo_status_store, repo_data)
+    logger.info('%d libraries to check, %d of them have new commits', len(repos), backlog)
+    try:
+        stopped = index_repos(repos, backlog, repo_status_store, repo_file_index, index_manager, workers, time_budget)
+    finally:
+        repo_status_store.flush()
+    if dirty_repos is not None:
+        # continue them with the updated libraries
+        for repo in stopped:
+            dirty_repos.add(repo[0])
+
+    clear_deleted_repo(repo_status_store, repo_file_index, index_manager, [repo[0] for repo in repos])
+
+
+def index_repos(repos, backlog, repo_status_file_index, repo_file_index, index_manager, workers, time_budget):
+    """Index the repos on a pool of ``workers`` threads, the first ``backlog``
+    of them have new commits. Return the repos stopped by the time budget.
+    """
+    def update(repo):
+        repo_id, commit_id, metadata_query_time = repo
+        deadline = time.time() + time_budget if time_budget else None
+        return index_manager.update_library_file_index(repo_id, commit_id, repo_file_index, repo_status_file_index,
+                                                       metadata_query_time, deadline)
+
+    start = time.time()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(update, repos))
+    duration = time.time() - start
+
+    updated = sum(1 for result in results[:backlog] if result)
+    checkpointed = results.count(False)
+    failed = results.count(None)
+    logger.info("Finish updating file index, %d updated, %d checkpointed, %d failed in %.1f seconds",
+                updated, checkpointed, failed, duration)
+    publish_metric('seasearch_index_backlog_repos', backlog, 'Libraries with new commits at the start of the last run')
+    publish_metric('seasearch_index_remaining_repos', backlog - updated,
+                   'Libraries with new commits left by the last run')
+    publish_metric('seasearch_index_checkpointed_repos', checkpointed,
+                   'Libraries stopped by the time budget in the last run')
+    publish_metric('seasearch_index_failed_repos', failed, 'Libraries failed in the last run')
+    publish_metric('seasearch_index_repos_per_minute', round(updated * 60 / max(duration, 1), 2),
+                   'Libraries with new commits indexed per minute in the last run')
+    return [repo for repo, result in zip(repos, results) if result is False]
+
+
+def update_dirty_repo_file_indexes(repo_status_file_index, repo_file_index, index_manager, repo_data, dirty_repos,
+                                   workers=1, time_budget=None):
+    """Index the libraries updated since the last run, without checking the
+    others.
+    """
+    repo_ids = dirty_repos.take()
+    publish_metric('seasearch_index_dirty_repos', len(repo_ids), 'Updated libraries taken by the last run')
+    if not repo_ids:
+        return
+
+    repos = []
+    try:
+        for i in range(0, len(repo_ids), REPO_QUERY_CHUNK):
+            repo_commits = repo_data.get_repos_id_commit_id(repo_ids[i: i + REPO_QUERY_CHUNK])
+            metadata_query_time = time.time()
+            virtual_repos = repo_data.get_virtual_repo_in_repos([repo[0] for repo in repo_commits])
+            virtual_repo_set = {repo[0] for repo in virtual_repos}
+            for repo_id, commit_id, repo_type in repo_commits:
+                if repo_id in virtual_repo_set or repo_type == REPO_TYPE_WIKI:
+                    continue
+                repos.append((repo_id, commit_id, metadata_query_time))
+    except Exception:
+        for repo_id in repo_ids:
+            dirty_repos.add(repo_id)
+        raise
+
+    logger.info('%d libraries are updated', len(repos))
+    stopped = index_repos(repos, len(repos), repo_status_file_index, repo_file_index, index_manager,
+                          workers, time_budget)
+    # continue them in the next run
+    for repo in stopped:
+        dirty_repos.add(repo[0])
+
+
+class DirtyRepoSet(object):
+    """Ids of the libraries updated since they were last taken, in the order
+    of their first update.
+    """
+    def __init__(self):
+        self._repos = {}
+        self._lock = Lock()
+
+    def add(self, repo_id):
+        with self._lock:
+            self._repos[repo_id] = None
+
+    def take(self):
+        with self._lock:
+            repos, self._repos = self._repos, {}
+        return list(repos)
+
+    def __len__(self):
+        return len(self._repos)
+
+
+class RepoUpdateSubscriber(Thread):
+    """Add the libraries of the repo_update messages to the dirty set."""
+    def __init__(self, redis_client, dirty_repos):
+        super(RepoUpdateSubscriber, self).__init__()
+        self.daemon = True
+        self._redis_client = redis_client
+        self._dirty_repos = dirty_repos
+        self.finished = Event()
 
-    clear_deleted_repo(repo_status_file_index, repo_file_index, index_manager, all_repos)
+    def run(self):
+        subscriber = self._redis_client.get_subscriber('repo_update')
+        while not self.finished.is_set():
+            try:
+                msg = subscriber.get_message()
+                if msg:
+                    try:
+                        repo_id = json.loads(msg.get('data')).get('repo_id')
+                    except Exception as e:
+                        logger.error('parse repo_update message error: %s' % e)
+                        continue
+                    if repo_id:
+                        self._dirty_repos.add(repo_id)
+                else:
+                    time.sleep(1)
+            except Exception as e:
+                logger.error('Failed to get repo_update message: %s' % e)
+                time.sleep(1)
+                subscriber = self._redis_client.get_subscriber('repo_update')
+
+    def cancel(self):
+        self.finished.set()
 
 
 class RepoFileIndexUpdaterTimer(Thread):
-    def __init__(self, repo_status_file_index, repo_file_index, index_manager, repo_data, interval):
+    def __init__(self, repo_status_file_index, repo_file_index, index_manager, repo_data, interval,
+                 workers=1, time_budget=None):
         super(RepoFileIndexUpdaterTimer, self).__init__()
         self.repo_status_file_index = repo_status_file_index
         self.repo_file_index = repo_file_index
         self.index_manager = index_manager
         self.repo_data = repo_data
         self.interval = interval
+        self.workers = workers
+        self.time_budget = time_budget
         self.finished = Event()
 
     def run(self):
@@ -160,9 +405,59 @@ class RepoFileIndexUpdaterTimer(Thread):
             if not self.finished.is_set():
                 logger.info('starts to update seasearch file index...')
                 try:
-                    update_repo_file_indexes(self.repo_status_file_index, self.repo_file_index, self.index_manager, self.repo_data)
+                    update_repo_file_indexes(self.repo_status_file_index, self.repo_file_index, self.index_manager,
+                                             self.repo_data, self.workers, self.time_budget)
                 except Exception as e:
                     logger.exception('periodical update seasearch file index error: %s', e)
 
     def cancel(self):
         self.finished.set()
+
+
+class RepoFileIndexEventUpdater(Thread):
+    """Index the updated libraries every ``interval``, and check all of them
+    every ``reconcile_interval`` in case any update message is lost, e.g.
+    while seafevents is restarting.
+    """
+    def __init__(self, repo_status_file_index, repo_file_index, index_manager, repo_data, dirty_repos,
+                 interval, reconcile_interval, workers=1, time_budget=None):
+        super(RepoFileIndexEventUpdater, self).__init__()
+        self.repo_status_file_index = repo_status_file_index
+        self.repo_file_index = repo_file_index
+        self.index_manager = index_manager
+        self.repo_data = repo_data
+        self.dirty_repos = dirty_repos
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.workers = workers
+        self.time_budget = time_budget
+        self.finished = Event()
+
+    def run(self):
+        # check all the libraries on start
+        last_reconcile_time = 0
+        while not self.finished.is_set():
+            self.finished.wait(self.interval)
+            if self.finished.is_set():
+                break
+            if time.time() - last_reconcile_time >= self.reconcile_interval:
+                logger.info('starts to reconcile seasearch file index...')
+                # the full update covers the libraries updated before it starts
+                self.dirty_repos.take()
+                last_reconcile_time = time.time()
+                try:
+                    update_repo_file_indexes(self.repo_status_file_index, self.repo_file_index, self.index_manager,
+                                             self.repo_data, self.workers, self.time_budget, self.dirty_repos)
+                except Exception as e:
+                    logger.exception('reconcile seasearch file index error: %s', e)
+                continue
+
+            try:
+                update_dirty_repo_file_indexes(self.repo_status_file_index, self.repo_file_index,
+                                               self.index_manager, self.repo_data, self.dirty_repos,
+                                               self.workers, self.time_budget)
+            except Exception as e:
+                logger.exception('update seasearch file index of updated repos error: %s', e)
+
+    def cancel(self):
+        self.finished.set()
@@ -9,6 +9,7 @@ import threading
 from seafobj import commit_mgr, fs_mgr, block_mgr
 from seafevents.utils import get_opt_from_conf_or_env
 from seafevents.app.config import get_config
+from seafevents.utils.extract_cache import extract_cache
 from seafevents.seasearch.utils import init_logging
 from seafevents.repo_data import repo_data
 from seafevents.seasearch.index_store.index_manager import IndexManager
@@ -155,6 +156,7 @@ def start_index_local():
     section_name = 'SEASEARCH'
     seafevents_conf = os.environ.get('EVENTS_CONFIG_FILE')
     config = get_config(seafevents_conf)
+    extract_cache.init(config)
     seasearch_url = get_opt_from_conf_or_env(
         config, section_name, 'seasearch_url'
     )
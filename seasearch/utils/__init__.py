@@ -15,16 +15,13 @@ logger = logging.getLogger(__name__)
 SYS_DIRS = ['images', '_Internal']
 WIKI_DIRS = ['wiki-pages']
 
-def get_library_diff_files(repo_id, old_commit_id, new_commit_id):
-    version = 1
-    if old_commit_id == new_commit_id:
-        return [], [], [], [], [], version
-
+def _get_diff_roots(repo_id, old_commit_id, new_commit_id):
+    """Return (old_root, new_commit), new_commit is None if it can not be loaded."""
     old_root = None
     if old_commit_id:
         try:
             old_commit = commit_mgr.load_commit(repo_id, 0, old_commit_id)
-            old_root = old_commit.root_id
+            old_root = old_commit.root_id if old_commit else None
         except GetObjectError as e:
             logger.debug(e)
             old_root = None
@@ -34,6 +31,28 @@ def get_library_diff_files(repo_id, old_commit_id, new_commit_id):
     except GetObjectError as e:
         # new commit should exists in the obj store
         logger.warning(e)
+        return old_root, None
+
+    return old_root, new_commit
+
+
+def get_commit_ctime(repo_id, commit_id):
+    """Return the ctime of the commit, None if it can not be loaded."""
+    try:
+        commit = commit_mgr.load_commit(repo_id, 0, commit_id)
+    except GetObjectError as e:
+        logger.debug(e)
+        return None
+    return commit.ctime if commit else None
+
+
+def get_library_diff_files(repo_id, old_commit_id, new_commit_id):
+    version = 1
+    if old_commit_id == new_commit_id:
+        return [], [], [], [], [], version
+
+    old_root, new_commit = _get_diff_roots(repo_id, old_commit_id, new_commit_id)
+    if new_commit is None:
         return [], [], [], [], [], version
 
     new_root = new_commit.root_id
@@ -50,6 +69,25 @@ def get_library_diff_files(repo_id, old_commit_id, new_commit_id):
     return added_files, deleted_files, modified_files, added_dirs, deleted_dirs, version
 
 
+def iter_library_diff(repo_id, old_commit_id, new_commit_id):
+    """Return a generator of the (entry_type, entry) differences and the repo version.
+
+    Unlike get_library_diff_files, errors of the differ are raised to the caller
+    while iterating.
+    """
+    version = 1
+    if old_commit_id == new_commit_id:
+        return iter(()), version
+
+    old_root, new_commit = _get_diff_roots(repo_id, old_commit_id, new_commit_id)
+    if new_commit is None:
+        return iter(()), version
+
+    version = new_commit.get_version()
+    differ = CommitDiffer(repo_id, version, old_root, new_commit.root_id)
+    return differ.iter_diff(new_commit.ctime), version
+
+
 def init_logging(args):
     level = args.loglevel
 
@@ -1,93 +1,133 @@
 # coding: UTF-8
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from seafevents.seasearch.utils.constants import ZERO_OBJ_ID
+from seafevents.utils.diff_cache import diff_cache
 
 from seafobj import fs_mgr
 
+# entry types yielded by CommitDiffer.iter_diff
+ADDED_FILE = 'added_file'
+DELETED_FILE = 'deleted_file'
+MODIFIED_FILE = 'modified_file'
+ADDED_DIR = 'added_dir'
+DELETED_DIR = 'deleted_dir'
+
+# number of queued directories loaded ahead of the one being compared
+DIFF_PREFETCH_SIZE = 64
+
 
 class CommitDiffer(object):
-    def __init__(self, repo_id, version, root1, root2):
+    def __init__(self, repo_id, version, root1, root2, workers=4):
         self.repo_id = repo_id
         self.version = version
         self.root1 = root1
         self.root2 = root2
+        self.workers = workers
+
+    def diff(self, root2_time):
+        added_files, deleted_files, added_dirs, deleted_dirs, modified_files = \
+            diff_cache.get_or_diff('tree', self.repo_id, self.root1, self.root2,
+                                   lambda: self._diff(root2_time))
+        if added_dirs and added_dirs[0][0] == '/':
+            # the same root may be shared by commits created at different time
+            added_dirs[0] = ('/', added_dirs[0][1], root2_time, None)
+        return (added_files, deleted_files, added_dirs, deleted_dirs,
+                modified_files)
 
-    def diff(self, root2_time): # noqa: C901
-        added_files = []
-        deleted_files = []
-        deleted_dirs = []
-        modified_files = []
-        added_dirs = []
+    def _diff(self, root2_time):
+        results = {ADDED_FILE: [], DELETED_FILE: [], ADDED_DIR: [], DELETED_DIR: [], MODIFIED_FILE: []}
+        for entry_type, entry in self.iter_diff(root2_time):
+            results[entry_type].append(entry)
+        return (results[ADDED_FILE], results[DELETED_FILE], results[ADDED_DIR],
+                results[DELETED_DIR], results[MODIFIED_FILE])
 
-        new_dirs = [] # (path, dir_id)
-        queued_dirs = [] # (path, dir_id1, dir_id2)
+    def iter_diff(self, root2_time):
+        """Yield (entry_type, entry) for every difference between the two roots.
 
+        Directories are walked breadth first, the objects of the next queued
+        directories are loaded by a thread pool before they are compared.
+        """
         if ZERO_OBJ_ID == self.root1:
             self.root1 = None
         if ZERO_OBJ_ID == self.root2:
             self.root2 = None
 
+        queued_dirs = deque() # (path, dir_id1, dir_id2), dir_id1 is None for added dirs
         if self.root1 == self.root2:
-            return (added_files, deleted_files, added_dirs, deleted_dirs,
-                    modified_files)
+            return
         elif not self.root1:
-            new_dirs.append(('/', self.root2, root2_time, None))
+            yield ADDED_DIR, ('/', self.root2, root2_time, None)
+            queued_dirs.append(('/', None, self.root2))
         elif not self.root2:
-            deleted_dirs.append('/')
+            yield DELETED_DIR, '/'
+            return
         else:
             queued_dirs.append(('/', self.root1, self.root2))
 
-        while True:
-            path = old_id = new_id = None
-            try:
-                path, old_id, new_id = queued_dirs.pop(0)
-            except IndexError:
-                break
-
-            dir1 = fs_mgr.load_seafdir(self.repo_id, self.version, old_id)
-            dir2 = fs_mgr.load_seafdir(self.repo_id, self.version, new_id)
-
+        if self.workers > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                yield from self._walk(queued_dirs, pool)
+        else:
+            yield from self._walk(queued_dirs, None)
+
+    def _load_dirs(self, obj_ids):
+        return [fs_mgr.load_seafdir(self.repo_id, self.version, obj_id) for obj_id in obj_ids]
+
+    def _walk(self, queued_dirs, pool): # noqa: C901
+        loading = deque() # (path, dir_id1, dir_id2, future)
+        while queued_dirs or loading:
+            while queued_dirs and (not loading or pool and len(loading) < DIFF_PREFETCH_SIZE):
+                path, old_id, new_id = queued_dirs.popleft()
+                obj_ids = [new_id] if old_id is None else [old_id, new_id]
+                future = pool.submit(self._load_dirs, obj_ids) if pool else None
+                loading.append((path, old_id, new_id, future))
+
+            path, old_id, new_id, future = loading.popleft()
+            if future:
+                dirs = future.result()
+            else:
+                dirs = self._load_dirs([new_id] if old_id is None else [old_id, new_id])
+
+            if old_id is None:
+                # Process newly added dirs and its sub-dirs, all files under
+                # these dirs should be marked as added.
+                d = dirs[0]
+                for dent in d.get_files_list():
+                    yield ADDED_FILE, (make_path(path, dent.name), dent.id, dent.mtime, dent.size)
+                for dent in d.get_subdirs_list():
+                    sub_path = make_path(path, dent.name)
+                    yield ADDED_DIR, (sub_path, dent.id, dent.mtime, dent.size)
+                    queued_dirs.append((sub_path, None, dent.id))
+                continue
+
+            dir1, dir2 = dirs
             for dent in dir1.get_files_list():
                 new_dent = dir2.lookup_dent(dent.name)
                 if not new_dent or new_dent.type != dent.type:
-                    deleted_files.append((make_path(path, dent.name), ))
+                    yield DELETED_FILE, (make_path(path, dent.name), )
                 else:
                     dir2.remove_entry(dent.name)
-                    if new_dent.id == dent.id:
-                        pass
-                    else:
-                        modified_files.append((make_path(path, dent.name), new_dent.id, new_dent.mtime, new_dent.size))
+                    if new_dent.id != dent.id:
+                        yield MODIFIED_FILE, (make_path(path, dent.name), new_dent.id, new_dent.mtime, new_dent.size)
 
-            added_files.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in dir2.get_files_list()])
+            for dent in dir2.get_files_list():
+                yield ADDED_FILE, (make_path(path, dent.name), dent.id, dent.mtime, dent.size)
 
             for dent in dir1.get_subdirs_list():
                 new_dent = dir2.lookup_dent(dent.name)
                 if not new_dent or new_dent.type != dent.type:
-                    deleted_dirs.append(make_path(path, dent.name))
+                    yield DELETED_DIR, make_path(path, dent.name)
                 else:
                     dir2.remove_entry(dent.name)
-                    if new_dent.id == dent.id:
-                        pass
-                    else:
+                    if new_dent.id != dent.id:
                         queued_dirs.append((make_path(path, dent.name), dent.id, new_dent.id))
 
-            new_dirs.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in dir2.get_subdirs_list()])
-
-        while True:
-            # Process newly added dirs and its sub-dirs, all files under
-            # these dirs should be marked as added.
-            path = obj_id = None
-            try:
-                path, obj_id, mtime, size = new_dirs.pop(0)
-                added_dirs.append((path, obj_id, mtime, size))
-            except IndexError:
-                break
-            d = fs_mgr.load_seafdir(self.repo_id, self.version, obj_id)
-            added_files.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in d.get_files_list()])
-
-            new_dirs.extend([(make_path(path, dent.name), dent.id, dent.mtime, dent.size) for dent in d.get_subdirs_list()])
-
-        return (added_files, deleted_files, added_dirs, deleted_dirs,
-                modified_files)
+            for dent in dir2.get_subdirs_list():
+                sub_path = make_path(path, dent.name)
+                yield ADDED_DIR, (sub_path, dent.id, dent.mtime, dent.size)
+                queued_dirs.append((sub_path, None, dent.id))
 
 
 def search_entry(entries, entryname):
@@ -10,6 +10,7 @@ from zipfile import ZipFile
 from io import BytesIO
 
 from seafevents.utils import run_and_wait
+from seafevents.utils.extract_cache import extract_cache
 from seafevents.seasearch.utils.constants import text_suffixes, office_suffixes, ZERO_OBJ_ID
 
 from seafobj import fs_mgr
@@ -154,15 +155,24 @@ def is_text_office(filename):
     return is_text_file(filename) or is_office_pdf(filename)
 
 class Extractor(object):
-    def __init__(self, func):
+    def __init__(self, func, suffix=None):
         self.func = func
+        self.suffix = suffix
 
-    def extract(self, repo_id, version, obj_id, path):
+    def load(self, repo_id, version, obj_id):
         if obj_id == ZERO_OBJ_ID:
             return None
 
         f = fs_mgr.load_seafile(repo_id, version, obj_id)
-        content = f.get_content()
+        return f.get_content()
+
+    def extract(self, repo_id, version, obj_id, path):
+        # the text of an object is the same in every library and path
+        return extract_cache.get_or_extract(self.suffix, obj_id,
+                                            lambda: self._extract(repo_id, version, obj_id, path))
+
+    def _extract(self, repo_id, version, obj_id, path):
+        content = self.load(repo_id, version, obj_id)
         if not content:
             # An empty file
             return None
@@ -208,4 +218,4 @@ class ExtractorFactory(object):
         func = EXTRACT_TEXT_FUNCS.get(suffix, None)
         if not func:
             return None
-        return Extractor(func)
+        return Extractor(func, suffix)
@@ -0,0 +1,219 @@
+# coding: UTF-8
+import time
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from concurrent.futures import Future
+from threading import Thread, Condition
+from collections import deque
+
+from seafevents.events.metrics import publish_metric
+
+logger = logging.getLogger('seasearch')
+
+
+class ExtractTimeout(Exception):
+    pass
+
+
+def _extract_worker(conn):
+    from seafevents.seasearch.utils.extract import EXTRACT_TEXT_FUNCS
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        suffix, content = task
+        try:
+            conn.send((True, EXTRACT_TEXT_FUNCS[suffix](content)))
+        except Exception as e:
+            conn.send((False, '%s: %s' % (e.__class__.__name__, e)))
+
+
+class _Worker(object):
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_extract_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.deadline = None
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+        except Exception as e:
+            logger.warning('failed to kill content extract worker: %s', e)
+
+
+class _Task(object):
+    __slots__ = ('suffix', 'content', 'size', 'future', 'start')
+
+    def __init__(self, suffix, content):
+        self.suffix = suffix
+        self.content = content
+        self.size = len(content)
+        self.future = Future()
+        self.start = None
+
+
+class ContentExtractPool(object):
+    """Parse office and pdf files in worker processes.
+
+    ``submit`` returns a Future of the extracted bytes. It blocks while the
+    contents submitted and not yet parsed are over ``max_memory`` bytes, so
+    the indexing threads can not load a whole library into memory. A worker
+    which takes more than ``timeout`` seconds on a file is killed and
+    replaced, the Future gets an ExtractTimeout. If the dispatcher thread
+    fails, all the pending Futures get its error and the next submit starts
+    it again.
+
+    Workers are started on the first submit, with spawn as the indexing
+    process runs many threads.
+    """
+    def __init__(self, workers, timeout, max_memory):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self._ctx = multiprocessing.get_context('spawn')
+        self._cond = Condition()
+        self._queue = deque()
+        self._memory = 0
+        self._wake_r = self._wake_w = None
+        self._thread = None
+        self._stats = {}
+
+    def _start(self):
+        self._wake_r, self._wake_w = self._ctx.Pipe(duplex=False)
+        self._thread = Thread(target=self._dispatch, name='content-extract-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, suffix, content):
+        task = _Task(suffix, content)
+        with self._cond:
+            if self._thread is None:
+                self._start()
+            # a file larger than max_memory is parsed when it is the only one
+            while self._memory and self._memory + task.size > self.max_memory:
+                self._cond.wait()
+            self._memory += task.size
+            self._queue.append(task)
+            wake_w = self._wake_w
+        wake_w.send_bytes(b'')
+        return task.future
+
+    def _finish(self, task, ok, result):
+        duration = time.time() - task.start
+        with self._cond:
+            self._memory -= task.size
+            stats = self._stats.setdefault(task.suffix, [0, 0.0, 0, 0])
+            stats[0] += 1
+            stats[1] += duration
+            if not ok:
+                stats[2] += 1
+                if isinstance(result, ExtractTimeout):
+                    stats[3] += 1
+            self._cond.notify_all()
+        task.content = None
+        if ok:
+            task.future.set_result(result)
+        else:
+            task.future.set_exception(result)
+
+    def _dispatch(self):
+        idle = []
+        busy = {}
+        try:
+            self._run(idle, busy)
+        except Exception as e:
+            logger.exception('content extract dispatcher failed: %s', e)
+            self._abort(idle, busy, e)
+
+    def _abort(self, idle, busy, error):
+        for worker in idle + list(busy.values()):
+            worker.kill()
+        with self._cond:
+            tasks = [w.task for w in busy.values() if w.task] + list(self._queue)
+            self._queue = deque()
+            self._memory = 0
+            self._thread = None
+            self._cond.notify_all()
+        for task in tasks:
+            task.content = None
+            if not task.future.done():
+                task.future.set_exception(RuntimeError('content extract dispatcher failed: %s' % error))
+
+    def _run(self, idle, busy):  # noqa: C901
+        for _ in range(self.workers):
+            idle.append(_Worker(self._ctx))
+        while True:
+            with self._cond:
+                while idle and self._queue:
+                    task = self._queue.popleft()
+                    worker = idle.pop()
+                    task.start = time.time()
+                    worker.task = task
+                    worker.deadline = task.start + self.timeout
+                    try:
+                        worker.conn.send((task.suffix, task.content))
+                        busy[worker.conn] = worker
+                    except Exception as e:
+                        # the worker is dead, parse the file again by a new one
+                        logger.warning('content extract worker failed: %s', e)
+                        worker.kill()
+                        task.start = None
+                        self._queue.appendleft(task)
+                        idle.append(_Worker(self._ctx))
+
+            timeout = None
+            if busy:
+                timeout = max(min(w.deadline for w in busy.values()) - time.time(), 0)
+            ready = wait(list(busy.keys()) + [self._wake_r], timeout)
+
+            for conn in ready:
+                if conn is self._wake_r:
+                    while self._wake_r.poll():
+                        self._wake_r.recv_bytes()
+                    continue
+                # a worker stays in busy until its task is finished, so the task
+                # is failed if the dispatcher fails in between
+                worker = busy[conn]
+                try:
+                    ok, result = conn.recv()
+                except (EOFError, OSError) as e:
+                    # killed by the system, e.g. out of memory
+                    del busy[conn]
+                    worker.kill()
+                    self._finish(worker.task, False, RuntimeError('worker exited: %s' % e))
+                    idle.append(_Worker(self._ctx))
+                    continue
+                del busy[conn]
+                task, worker.task = worker.task, None
+                self._finish(task, ok, result if ok else RuntimeError(result))
+                idle.append(worker)
+
+            now = time.time()
+            for conn, worker in list(busy.items()):
+                if worker.deadline <= now:
+                    del busy[conn]
+                    worker.kill()
+                    self._finish(worker.task, False, ExtractTimeout('timeout after %s seconds' % self.timeout))
+                    idle.append(_Worker(self._ctx))
+
+    def publish_stats(self):
+        """Publish and reset the extraction time and failures of each suffix."""
+        with self._cond:
+            stats, self._stats = self._stats, {}
+        for suffix, (files, seconds, failures, timeouts) in stats.items():
+            publish_metric('seasearch_extract_%s_files' % suffix, files,
+                           'Files of suffix %s parsed since the last report' % suffix)
+            publish_metric('seasearch_extract_%s_seconds' % suffix, round(seconds, 3),
+                           'Time to parse files of suffix %s since the last report' % suffix)
+            publish_metric('seasearch_extract_%s_failures' % suffix, failures,
+                           'Files of suffix %s failed to parse since the last report' % suffix)
+            publish_metric('seasearch_extract_%s_timeouts' % suffix, timeouts,
+                           'Files of suffix %s timed out since the last report' % suffix)
@@ -0,0 +1,9 @@
+-- Indexes used by the keyset pagination of audit logs (get_events_by_cursor)
+-- when no org is given. New installations get them from the models.
+ALTER TABLE `FileAudit` ADD INDEX `idx_file_audit_user_eid` (`user`, `eid`),
+                        ADD INDEX `idx_file_audit_repo_eid` (`repo_id`, `eid`);
+ALTER TABLE `FileUpdate` ADD INDEX `idx_file_update_user_eid` (`user`, `eid`),
+                         ADD INDEX `idx_file_update_repo_eid` (`repo_id`, `eid`);
+ALTER TABLE `PermAudit` ADD INDEX `idx_perm_audit_user_eid` (`from_user`, `eid`),
+                        ADD INDEX `idx_perm_audit_repo_eid` (`repo_id`, `eid`),
+                        ADD INDEX `idx_perm_audit_to_eid` (`to`, `eid`);
@@ -0,0 +1,48 @@
+-- Partition the event tables by month of timestamp, so the retention of
+-- [RETENTION] in events.conf drops whole months instead of deleting rows.
+-- MySQL requires the partition column in the primary key. Every table gets
+-- one partition per month from its oldest row up to two months after this
+-- one, plus a catch-all pmax. seafevents then only splits the next months
+-- off pmax, which never holds more than a few days of rows.
+--
+-- Each statement rebuilds its table, run them in a maintenance window.
+-- Tables which are not partitioned keep working, their rows out of
+-- retention are deleted in small chunks instead.
+DELIMITER //
+CREATE PROCEDURE seafevents_partition_by_month(IN tbl VARCHAR(64), IN pk VARCHAR(64))
+BEGIN
+    DECLARE month_start DATE;
+    DECLARE last_month DATE;
+    DECLARE parts TEXT DEFAULT '';
+
+    SET @sql = CONCAT('SELECT DATE_FORMAT(COALESCE(MIN(`timestamp`), UTC_DATE()), ''%Y-%m-01'') INTO @oldest FROM `',
+                      tbl, '`');
+    PREPARE stmt FROM @sql;
+    EXECUTE stmt;
+    DEALLOCATE PREPARE stmt;
+
+    SET month_start = @oldest;
+    SET last_month = DATE_ADD(DATE_FORMAT(UTC_DATE(), '%Y-%m-01'), INTERVAL 2 MONTH);
+    WHILE month_start <= last_month DO
+        SET parts = CONCAT(parts, 'PARTITION p', DATE_FORMAT(month_start, '%Y%m'), ' VALUES LESS THAN (',
+                           TO_DAYS(DATE_ADD(month_start, INTERVAL 1 MONTH)), '), ');
+        SET month_start = DATE_ADD(month_start, INTERVAL 1 MONTH);
+    END WHILE;
+
+    SET @sql = CONCAT('ALTER TABLE `', tbl, '` DROP PRIMARY KEY, ADD PRIMARY KEY (`', pk, '`, `timestamp`) ',
+                      'PARTITION BY RANGE (TO_DAYS(`timestamp`)) (', parts,
+                      'PARTITION pmax VALUES LESS THAN MAXVALUE)');
+    PREPARE stmt FROM @sql;
+    EXECUTE stmt;
+    DEALLOCATE PREPARE stmt;
+END //
+DELIMITER ;
+
+CALL seafevents_partition_by_month('FileAudit', 'eid');
+CALL seafevents_partition_by_month('FileUpdate', 'eid');
+CALL seafevents_partition_by_month('PermAudit', 'eid');
+CALL seafevents_partition_by_month('Activity', 'id');
+CALL seafevents_partition_by_month('UserActivity', 'id');
+CALL seafevents_partition_by_month('FileHistory', 'id');
+
+DROP PROCEDURE seafevents_partition_by_month;
@@ -0,0 +1,149 @@
+import zlib
+import logging
+from threading import Lock
+
+from seafevents.events.metrics import publish_metric
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+from seafevents.utils.journal import SegmentedJournal, remove_journal_segments
+
+logger = logging.getLogger(__name__)
+
+
+def is_journal_enabled(config):
+    enabled = get_opt_from_conf_or_env(config, 'STATISTICS', 'journal', default=False)
+    return parse_bool(enabled)
+
+
+def add_value(old, new):
+    return old + new
+
+
+def replace_value(old, new):
+    return new
+
+
+class _Shard(object):
+    __slots__ = ('lock', 'items', 'merged', 'dropped', 'journal')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.items = {}
+        self.merged = 0
+        self.dropped = 0
+        self.journal = None
+
+
+class StatsAccumulator(object):
+    """In-memory counters which are written to the database periodically.
+
+    Keys are spread over ``shards`` buffers, each with its own lock, so event
+    threads adding different keys rarely wait for each other. ``swap`` replaces
+    every buffer with an empty one and returns the old ones, so nothing added
+    between taking the data and clearing it can be lost.
+
+    A value added to an existing key is merged with ``merge``. When the
+    accumulator holds ``max_size`` keys, values of new keys are dropped.
+
+    With ``enable_journal``, every added value is also appended to a local
+    journal of its shard, which is loaded back on startup. Keys and values
+    must be json serializable then, keys are tuples of strings and numbers.
+    The writer calls ``commit`` after saving the swapped values, or ``restore``
+    if saving fails. A crash between saving and ``commit`` replays the saved
+    values on startup, so values added to the database, like traffic sizes,
+    are counted twice for that flush.
+    """
+    def __init__(self, name, merge=add_value, shards=16, max_size=0):
+        self.name = name
+        self._merge = merge
+        self._max_shard_size = max(max_size // shards, 1) if max_size else 0
+        self._shards = [_Shard() for _ in range(shards)]
+        # journal segments holding swapped values which are not saved yet
+        self._pending_segments = []
+
+    def enable_journal(self, fsync=False):
+        """Load the values left by the last run and start journaling."""
+        count = 0
+        for i, shard in enumerate(self._shards):
+            shard.journal = SegmentedJournal('stats_%s.%d' % (self.name, i), fsync)
+            for key, value in shard.journal.load():
+                key = tuple(key)
+                # the same key always goes to the same shard, replay in order
+                target = self._get_shard(key)
+                if key in target.items:
+                    target.items[key] = self._merge(target.items[key], value)
+                else:
+                    target.items[key] = value
+                count += 1
+        if count:
+            logger.info('Loaded %d values of %s from journal', count, self.name)
+
+    def _get_shard(self, key):
+        return self._shards[zlib.crc32(repr(key).encode('utf-8')) % len(self._shards)]
+
+    def add(self, key, value):
+        """Merge ``value`` into ``key``, return False if it is dropped."""
+        shard = self._get_shard(key)
+        with shard.lock:
+            items = shard.items
+            if key in items:
+                items[key] = self._merge(items[key], value)
+                shard.merged += 1
+            elif self._max_shard_size and len(items) >= self._max_shard_size:
+                shard.dropped += 1
+                return False
+            else:
+                items[key] = value
+            if shard.journal is not None:
+                shard.journal.append([key, value])
+        return True
+
+    def restore(self, items):
+        """Put back values taken by ``swap`` which could not be written,
+        they are merged before the values added since.
+        """
+        for key, value in items:
+            shard = self._get_shard(key)
+            with shard.lock:
+                if key in shard.items:
+                    shard.items[key] = self._merge(value, shard.items[key])
+                else:
+                    shard.items[key] = value
+
+    def swap(self):
+        """Take all the accumulated values and start over with empty buffers."""
+        result = {}
+        for shard in self._shards:
+            with shard.lock:
+                items, shard.items = shard.items, {}
+                if shard.journal is not None:
+                    self._pending_segments.extend(shard.journal.rotate())
+            result.update(items)
+        return result
+
+    def commit(self):
+        """Drop the journal of the swapped values once they are saved.
+
+        Values put back by ``restore`` are kept in the journal until the
+        next successful commit.
+        """
+        segments, self._pending_segments = self._pending_segments, []
+        remove_journal_segments(segments)
+
+    def __len__(self):
+        return sum(len(shard.items) for shard in self._shards)
+
+    def publish_counters(self):
+        """Publish and reset the numbers of merged and dropped values."""
+        merged = dropped = 0
+        for shard in self._shards:
+            with shard.lock:
+                merged += shard.merged
+                dropped += shard.dropped
+                shard.merged = shard.dropped = 0
+
+        if dropped:
+            logger.warning('%d values of %s are dropped as there are too many keys', dropped, self.name)
+        publish_metric('%s_merged_values' % self.name, merged,
+                       'Values merged into existing keys of %s since last flush' % self.name)
+        publish_metric('%s_dropped_values' % self.name, dropped,
+                       'Values of %s dropped since last flush because the buffer is full' % self.name)
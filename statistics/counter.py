@@ -3,11 +3,11 @@ import hashlib
 import time
 from datetime import timedelta
 from datetime import datetime
-from sqlalchemy import func, select, update, null
+from sqlalchemy import func, select, update, null, insert, cast, case, or_, bindparam, LargeBinary
 from sqlalchemy.sql import text
 
 from .models import FileOpsStat, TotalStorageStat, UserTraffic, SysTraffic, \
-        MonthlyUserTraffic, MonthlySysTraffic
+        MonthlyUserTraffic, MonthlySysTraffic, StatsCounterState
 from seafevents.events.models import FileUpdate
 from seafevents.events.models import FileAudit
 from seafevents.db import SeafBase, init_db_session_class
@@ -19,12 +19,20 @@ from seafevents.utils import get_quota_from_string
 from seafevents.app.config import ENABLED_ROLE_PERMISSIONS, \
         DOWNLOAD_LIMIT_WHEN_THROTTLE, UPLOAD_LIMIT_WHEN_THROTTLE
 from .db import get_org_id
+from .accumulator import StatsAccumulator, replace_value, is_journal_enabled
 
 # This is a throwaway variable to deal with a python bug
 throwaway = datetime.strptime('20110101', '%Y%m%d')
 
-login_records = {}
-traffic_info = {}
+# keys beyond these are dropped until the next flush, see StatsAccumulator
+LOGIN_RECORDS_MAX_SIZE = 1000000
+TRAFFIC_INFO_MAX_SIZE = 1000000
+USER_ACTIVITY_WRITE_CHUNK = 300
+
+# {(login_name, 'Y-m-d'): org_id}
+login_records = StatsAccumulator('login_records', merge=replace_value, max_size=LOGIN_RECORDS_MAX_SIZE)
+# {('Y-m-d', org_id, user_name, oper): size}
+traffic_info = StatsAccumulator('traffic_info', max_size=TRAFFIC_INFO_MAX_SIZE)
 
 
 download_rate_limit_users = {}
@@ -35,6 +43,10 @@ upload_rate_limit_orgs = {}
 
 reset_rate_limit_dates = []
 
+# UserTraffic of the open days counted by the last incremental
+# MonthlyTrafficCounter run, {'timestamp': month, 'days': [...], 'users': {...}}
+monthly_traffic_snapshot = {}
+
 DEFAULT_USER = 'default'
 GUEST_USER = 'guest'
 
@@ -44,33 +56,34 @@ MONTHLY_DOWNLOAD_TRAFFIC_LIMIT_PER_USER = 'monthly_rate_limit_per_user'
 MONTHLY_UPLOAD_TRAFFIC_LIMIT = 'monthly_upload_traffic_limit'
 MONTHLY_UPLOAD_TRAFFIC_LIMIT_PER_USER = 'monthly_upload_traffic_limit_per_user'
 
+# hours FileOpsCounter looks back for hours missed during downtime
+FILE_OPS_BACKFILL_HOURS = 24 * 7
+# StatsCounterState of the last hour counted by FileOpsCounter
+FILE_OPS_STATE = 'file_ops'
+FILE_OPS_INSERT_CHUNK = 1000
+TRAFFIC_QUERY_CHUNK = 1000
+
+MONTHLY_TRAFFIC_COLUMNS = ('web_file_upload', 'web_file_download', 'sync_file_upload',
+                           'sync_file_download', 'link_file_upload', 'link_file_download')
+MONTHLY_TRAFFIC_WRITE_CHUNK = 1000
+
 
-def get_org_user_quota(local_traffic_info, date_str):
-    org_user_dict = {}
-    for row in local_traffic_info[date_str]:
-        org_id = row[0]
-        if org_id > 0 and org_id not in org_user_dict:
-            with SeahubDB() as seahub_db:
-                user_count = seahub_db.get_org_member_quota(org_id)
-                org_user_dict[org_id] = user_count
-    return org_user_dict
+def init_stats_journal(config):
+    """Journal the login and traffic records buffered by the events handlers,
+    so they survive a restart.
+    """
+    if not is_journal_enabled(config):
+        return
+    login_records.enable_journal()
+    traffic_info.enable_journal()
 
 
 def update_hash_record(session, login_name, login_time, org_id):
-    time_str = login_time.strftime('%Y-%m-%d 00:00:00')
-    time_by_day = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-    md5_key = hashlib.md5((login_name + time_str).encode('utf-8')).hexdigest()
-    login_records[md5_key] = (login_name, time_by_day, org_id)
+    login_records.add((login_name, login_time.strftime('%Y-%m-%d')), org_id)
 
 def save_traffic_info(session, timestamp, user_name, repo_id, oper, size):
     org_id = get_org_id(repo_id)
-    time_str = timestamp.strftime('%Y-%m-%d')
-    if time_str not in traffic_info:
-        traffic_info[time_str] = {}
-    if (org_id, user_name, oper) not in traffic_info[time_str]:
-        traffic_info[time_str][(org_id, user_name, oper)] = size
-    else:
-        traffic_info[time_str][(org_id, user_name, oper)] += size
+    traffic_info.add((timestamp.strftime('%Y-%m-%d'), org_id, user_name, oper), size)
 
 
 def get_role_traffic_limit_dict():
@@ -100,96 +113,166 @@ def get_role_traffic_limit_dict():
     return role_traffic_limit_dict
 
 
+class TrafficLimitResolver(object):
+    """Traffic limits of the users and orgs of one traffic counting run.
+
+    Roles, org settings and org member quotas are loaded with a few IN queries
+    up front instead of being queried for every traffic record.
+    """
+    def __init__(self, role_traffic_limit_dict):
+        self.role_traffic_limit_dict = role_traffic_limit_dict
+        self.user_roles = {}
+        self.org_settings = {}
+        self.org_member_quotas = {}
+
+    def load(self, rows):
+        """Load the limit info of the (org_id, user, oper) rows.
+
+        Errors are raised, as the default limits would throttle the wrong
+        users, so the traffic of the run is counted again in the next one.
+        """
+        users = {row[1] for row in rows}
+        org_ids = {row[0] for row in rows if row[0] > 0}
+        with CcnetDB() as ccnet_db:
+            self.user_roles = ccnet_db.get_users_role(users)
+        with SeahubDB() as seahub_db:
+            self.org_settings = seahub_db.get_orgs_settings(org_ids)
+            self.org_member_quotas = seahub_db.get_orgs_member_quota(org_ids)
+
+    def _get_role_limit(self, role, limit_key):
+        if self.role_traffic_limit_dict and role in self.role_traffic_limit_dict:
+            return self.role_traffic_limit_dict[role].get(limit_key)
+        return None
+
+    def _get_org_threshold(self, org_id, limit_per_user_key):
+        org_role = self.org_settings.get(org_id, ('default', 0))[0]
+        role = DEFAULT_USER if org_role == '' else org_role
+        limit_per_user = self._get_role_limit(role, limit_per_user_key)
+        org_user_quota = self.org_member_quotas.get(org_id)
+        if org_user_quota and limit_per_user:
+            return org_user_quota * limit_per_user
+        return None
+
+    def get_download_threshold(self, org_id, user):
+        user_role = self.user_roles.get(user, 'default')
+        role = DEFAULT_USER if user_role == '' else user_role
+        threshold = self._get_role_limit(role, MONTHLY_DOWNLOAD_TRAFFIC_LIMIT)
+        if org_id > 0:
+            threshold = self._get_org_threshold(org_id, MONTHLY_DOWNLOAD_TRAFFIC_LIMIT_PER_USER)
+            monthly_traffic_limit = self.org_settings.get(org_id, ('default', 0))[1]
+            if monthly_traffic_limit > 0:
+                threshold = monthly_traffic_limit
+        return threshold
+
+    def get_upload_threshold(self, org_id, user):
+        user_role = self.user_roles.get(user, 'default')
+        role = DEFAULT_USER if user_role == '' else user_role
+        threshold = self._get_role_limit(role, MONTHLY_UPLOAD_TRAFFIC_LIMIT)
+        if org_id > 0:
+            threshold = self._get_org_threshold(org_id, MONTHLY_UPLOAD_TRAFFIC_LIMIT_PER_USER)
+        return threshold
+
+
 class FileOpsCounter(object):
     def __init__(self):
         self.edb_session = init_db_session_class()()
 
-    def start_count(self):
+    def get_first_missed_hour(self, end_hour):
+        # hours without any operation have no FileOpsStat rows, so the last
+        # counted hour is kept in StatsCounterState
+        stmt = select(StatsCounterState.timestamp).where(StatsCounterState.name == FILE_OPS_STATE)
+        last_hour = self.edb_session.scalars(stmt).first()
+        if last_hour is None:
+            # the first run which keeps the state
+            last_hour = self.edb_session.scalars(select(func.max(FileOpsStat.timestamp))).first()
+        first_hour = end_hour - timedelta(hours=FILE_OPS_BACKFILL_HOURS - 1)
+        if last_hour is None:
+            return end_hour
+        return max(last_hour + timedelta(hours=1), first_hour)
+
+    def set_last_counted_hour(self, hour):
+        stmt = select(StatsCounterState).where(StatsCounterState.name == FILE_OPS_STATE)
+        state = self.edb_session.scalars(stmt).first()
+        if state is None:
+            self.edb_session.add(StatsCounterState(FILE_OPS_STATE, hour))
+        elif state.timestamp < hour:
+            state.timestamp = hour
+
+    def count_ops_by_hour(self, start_hour, end_hour):
+        """Return [(hour, org_id, op_type, number)] of the hours between
+        start_hour and end_hour, counted by MySQL.
+        """
+        s_timestamp = start_hour
+        e_timestamp = end_hour.replace(minute=59, second=59)
+
+        # substring tests are case sensitive as file_oper is compared as binary
+        file_oper = cast(FileUpdate.file_oper, LargeBinary)
+        op_type = case(
+            (file_oper.like('%Added%'), 'Added'),
+            (or_(file_oper.like('%Deleted%'), file_oper.like('%Removed%')), 'Deleted'),
+            (file_oper.like('%Modified%'), 'Modified'),
+            else_=null()).label('op_type')
+        hour = func.date_format(FileUpdate.timestamp, '%Y-%m-%d %H:00:00').label('hour')
+        stmt = select(hour, FileUpdate.org_id, op_type, func.count(FileUpdate.eid)).where(
+                      FileUpdate.timestamp.between(s_timestamp, e_timestamp)).\
+            group_by(hour, FileUpdate.org_id, op_type)
+        rows = [row for row in self.edb_session.execute(stmt).all() if row[2] is not None]
+
+        hour = func.date_format(FileAudit.timestamp, '%Y-%m-%d %H:00:00').label('hour')
+        stmt = select(hour, FileAudit.org_id, func.count(FileAudit.eid)).where(
+                      FileAudit.timestamp.between(s_timestamp, e_timestamp)).\
+            group_by(hour, FileAudit.org_id)
+        rows.extend([(row[0], row[1], 'Visited', row[2]) for row in self.edb_session.execute(stmt).all()])
+
+        return [(datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S'), row[1], row[2], row[3]) for row in rows]
+
+    def start_count(self, start_hour=None, end_hour=None):
+        """Count file operations of every hour from start_hour to end_hour which
+        is not counted yet.
+
+        By default the last hour is counted, together with the hours missed since
+        the last run, at most FILE_OPS_BACKFILL_HOURS hours back.
+        """
         logging.info('Start counting file operations..')
         time_start = time.time()
-        added = 0
-        deleted = 0
-        visited = 0
-
-        dt = datetime.utcnow()
-        delta = timedelta(hours=1)
-        _start = (dt - delta)
-
-        start = _start.strftime('%Y-%m-%d %H:00:00')
-        end = _start.strftime('%Y-%m-%d %H:59:59')
 
-        s_timestamp = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
-        e_timestamp = datetime.strptime(end, '%Y-%m-%d %H:%M:%S')
+        if end_hour is None:
+            end_hour = (datetime.utcnow() - timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
 
-        total_added = total_deleted = total_visited = total_modified = 0
-        org_added = {}
-        org_deleted = {}
-        org_visited = {}
-        org_modified = {}
+        totals = {'Added': 0, 'Deleted': 0, 'Visited': 0, 'Modified': 0}
         try:
-            stmt = select(FileOpsStat).where(FileOpsStat.timestamp == s_timestamp).limit(1)
-            if self.edb_session.scalars(stmt).first():
+            if start_hour is None:
+                start_hour = self.get_first_missed_hour(end_hour)
+            if start_hour > end_hour:
                 self.edb_session.close()
                 return
 
-            # Select 'Added', 'Deleted', 'Modified' info from FileUpdate
-            stmt = select(FileUpdate).where(
-                          FileUpdate.timestamp.between(s_timestamp, e_timestamp))
-            rows = self.edb_session.scalars(stmt).all()
-            for row in rows:
-                org_id = row.org_id
-                if 'Added' in row.file_oper:
-                    total_added += 1
-                    if org_id not in org_added:
-                        org_added[org_id] = 1
-                    else:
-                        org_added[org_id] += 1
-                elif 'Deleted' in row.file_oper or 'Removed' in row.file_oper:
-                    total_deleted += 1
-                    if org_id not in org_deleted:
-                        org_deleted[org_id] = 1
-                    else:
-                        org_deleted[org_id] += 1
-                elif 'Modified' in row.file_oper:
-                    total_modified += 1
-                    if org_id not in org_modified:
-                        org_modified[org_id] = 1
-                    else:
-                        org_modified[org_id] += 1
-
-            # Select 'Visited' info from FileAudit
-            stmt = select(FileAudit.org_id, func.count(FileAudit.eid)).where(
-                          FileAudit.timestamp.between(s_timestamp, e_timestamp)).group_by(FileAudit.org_id)
-            rows = self.edb_session.execute(stmt).all()
-            for row in rows:
-                org_id = row[0]
-                total_visited += row[1]
-                org_visited[org_id] = row[1]
+            stmt = select(FileOpsStat.timestamp).where(
+                          FileOpsStat.timestamp.between(start_hour, end_hour)).distinct()
+            counted_hours = set(self.edb_session.scalars(stmt).all())
+            if len(counted_hours) > (end_hour - start_hour).total_seconds() // 3600:
+                self.edb_session.close()
+                return
 
+            new_records = []
+            for hour, org_id, op_type, number in self.count_ops_by_hour(start_hour, end_hour):
+                if hour in counted_hours:
+                    continue
+                totals[op_type] += number
+                new_records.append({'org_id': org_id, 'timestamp': hour, 'op_type': op_type, 'number': number})
         except Exception as e:
             self.edb_session.close()
             logging.warning('[FileOpsCounter] query error : %s.', e)
             return
 
-        for k, v in org_added.items():
-            new_record = FileOpsStat(k, s_timestamp, 'Added', v)
-            self.edb_session.add(new_record)
-
-        for k, v in org_deleted.items():
-            new_record = FileOpsStat(k, s_timestamp, 'Deleted', v)
-            self.edb_session.add(new_record)
+        for i in range(0, len(new_records), FILE_OPS_INSERT_CHUNK):
+            self.edb_session.execute(insert(FileOpsStat).values(new_records[i: i + FILE_OPS_INSERT_CHUNK]))
+        self.set_last_counted_hour(end_hour)
 
-        for k, v in org_visited.items():
-            new_record = FileOpsStat(k, s_timestamp, 'Visited', v)
-            self.edb_session.add(new_record)
-
-        for k, v in org_modified.items():
-            new_record = FileOpsStat(k, s_timestamp, 'Modified', v)
-            self.edb_session.add(new_record)
-
-        logging.info('[FileOpsCounter] Finish counting file operations in %s seconds, %d added, %d deleted, %d visited,'
-                     ' %d modified',
-                     str(time.time() - time_start), total_added, total_deleted, total_visited, total_modified)
+        logging.info('[FileOpsCounter] Finish counting file operations from %s to %s in %s seconds, '
+                     '%d added, %d deleted, %d visited, %d modified',
+                     start_hour, end_hour, str(time.time() - time_start), totals['Added'],
+                     totals['Deleted'], totals['Visited'], totals['Modified'])
 
         self.edb_session.commit()
         self.edb_session.close()
@@ -272,35 +355,35 @@ class TrafficInfoCounter(object):
         today = dt.date()
         today_str = today.strftime('%Y-%m-%d')
 
-        local_traffic_info = traffic_info.copy()
-        traffic_info.clear()
-
-        if yesterday_str in local_traffic_info:
-            s_time = time.time()
-            self.update_record(local_traffic_info, yesterday, yesterday_str)
-            logging.info(
-                'Traffic Counter: %d items has been recorded on %s, time: %s seconds.' % (
-                    len(local_traffic_info[yesterday_str]),
-                    yesterday_str,
-                    str(time.time() - s_time)
-                )
-            )
-
-        if today_str in local_traffic_info:
-            s_time = time.time()
-            self.update_record(local_traffic_info, today, today_str)
-            logging.info(
-                'Traffic Counter: %d items has been updated on %s, time: %s seconds.' % (
-                    len(local_traffic_info[today_str]),
-                    today_str,
-                    str(time.time() - s_time)
-                )
-            )
+        swapped = traffic_info.swap()
+        local_traffic_info = {}
+        for (date_str, org_id, user_name, oper), size in swapped.items():
+            local_traffic_info.setdefault(date_str, {})[(org_id, user_name, oper)] = size
+        traffic_info.publish_counters()
 
         try:
+            for date, date_str in ((yesterday, yesterday_str), (today, today_str)):
+                if date_str not in local_traffic_info:
+                    continue
+                s_time = time.time()
+                if not self.update_record(local_traffic_info, date, date_str):
+                    raise RuntimeError('failed to update traffic of %s' % date_str)
+                logging.info(
+                    'Traffic Counter: %d items has been updated on %s, time: %s seconds.' % (
+                        len(local_traffic_info[date_str]),
+                        date_str,
+                        str(time.time() - s_time)
+                    )
+                )
             self.edb_session.commit()
+            traffic_info.commit()
         except Exception as e:
             logging.warning('Failed to update traffic info: %s.', e)
+            self.edb_session.rollback()
+            # sizes are added to the rows in the database, so the run is one
+            # transaction and the values are counted again in the next run
+            traffic_info.restore([(key, size) for key, size in swapped.items()
+                                  if key[0] in (yesterday_str, today_str)])
         finally:
             logging.info(
                 'Traffic counter finished, total time: %s seconds.' % (
@@ -310,15 +393,48 @@ class TrafficInfoCounter(object):
             self.edb_session.close()
             del local_traffic_info
 
-    def update_record(self, local_traffic_info, date, date_str):
+    def get_monthly_user_traffic(self, users, org_id, first_day_of_month, date):
+        """Return {(user, oper type): size} of this month, oper type is
+        'download' or 'upload'.
+        """
+        users = list(users)
+        monthly_traffic = {}
+        for i in range(0, len(users), TRAFFIC_QUERY_CHUNK):
+            stmt = select(UserTraffic.user, UserTraffic.op_type, func.sum(UserTraffic.size)).where(
+                UserTraffic.timestamp.between(first_day_of_month, date),
+                UserTraffic.user.in_(users[i: i + TRAFFIC_QUERY_CHUNK]),
+                UserTraffic.org_id == org_id,
+                UserTraffic.op_type.in_(self.download_type_list + self.upload_type_list)
+            ).group_by(UserTraffic.user, UserTraffic.op_type)
+            for user, op_type, size in self.edb_session.execute(stmt).all():
+                oper_type = 'download' if op_type in self.download_type_list else 'upload'
+                monthly_traffic[(user, oper_type)] = monthly_traffic.get((user, oper_type), 0) + int(size or 0)
+        return monthly_traffic
+
+    def get_monthly_org_traffic(self, org_ids, first_day_of_month, date):
+        """Return {(org_id, oper type): size} of this month."""
+        org_ids = list(org_ids)
+        monthly_traffic = {}
+        for i in range(0, len(org_ids), TRAFFIC_QUERY_CHUNK):
+            stmt = select(SysTraffic.org_id, SysTraffic.op_type, func.sum(SysTraffic.size)).where(
+                SysTraffic.timestamp.between(first_day_of_month, date),
+                SysTraffic.org_id.in_(org_ids[i: i + TRAFFIC_QUERY_CHUNK]),
+                SysTraffic.op_type.in_(self.download_type_list + self.upload_type_list)
+            ).group_by(SysTraffic.org_id, SysTraffic.op_type)
+            for org_id, op_type, size in self.edb_session.execute(stmt).all():
+                oper_type = 'download' if op_type in self.download_type_list else 'upload'
+                monthly_traffic[(org_id, oper_type)] = monthly_traffic.get((org_id, oper_type), 0) + int(size or 0)
+        return monthly_traffic
 
+    def update_record(self, local_traffic_info, date, date_str):
+        """Add the traffic of one day to UserTraffic and SysTraffic without
+        committing, return False if it fails.
+        """
         # org_delta format: org_delta[(org_id, oper)] = size
         # Calculate each org traffic into org_delta, then update SysTraffic.
         org_delta = {}
 
-        trans_count = 0
         first_day_of_month = datetime(datetime.now().year, datetime.now().month, 1)
-        org_user_quota_dict = get_org_user_quota(local_traffic_info, date_str)
 
         try:
             # get role traffic limit config
@@ -327,10 +443,28 @@ class TrafficInfoCounter(object):
             logging.warning('Failed get download rate limit info: %s.', e)
             role_traffic_limit_dict = None
 
+        traffic_limits = TrafficLimitResolver(role_traffic_limit_dict)
+        traffic_limits.load([row for row in local_traffic_info[date_str]
+                             if row[2] in self.download_type_list or row[2] in self.upload_type_list])
+
+        # Monthly traffic of the users to be checked, sizes of this run are
+        # added below as the records are updated.
+        users_to_check = set()
+        for org_id, user, oper in local_traffic_info[date_str]:
+            if org_id >= 0 or not role_traffic_limit_dict:
+                continue
+            if oper in self.download_type_list and not download_rate_limit_users.get(user, False) or \
+                    oper in self.upload_type_list and not upload_rate_limit_users.get(user, False):
+                users_to_check.add(user)
+        try:
+            monthly_user_traffic = self.get_monthly_user_traffic(users_to_check, -1, first_day_of_month, date)
+        except Exception as e:
+            logging.warning('Failed to get monthly user traffic: %s.', e)
+            monthly_user_traffic = {}
+
         # Update UserTraffic
         for row in local_traffic_info[date_str]:
 
-            trans_count += 1
             org_id = row[0]
             user = row[1]
             oper = row[2]
@@ -343,46 +477,7 @@ class TrafficInfoCounter(object):
             upload_traffic_threshold = None
 
             if oper in self.download_type_list:
-
-                with CcnetDB() as ccnet_db:
-                    user_role = ccnet_db.get_user_role(user)
-                    role = DEFAULT_USER if user_role == '' else user_role
-
-                # get common user download traffic limit
-                if role_traffic_limit_dict and role in role_traffic_limit_dict:
-                    download_traffic_threshold = role_traffic_limit_dict[role].get(
-                        MONTHLY_DOWNLOAD_TRAFFIC_LIMIT
-                    )
-                else:
-                    download_traffic_threshold = None
-
-                # get org download traffic limit
-                if org_id > 0:
-
-                    with SeahubDB() as seahub_db:
-                        org_role = seahub_db.get_org_role(org_id)
-                        role = DEFAULT_USER if org_role == '' else org_role
-
-                    if role_traffic_limit_dict and role in role_traffic_limit_dict:
-                        limit_per_user = role_traffic_limit_dict[role].get(
-                            MONTHLY_DOWNLOAD_TRAFFIC_LIMIT_PER_USER
-                        )
-                    else:
-                        limit_per_user = None
-
-                    org_user_quota = org_user_quota_dict.get(org_id)
-                    if org_user_quota and limit_per_user:
-                        download_traffic_threshold = org_user_quota * limit_per_user
-                    else:
-                        download_traffic_threshold = None
-
-                    try:
-                        with SeahubDB() as seahub_db:
-                            monthly_traffic_limit = seahub_db.get_org_monthly_traffic_limit(org_id)
-                            if monthly_traffic_limit > 0:
-                                download_traffic_threshold = monthly_traffic_limit
-                    except Exception as e:
-                        logging.warning('Failed to get org %s monthly download traffic limit: %s.', org_id, e)
+                download_traffic_threshold = traffic_limits.get_download_threshold(org_id, user)
 
                 if (org_id, oper, download_traffic_threshold) not in org_delta:
                     org_delta[(org_id, oper, download_traffic_threshold)] = size
@@ -390,38 +485,7 @@ class TrafficInfoCounter(object):
                     org_delta[(org_id, oper, download_traffic_threshold)] += size
 
             elif oper in self.upload_type_list:
-
-                with CcnetDB() as ccnet_db:
-                    user_role = ccnet_db.get_user_role(user)
-                    role = DEFAULT_USER if user_role == '' else user_role
-
-                # get common user upload traffic limit
-                if role_traffic_limit_dict and role in role_traffic_limit_dict:
-                    upload_traffic_threshold = role_traffic_limit_dict[role].get(
-                        MONTHLY_UPLOAD_TRAFFIC_LIMIT
-                    )
-                else:
-                    upload_traffic_threshold = None
-
-                # get org upload traffic limit
-                if org_id > 0:
-
-                    with SeahubDB() as seahub_db:
-                        org_role = seahub_db.get_org_role(org_id)
-                        role = DEFAULT_USER if org_role == '' else org_role
-
-                    if role_traffic_limit_dict and role in role_traffic_limit_dict:
-                        limit_per_user = role_traffic_limit_dict[role].get(
-                            MONTHLY_UPLOAD_TRAFFIC_LIMIT_PER_USER
-                        )
-                    else:
-                        limit_per_user = None
-
-                    org_user_quota = org_user_quota_dict.get(org_id)
-                    if org_user_quota and limit_per_user:
-                        upload_traffic_threshold = org_user_quota * limit_per_user
-                    else:
-                        upload_traffic_threshold = None
+                upload_traffic_threshold = traffic_limits.get_upload_threshold(org_id, user)
 
                 if (org_id, oper, upload_traffic_threshold) not in org_delta:
                     org_delta[(org_id, oper, upload_traffic_threshold)] = size
@@ -442,14 +506,7 @@ class TrafficInfoCounter(object):
                     and oper in self.download_type_list
                     and not download_rate_limit_users.get(user, False)
                 ):
-
-                    stmt2 = select(func.sum(UserTraffic.size).label("size")).where(
-                        UserTraffic.timestamp.between(first_day_of_month, date),
-                        UserTraffic.user == user,
-                        UserTraffic.org_id == org_id,
-                        UserTraffic.op_type.in_(self.download_type_list)
-                    )
-                    user_monthly_download_traffic_size = self.edb_session.scalars(stmt2).first()
+                    user_monthly_download_traffic_size = monthly_user_traffic.get((user, 'download'))
 
                     # common user download tarffic limit
                     if user_monthly_download_traffic_size and \
@@ -465,14 +522,7 @@ class TrafficInfoCounter(object):
                     and oper in self.upload_type_list
                     and not upload_rate_limit_users.get(user, False)
                 ):
-
-                    stmt2 = select(func.sum(UserTraffic.size).label("size")).where(
-                        UserTraffic.timestamp.between(first_day_of_month, date),
-                        UserTraffic.user == user,
-                        UserTraffic.org_id == org_id,
-                        UserTraffic.op_type.in_(self.upload_type_list)
-                    )
-                    user_monthly_upload_traffic_size = self.edb_session.scalars(stmt2).first()
+                    user_monthly_upload_traffic_size = monthly_user_traffic.get((user, 'upload'))
 
                     # common user upload tarffic limit
                     if user_monthly_upload_traffic_size and \
@@ -481,6 +531,11 @@ class TrafficInfoCounter(object):
                         seafile_api.set_user_upload_rate_limit(user, upload_limit_format)
                         upload_rate_limit_users[user] = True
 
+                if org_id < 0 and oper in self.download_type_list:
+                    monthly_user_traffic[(user, 'download')] = monthly_user_traffic.get((user, 'download'), 0) + size
+                elif org_id < 0 and oper in self.upload_type_list:
+                    monthly_user_traffic[(user, 'upload')] = monthly_user_traffic.get((user, 'upload'), 0) + size
+
                 stmt = select(UserTraffic.size).where(
                                            UserTraffic.timestamp == date,
                                            UserTraffic.user == user,
@@ -499,13 +554,16 @@ class TrafficInfoCounter(object):
                     new_record = UserTraffic(user, date, oper, size, org_id)
                     self.edb_session.add(new_record)
 
-                # commit every 100 items.
-                if trans_count >= 100:
-                    self.edb_session.commit()
-                    trans_count = 0
             except Exception as e:
                 logging.warning('Failed to update traffic info: %s.', e)
-                return
+                return False
+
+        orgs_to_check = {row[0] for row in org_delta if row[0] > 0}
+        try:
+            monthly_org_traffic = self.get_monthly_org_traffic(orgs_to_check, first_day_of_month, date)
+        except Exception as e:
+            logging.warning('Failed to get monthly org traffic: %s.', e)
+            monthly_org_traffic = {}
 
         # Update SysTraffic
         for row in org_delta:
@@ -521,13 +579,7 @@ class TrafficInfoCounter(object):
                     and oper in self.download_type_list
                     and not download_rate_limit_orgs.get(org_id)
                 ):
-
-                    stmt2 = select(func.sum(SysTraffic.size).label("size")).where(
-                        SysTraffic.timestamp.between(first_day_of_month, date),
-                        SysTraffic.org_id == org_id,
-                        SysTraffic.op_type.in_(self.download_type_list)
-                    )
-                    org_monthly_download_traffic_size = self.edb_session.scalars(stmt2).first()
+                    org_monthly_download_traffic_size = monthly_org_traffic.get((org_id, 'download'))
 
                     download_traffic_threshold = row[2]
 
@@ -549,12 +601,7 @@ class TrafficInfoCounter(object):
                     and not upload_rate_limit_orgs.get(org_id)
                 ):
 
-                    stmt2 = select(func.sum(SysTraffic.size).label("size")).where(
-                        SysTraffic.timestamp.between(first_day_of_month, date),
-                        SysTraffic.org_id == org_id,
-                        SysTraffic.op_type.in_(self.upload_type_list)
-                    )
-                    org_monthly_upload_traffic_size = self.edb_session.scalars(stmt2).first()
+                    org_monthly_upload_traffic_size = monthly_org_traffic.get((org_id, 'upload'))
 
                     upload_traffic_threshold = row[2]
 
@@ -569,6 +616,11 @@ class TrafficInfoCounter(object):
                         seafile_api.org_set_upload_rate_limit(org_id, upload_limit_format)
                         upload_rate_limit_orgs[org_id] = True
 
+                if org_id > 0 and oper in self.download_type_list:
+                    monthly_org_traffic[(org_id, 'download')] = monthly_org_traffic.get((org_id, 'download'), 0) + size
+                elif org_id > 0 and oper in self.upload_type_list:
+                    monthly_org_traffic[(org_id, 'upload')] = monthly_org_traffic.get((org_id, 'upload'), 0) + size
+
                 stmt = select(SysTraffic.size).where(
                                            SysTraffic.timestamp == date,
                                            SysTraffic.org_id == org_id,
@@ -587,13 +639,26 @@ class TrafficInfoCounter(object):
 
             except Exception as e:
                 logging.warning('Failed to update traffic info: %s.', e)
+                return False
+
+        return True
 
 
 class MonthlyTrafficCounter(object):
-    def __init__(self):
+    """Count MonthlyUserTraffic and MonthlySysTraffic from UserTraffic.
+
+    By default the whole month is counted again every run. In incremental mode
+    only the days after the watermark are read: UserTraffic of yesterday and
+    today may still grow, so their sums are kept in monthly_traffic_snapshot
+    and only the difference to the last run is added to the monthly records.
+    The month is counted in full when there is no snapshot of it, e.g. after a
+    restart or at the beginning of a month.
+    """
+    def __init__(self, incremental=False):
         self.edb_session = init_db_session_class()()
+        self.incremental = incremental
 
-    def start_count(self):
+    def start_count(self, full=False):
         time_start = time.time()
         logging.info('Start counting monthly traffic info..')
 
@@ -623,73 +688,23 @@ class MonthlyTrafficCounter(object):
 
                 reset_rate_limit_dates.append(first_day)
 
-        try:
-            # Get raw data from UserTraffic, then update MonthlyUserTraffic and MonthlySysTraffic.
-            stmt = select(UserTraffic.user, UserTraffic.org_id,
-                          UserTraffic.op_type, func.sum(UserTraffic.size).label('size')).where(
-                          UserTraffic.timestamp.between(first_day, today)).group_by(
-                          UserTraffic.user, UserTraffic.org_id, UserTraffic.op_type).order_by(UserTraffic.user)
-            results = self.edb_session.execute(stmt).all()
-
-            # The raw data is ordered by 'user', and also we count monthly data by user
-            # format: user_size_dict[(username, org_id)] = {'web-file-upload': 10, 'web-file-download': 0...}
-            last_key = ()
-            cur_key = ()
-            user_size_dict = {}
-            init_size_dict = {'web_file_upload': 0, 'web_file_download': 0, 'sync_file_download': 0,
-                              'sync_file_upload': 0, 'link_file_upload': 0, 'link_file_download': 0}
-
-            org_size_dict = {}
-
-            trans_count = 0
-            # Update MonthlyUserTraffic.
-            for result in results:
-                trans_count += 1
-                user = result[0]
-                org_id = result[1]
-                size = result[3]
-                # op_type in UserTraffic uses '-', convert to '_'
-                oper = result[2].replace('-', '_')
-
-                cur_key = (user, org_id)
-                if cur_key not in user_size_dict:
-                    user_size_dict[cur_key] = init_size_dict.copy()
-                user_size_dict[cur_key][oper] += size
-
-                # We reached a new user, update last user's data if exists.
-                if cur_key != last_key:
-                    if not last_key:
-                        last_key = cur_key
-                    else:
-                        self.update_monthly_user_traffic_record (last_key[0], last_key[1], first_day, user_size_dict[last_key])
-                        del user_size_dict[last_key]
-                last_key = cur_key
-
-                # Count org data
-                if org_id not in org_size_dict:
-                    org_size_dict[org_id] = init_size_dict.copy()
-                    org_size_dict[org_id][oper] = size
-                else:
-                    org_size_dict[org_id][oper] += size
-
-                # commit every 100 items.
-                if trans_count >= 100:
-                    self.edb_session.commit()
-                    trans_count = 0
-
-            # The above loop would miss a user, update it
-            if cur_key in user_size_dict:
-                self.update_monthly_user_traffic_record (cur_key[0], cur_key[1], first_day, user_size_dict[cur_key])
-                del user_size_dict[cur_key]
+        # days of UserTraffic which may still be updated by TrafficInfoCounter
+        open_days = [day for day in (today - timedelta(days=1), today) if day >= first_day]
 
-            # Update MonthlySysTraffic.
-            for org_id in org_size_dict:
-                self.update_monthly_org_traffic_record(org_id, first_day, org_size_dict[org_id])
+        try:
+            if self.incremental and not full and monthly_traffic_snapshot.get('timestamp') == first_day:
+                snapshot = self.count_delta(first_day, open_days)
+            else:
+                snapshot = self.count_full(first_day, today, open_days)
 
             try:
                 self.edb_session.commit()
+                monthly_traffic_snapshot.clear()
+                if self.incremental:
+                    monthly_traffic_snapshot.update(snapshot)
             except Exception as e:
                 logging.warning('Failed to commit monthly traffic info: %s.', e)
+                monthly_traffic_snapshot.clear()
             finally:
                 logging.info('Monthly traffic counter finished, update %d user items, %d org items, total time: %s seconds.' %\
                             (self.user_item_count, self.sys_item_count, str(time.time() - time_start)))
@@ -697,37 +712,131 @@ class MonthlyTrafficCounter(object):
 
         except Exception as e:
             logging.warning('Failed to update monthly traffic info: %s.', e)
+            monthly_traffic_snapshot.clear()
             self.edb_session.close()
 
-    def update_monthly_user_traffic_record(self, user, org_id, timestamp, size_dict):
-        stmt = select(MonthlyUserTraffic).where(
-                                   MonthlyUserTraffic.timestamp == timestamp,
-                                   MonthlyUserTraffic.user == user,
-                                   MonthlyUserTraffic.org_id == org_id).limit(1)
-        if self.edb_session.scalars(stmt).first():
-            stmt = update(MonthlyUserTraffic).where(
-                                   MonthlyUserTraffic.timestamp == timestamp,
-                                   MonthlyUserTraffic.user == user,
-                                   MonthlyUserTraffic.org_id == org_id).values(size_dict)
-            self.edb_session.execute(stmt)
+    def count_by_user(self, condition, open_days):
+        """Return {(user, org_id): size_dict} of UserTraffic matching condition,
+        and the same of the open days among them.
+        """
+        stmt = select(UserTraffic.user, UserTraffic.org_id, UserTraffic.op_type,
+                      UserTraffic.timestamp, func.sum(UserTraffic.size).label('size')).where(
+                      condition).group_by(
+                      UserTraffic.user, UserTraffic.org_id, UserTraffic.op_type, UserTraffic.timestamp)
+        user_size_dict = {}
+        open_user_size_dict = {}
+        for user, org_id, op_type, timestamp, size in self.edb_session.execute(stmt).all():
+            key = (user, org_id)
+            # op_type in UserTraffic uses '-', convert to '_'
+            oper = op_type.replace('-', '_')
+            size_dicts = [user_size_dict]
+            if timestamp.date() in open_days:
+                size_dicts.append(open_user_size_dict)
+            for size_dict in size_dicts:
+                if key not in size_dict:
+                    size_dict[key] = dict.fromkeys(MONTHLY_TRAFFIC_COLUMNS, 0)
+                size_dict[key][oper] += int(size)
+        return user_size_dict, open_user_size_dict
+
+    def count_full(self, first_day, today, open_days):
+        # Get raw data from UserTraffic, then update MonthlyUserTraffic and MonthlySysTraffic.
+        user_size_dict, open_user_size_dict = self.count_by_user(
+            UserTraffic.timestamp.between(first_day, today), open_days)
+
+        org_size_dict = {}
+        for (user, org_id), size_dict in user_size_dict.items():
+            if org_id not in org_size_dict:
+                org_size_dict[org_id] = size_dict.copy()
+            else:
+                for column in MONTHLY_TRAFFIC_COLUMNS:
+                    org_size_dict[org_id][column] += size_dict[column]
+
+        self.save_monthly_records(MonthlyUserTraffic, first_day, user_size_dict)
+        self.save_monthly_records(MonthlySysTraffic, first_day, {(k, ): v for k, v in org_size_dict.items()})
+        self.user_item_count += len(user_size_dict)
+        self.sys_item_count += len(org_size_dict)
+
+        return {'timestamp': first_day, 'days': open_days, 'users': open_user_size_dict}
+
+    def count_delta(self, first_day, open_days):
+        """Add the traffic of the open days since the last run, the days which
+        were open in the last run are read again as they may have grown since.
+        """
+        days = sorted(set(monthly_traffic_snapshot['days']) | set(open_days))
+        counted = monthly_traffic_snapshot['users']
+        current, open_user_size_dict = self.count_by_user(UserTraffic.timestamp.in_(days), open_days)
+
+        user_delta_dict = {}
+        org_delta_dict = {}
+        for key, size_dict in current.items():
+            counted_size_dict = counted.get(key, {})
+            delta_dict = {column: size_dict[column] - counted_size_dict.get(column, 0)
+                          for column in MONTHLY_TRAFFIC_COLUMNS}
+            if not any(delta_dict.values()):
+                continue
+            user_delta_dict[key] = delta_dict
+
+            org_id = key[1]
+            if org_id not in org_delta_dict:
+                org_delta_dict[org_id] = delta_dict.copy()
+            else:
+                for column in MONTHLY_TRAFFIC_COLUMNS:
+                    org_delta_dict[org_id][column] += delta_dict[column]
+
+        self.save_monthly_records(MonthlyUserTraffic, first_day, user_delta_dict, increment=True)
+        self.save_monthly_records(MonthlySysTraffic, first_day, {(k, ): v for k, v in org_delta_dict.items()},
+                                  increment=True)
+        self.user_item_count += len(user_delta_dict)
+        self.sys_item_count += len(org_delta_dict)
+
+        return {'timestamp': first_day, 'days': open_days, 'users': open_user_size_dict}
+
+    def save_monthly_records(self, model, timestamp, size_dicts, increment=False):
+        """Set or add the size dicts to the monthly records of ``timestamp``.
+
+        Keys of ``size_dicts`` are (user, org_id) for MonthlyUserTraffic and
+        (org_id, ) for MonthlySysTraffic. Existing records are updated with one
+        executemany and the others are added with a multi-row INSERT.
+        """
+        table = model.__table__
+        if model is MonthlyUserTraffic:
+            key_columns = [table.c.user, table.c.org_id]
         else:
-            new_record = MonthlyUserTraffic(user, org_id, timestamp, size_dict)
-            self.edb_session.add(new_record)
-        self.user_item_count += 1
-
-    def update_monthly_org_traffic_record(self, org_id, timestamp, size_dict):
-        stmt = select(MonthlySysTraffic).where(
-                                   MonthlySysTraffic.timestamp == timestamp,
-                                   MonthlySysTraffic.org_id == org_id).limit(1)
-        if self.edb_session.scalars(stmt).first():
-            stmt = update(MonthlySysTraffic).where(
-                                   MonthlySysTraffic.timestamp == timestamp,
-                                   MonthlySysTraffic.org_id == org_id).values(size_dict)
-            self.edb_session.execute(stmt)
+            key_columns = [table.c.org_id]
+
+        if increment:
+            values = {column: table.c[column] + bindparam('_' + column) for column in MONTHLY_TRAFFIC_COLUMNS}
         else:
-            new_record = MonthlySysTraffic(timestamp, org_id, size_dict)
-            self.edb_session.add(new_record)
-        self.sys_item_count += 1
+            values = {column: bindparam('_' + column) for column in MONTHLY_TRAFFIC_COLUMNS}
+        update_stmt = update(table).where(table.c.id == bindparam('_id')).values(values)
+
+        keys = list(size_dicts)
+        for i in range(0, len(keys), MONTHLY_TRAFFIC_WRITE_CHUNK):
+            chunk = keys[i: i + MONTHLY_TRAFFIC_WRITE_CHUNK]
+            conditions = [table.c.timestamp == timestamp]
+            for idx, column in enumerate(key_columns):
+                conditions.append(column.in_({key[idx] for key in chunk}))
+            stmt = select(table.c.id, *key_columns).where(*conditions)
+            record_ids = {tuple(row[1:]): row[0] for row in self.edb_session.execute(stmt).all()}
+
+            updates = []
+            inserts = []
+            for key in chunk:
+                size_dict = size_dicts[key]
+                if key in record_ids:
+                    params = {'_' + column: size_dict[column] for column in MONTHLY_TRAFFIC_COLUMNS}
+                    params['_id'] = record_ids[key]
+                    updates.append(params)
+                else:
+                    record = dict(zip([column.key for column in key_columns], key))
+                    record['timestamp'] = timestamp
+                    record.update(size_dict)
+                    inserts.append(record)
+
+            if updates:
+                self.edb_session.execute(update_stmt, updates)
+            if inserts:
+                self.edb_session.execute(insert(table).values(inserts))
 
 class UserActivityCounter(object):
     def __init__(self):
@@ -735,44 +844,41 @@ class UserActivityCounter(object):
 
     def start_count(self):
         logging.info('Start counting user activity info..')
-        ret = 0
+        records = login_records.swap()
+        login_records.publish_counters()
+        if not records:
+            login_records.commit()
+            return
+
+        items = list(records.items())
         try:
-            while True:
-                all_keys = list(login_records.keys())
-                if len(all_keys) > 300:
-                    keys = all_keys[:300]
-                    self.update_login_record(keys)
-                else:
-                    keys = all_keys
-                    self.update_login_record(keys)
-                    break
+            for i in range(0, len(items), USER_ACTIVITY_WRITE_CHUNK):
+                self.update_login_record(items[i:i + USER_ACTIVITY_WRITE_CHUNK])
             self.edb_session.commit()
-            logging.info("[UserActivityCounter] update %s items." % len(all_keys))
+            login_records.commit()
+            logging.info("[UserActivityCounter] update %s items." % len(items))
         except Exception as e:
             logging.warning('[UserActivityCounter] Failed to update user activity info: %s.', e)
+            # REPLACE INTO is idempotent, so write them again in the next run
+            login_records.restore(items)
         finally:
             self.edb_session.close()
 
-    def update_login_record(self, keys):
-        """ example:
-                cmd: 'REPLACE INTO UserActivityStat values (:key1, :name1, :tim1), (:key2, :name2, :time2)'
-                data: {key1: xxx, name1: xxx, time1: xxx, key2: xxx, name2: xxx, time2: xxx}
-        """
-        l = len(keys)
-        if l <= 0:
+    def update_login_record(self, items):
+        """Write a list of ((login_name, 'Y-m-d'), org_id) in one executemany."""
+        if not items:
             return
 
-        cmd = "REPLACE INTO UserActivityStat (name_time_md5, username, timestamp, org_id) values"
-        cmd_extend = ''.join([' (:key' + str(i) +', :name'+ str(i) +', :time'+ str(i) + ', :org' + str(i) + '),'\
-                     for i in range(l)])[:-1]
-        cmd += cmd_extend
-        data = {}
-        for key in keys:
-            pop_data = login_records.pop(key)
-            i = str(keys.index(key))
-            data['key'+i] = key
-            data['name'+i] = pop_data[0]
-            data['time'+i] = pop_data[1]
-            data['org'+i] = pop_data[2]
+        cmd = "REPLACE INTO UserActivityStat (name_time_md5, username, timestamp, org_id) " \
+              "VALUES (:key, :name, :time, :org)"
+        data = []
+        for (login_name, date_str), org_id in items:
+            time_str = date_str + ' 00:00:00'
+            data.append({
+                'key': hashlib.md5((login_name + time_str).encode('utf-8')).hexdigest(),
+                'name': login_name,
+                'time': datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S'),
+                'org': org_id,
+            })
 
         self.edb_session.execute(text(cmd), data)
@@ -1,15 +1,19 @@
 import logging
-from sqlalchemy import desc, func, distinct, select
+from sqlalchemy import desc, func, select
 from datetime import datetime
 
-from .models import UserActivityStat, UserTraffic, SysTraffic, \
-                   FileOpsStat, TotalStorageStat, MonthlyUserTraffic, MonthlySysTraffic
+from .models import UserTraffic, MonthlyUserTraffic, MonthlySysTraffic
+from .rollup import get_daily_stats, cached_stats, ROLLUP_ACTIVITY, ROLLUP_STORAGE, \
+                    ROLLUP_FILE_OPS, ROLLUP_TRAFFIC
 
 from seaserv import seafile_api, get_org_id_by_repo_id
 
 repo_org = {}
 is_org = -1
 
+TRAFFIC_OP_TYPES = ('web-file-upload', 'web-file-download', 'sync-file-download',
+                    'sync-file-upload', 'link-file-upload', 'link-file-download')
+
 def get_org_id(repo_id):
     global is_org
     if is_org == -1:
@@ -32,174 +36,61 @@ def get_org_id(repo_id):
     return org_id
 
 
+@cached_stats
 def get_user_activity_stats_by_day(session, start, end, offset='+00:00'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
     # offset is not supported for now
     offset='+00:00'
 
-    stmt = select(func.date(func.convert_tz(UserActivityStat.timestamp, '+00:00', offset)).label("timestamp"),
-                  func.count(distinct(UserActivityStat.username)).label("number")).where(
-                  UserActivityStat.timestamp.between(
-                      func.convert_tz(start_at_0, offset, '+00:00'),
-                      func.convert_tz(end_at_23, offset, '+00:00'))).group_by(
-                      func.date(func.convert_tz(UserActivityStat.timestamp, '+00:00', offset))).order_by("timestamp")
-    rows = session.execute(stmt).all()
-    ret = []
-
-    for row in rows:
-        ret.append((datetime.strptime(str(row[0]), '%Y-%m-%d'), row[1]))
-    return ret
+    rows = get_daily_stats(session, ROLLUP_ACTIVITY, start, end, offset)
+    return [(timestamp, number) for timestamp, _, number in rows]
 
+@cached_stats
 def get_org_user_activity_stats_by_day(session, org_id, start, end):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
     ret = []
-
-    stmt = select(UserActivityStat.timestamp.label("timestamp"),
-                  func.count(UserActivityStat.username).label("number")).where(
-                  UserActivityStat.timestamp.between(start_at_0, end_at_23),
-                  UserActivityStat.org_id == org_id).group_by("timestamp").order_by("timestamp")
     try:
-        rows = session.execute(stmt).all()
-
-        for row in rows:
-            timestamp = row[0]
-            num = row[1]
+        rows = get_daily_stats(session, ROLLUP_ACTIVITY, start, end, org_id=org_id)
+        for timestamp, _, num in rows:
             ret.append({"timestamp":timestamp, "number":num})
     except Exception as e:
         logging.warning('Failed to get org-user activities by day: %s.', e)
 
     return ret
 
-def _get_total_storage_stats(session, start, end, offset='+00:00', org_id=0):
+@cached_stats
+def get_total_storage_stats_by_day(session, start, end, offset='+00:00'):
     ret = []
     try:
-        stmt = select(func.convert_tz(TotalStorageStat.timestamp, '+00:00', offset).label("timestamp"),
-                      func.sum(TotalStorageStat.total_size).label("total_size"))
-        if org_id == 0:
-            stmt = stmt.where(TotalStorageStat.timestamp.between(
-                         func.convert_tz(start, offset, '+00:00'),
-                         func.convert_tz(end, offset, '+00:00')))
-        else:
-            stmt = stmt.where(TotalStorageStat.timestamp.between(
-                         func.convert_tz(start, offset, '+00:00'),
-                         func.convert_tz(end, offset, '+00:00')),
-                         TotalStorageStat.org_id == org_id)
-        stmt = stmt.group_by("timestamp").order_by("timestamp")
-        rows = session.execute(stmt).all()
-
-        for row in rows:
-            ret.append((row[0], row[1]))
+        rows = get_daily_stats(session, ROLLUP_STORAGE, start, end, offset)
+        for timestamp, _, total_size in rows:
+            ret.append((timestamp, total_size))
     except Exception as e:
         logging.warning('Failed to get total storage: %s.', e)
 
     return ret
 
-def get_total_storage_stats_by_day(session, start, end, offset='+00:00'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
-    results = _get_total_storage_stats(session, start_at_0, end_at_23, offset)
-    results.reverse()
-
-    '''
-    Traverse data from end to start,
-    record the last piece of data in each day.
-    '''
-
-    last_date = None
-    ret = []
-    for result in results:
-        cur_time = result[0]
-        cur_num = result[1]
-        cur_date = datetime.date(cur_time)
-        if cur_date != last_date or last_date is None:
-            ret.append((datetime.strptime(str(cur_date), '%Y-%m-%d'), cur_num))
-            last_date = cur_date
-
-    ret.reverse()
-    return ret
-
+@cached_stats
 def get_org_storage_stats_by_day(session, org_id, start, end, offset='+00:00'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
-    results = _get_total_storage_stats(session, start_at_0, end_at_23, offset, org_id)
-    results.reverse()
-
-    '''
-    Traverse data from end to start,
-    record the last piece of data in each day.
-    '''
-
-    last_date = None
     ret = []
-    for result in results:
-        cur_time = result[0]
-        cur_num = result[1]
-        cur_date = datetime.date(cur_time)
-        if cur_date != last_date or last_date is None:
-            ret.append({"timestamp":datetime.strptime(str(cur_date), '%Y-%m-%d'),\
-                        "number" : cur_num})
-            last_date = cur_date
-    ret.reverse()
+    try:
+        rows = get_daily_stats(session, ROLLUP_STORAGE, start, end, offset, org_id)
+        for timestamp, _, total_size in rows:
+            ret.append({"timestamp":timestamp, "number":total_size})
+    except Exception as e:
+        logging.warning('Failed to get total storage: %s.', e)
 
     return ret
 
+@cached_stats
 def get_file_ops_stats_by_day(session, start, end, offset='+00:00'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
-    stmt = select(func.date(func.convert_tz(FileOpsStat.timestamp, '+00:00', offset)).label("timestamp"),
-                  func.sum(FileOpsStat.number).label("number"),
-                  FileOpsStat.op_type).where(FileOpsStat.timestamp.between(
-                      func.convert_tz(start_at_0, offset, '+00:00'),
-                      func.convert_tz(end_at_23, offset, '+00:00'))).group_by(
-                      func.date(func.convert_tz(FileOpsStat.timestamp, '+00:00', offset)),
-                      FileOpsStat.op_type).order_by("timestamp")
-
-    rows = session.execute(stmt).all()
-    ret = []
-
-    for row in rows:
-        ret.append((datetime.strptime(str(row[0]), '%Y-%m-%d'), row[2], int(row[1])))
-    return ret
+    rows = get_daily_stats(session, ROLLUP_FILE_OPS, start, end, offset)
+    return [(timestamp, op_type, number) for timestamp, op_type, number in rows]
 
+@cached_stats
 def get_org_file_ops_stats_by_day(session, org_id, start, end, offset='+00:00'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
     ret = []
-
     try:
-        stmt = select(func.date(func.convert_tz(FileOpsStat.timestamp, '+00:00', offset)).label("timestamp"),
-                      func.sum(FileOpsStat.number).label("number"), FileOpsStat.op_type).where(
-                      FileOpsStat.timestamp.between(
-                          func.convert_tz(start_at_0, offset, '+00:00'),
-                          func.convert_tz(end_at_23, offset, '+00:00')),
-                      FileOpsStat.org_id == org_id).group_by(
-                          func.date(func.convert_tz(FileOpsStat.timestamp, '+00:00', offset)),
-                          FileOpsStat.op_type).order_by("timestamp")
-
-        rows = session.execute(stmt).all()
-
-        for row in rows:
-            timestamp = datetime.strptime(str(row[0]), '%Y-%m-%d')
-            op_type = row[2]
-            num = int(row[1])
+        rows = get_daily_stats(session, ROLLUP_FILE_OPS, start, end, offset, org_id)
+        for timestamp, op_type, num in rows:
             ret.append({"timestamp":timestamp, "op_type":op_type, "number":num})
     except Exception as e:
         logging.warning('Failed to get org-file operations data: %s.', e)
@@ -286,83 +177,27 @@ def get_user_traffic_by_day(session, user, start, end, offset='+00:00', op_type=
         ret.append((datetime.strptime(str(row[0]), '%Y-%m-%d'), row[2], int(row[1])))
     return ret
 
+@cached_stats
 def get_org_traffic_by_day(session, org_id, start, end, offset='+00:00', op_type='all'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
     # offset is not supported for now
     offset='+00:00'
 
-    if op_type == 'web-file-upload' or op_type == 'web-file-download' or op_type == 'sync-file-download' \
-       or op_type == 'sync-file-upload' or op_type == 'link-file-upload' or op_type == 'link-file-download':
-        stmt = select(func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)).label("timestamp"),
-                      func.sum(SysTraffic.size).label("size"),
-                      SysTraffic.op_type).where(SysTraffic.timestamp.between(
-                          func.convert_tz(start_at_0, offset, '+00:00'),
-                          func.convert_tz(end_at_23, offset, '+00:00')),
-                          SysTraffic.org_id == org_id,
-                          SysTraffic.op_type == op_type).group_by(
-                          SysTraffic.org_id,
-                          func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)),
-                          SysTraffic.op_type).order_by("timestamp")
-    elif op_type == 'all':
-        stmt = select(func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)).label("timestamp"),
-                      func.sum(SysTraffic.size).label("size"),
-                      SysTraffic.op_type).where(SysTraffic.timestamp.between(
-                          func.convert_tz(start_at_0, offset, '+00:00'),
-                          func.convert_tz(end_at_23, offset, '+00:00')),
-                          SysTraffic.org_id == org_id).group_by(
-                          SysTraffic.org_id,
-                          func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)),
-                          SysTraffic.op_type).order_by("timestamp")
-    else:
+    if op_type != 'all' and op_type not in TRAFFIC_OP_TYPES:
         return []
 
-    rows = session.execute(stmt).all()
-    ret = []
-
-    for row in rows:
-        ret.append((datetime.strptime(str(row[0]), '%Y-%m-%d'), row[2], int(row[1])))
-    return ret
+    rows = get_daily_stats(session, ROLLUP_TRAFFIC, start, end, offset, org_id)
+    return [row for row in rows if op_type == 'all' or row[1] == op_type]
 
+@cached_stats
 def get_system_traffic_by_day(session, start, end, offset='+00:00', op_type='all'):
-    start_str = start.strftime('%Y-%m-%d 00:00:00')
-    end_str = end.strftime('%Y-%m-%d 23:59:59')
-    start_at_0 = datetime.strptime(start_str, '%Y-%m-%d %H:%M:%S')
-    end_at_23 = datetime.strptime(end_str, '%Y-%m-%d %H:%M:%S')
-
     # offset is not supported for now
     offset='+00:00'
 
-    if op_type == 'web-file-upload' or op_type == 'web-file-download' or op_type == 'sync-file-download' \
-       or op_type == 'sync-file-upload' or op_type == 'link-file-upload' or op_type == 'link-file-download':
-        stmt = select(func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)).label("timestamp"),
-                      func.sum(SysTraffic.size).label("size"),
-                      SysTraffic.op_type).where(SysTraffic.timestamp.between(
-                          func.convert_tz(start_at_0, offset, '+00:00'),
-                          func.convert_tz(end_at_23, offset, '+00:00')),
-                          SysTraffic.op_type == op_type).group_by(
-                          func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)),
-                          SysTraffic.op_type).order_by("timestamp")
-    elif op_type == 'all':
-        stmt = select(func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)).label("timestamp"),
-                      func.sum(SysTraffic.size).label("size"),
-                      SysTraffic.op_type).where(SysTraffic.timestamp.between(
-                          func.convert_tz(start_at_0, offset, '+00:00'),
-                          func.convert_tz(end_at_23, offset, '+00:00'))).group_by(
-                          func.date(func.convert_tz(SysTraffic.timestamp, '+00:00', offset)),
-                          SysTraffic.op_type).order_by("timestamp")
-    else:
+    if op_type != 'all' and op_type not in TRAFFIC_OP_TYPES:
         return []
 
-    rows = session.execute(stmt).all()
-    ret = []
-
-    for row in rows:
-        ret.append((datetime.strptime(str(row[0]), '%Y-%m-%d'), row[2], int(row[1])))
-    return ret
+    rows = get_daily_stats(session, ROLLUP_TRAFFIC, start, end, offset)
+    return [row for row in rows if op_type == 'all' or row[1] == op_type]
 
 
 def get_all_users_traffic_by_month(session, month, start=-1, limit=-1, order_by='user', org_id=-1):
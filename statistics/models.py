@@ -189,3 +189,62 @@ class OrgQuotaUsage(Base):
         self.quota = quota
         self.timestamp = timestamp
         
+
+
+class StatsDailyRollup(Base):
+    """Daily totals of a statistics table, see statistics/rollup.py.
+
+    ``timestamp`` is a day in the time zone of ``tz_offset``, ``org_id`` is
+    NULL for the totals of all orgs.
+    """
+    __tablename__ = 'StatsDailyRollup'
+
+    id = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    kind = mapped_column(String(length=16), nullable=False)
+    tz_offset = mapped_column(String(length=6), nullable=False)
+    timestamp = mapped_column(DateTime, nullable=False)
+    org_id = mapped_column(Integer)
+    op_type = mapped_column(String(length=48), nullable=False)
+    number = mapped_column(BigInteger, nullable=False)
+
+    __table_args__ = (Index('idx_rollup_kind_offset_time_org', 'kind', 'tz_offset', 'timestamp', 'org_id'), )
+
+
+class StatsRollupRange(Base):
+    """Days of StatsDailyRollup which are filled for a kind and time zone, and
+    the first day the dashboard has asked for.
+    """
+    __tablename__ = 'StatsRollupRange'
+
+    id = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind = mapped_column(String(length=16), nullable=False)
+    tz_offset = mapped_column(String(length=6), nullable=False)
+    first_day = mapped_column(DateTime, nullable=False)
+    last_day = mapped_column(DateTime, nullable=False)
+    requested_day = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (Index('idx_rollup_range_kind_offset', 'kind', 'tz_offset', unique=True), )
+
+    def __init__(self, kind, tz_offset, first_day, last_day, requested_day):
+        super().__init__()
+        self.kind = kind
+        self.tz_offset = tz_offset
+        self.first_day = first_day
+        self.last_day = last_day
+        self.requested_day = requested_day
+
+
+class StatsCounterState(Base):
+    """The last time processed by a statistics counter, e.g. the last hour
+    counted by FileOpsCounter, which may have written no rows for it.
+    """
+    __tablename__ = 'StatsCounterState'
+
+    id = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name = mapped_column(String(length=32), nullable=False, unique=True)
+    timestamp = mapped_column(DateTime, nullable=False)
+
+    def __init__(self, name, timestamp):
+        super().__init__()
+        self.name = name
+        self.timestamp = timestamp
@@ -2,147 +2,136 @@ import json
 import time
 import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread, Event
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy import text
 from seafevents.app.event_redis import RedisClient
 from seafevents.mq import get_mq
 from seafevents.app.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
-from seafevents.app.cache_provider import cache
 
 from seafevents.db import init_db_session_class
-from .models import OrgQuotaUsage, UserQuotaUsage
+from .accumulator import StatsAccumulator, replace_value, is_journal_enabled
 from seafevents.utils.seafile_db import SeafileDB
 
-storage_changed_repo_ids = {}
+# {(repo_id, ): 1}
+storage_changed_repo_ids = StatsAccumulator('storage_changed_repos', merge=replace_value)
 
 REPO_SIZE_TASK_CHANNEL_NAME = "repo_size_task"
-CACHE_TIME_OUT = 24 * 60 * 60
+QUOTA_USAGE_WORKERS = 4
+QUOTA_USAGE_WRITE_CHUNK = 1000
 
 class QuotaUsageCounter(object):
-    
-    def __init__(self, seafile_db=None):
+    """Recompute the quota usage of the owners and orgs of changed repos.
+
+    Changed repos are first mapped to their distinct owners and orgs, so the
+    usage of an owner is computed once however many of its repos changed.
+    Usages are summed with grouped queries, quotas are fetched from seafile
+    in a bounded thread pool, and results are saved with batched upserts.
+    """
+
+    def __init__(self, seafile_db=None, workers=QUOTA_USAGE_WORKERS):
         self._db_session_class = init_db_session_class()
         self.seafile_api = seafile_db
-    
-    def _get_org_id_by_repo_id(self, repo_id):
-        
-        cache_key = f"{repo_id}_org_id"
-        org_id = cache.get(cache_key)
-        if not org_id:
-            org_id = self.seafile_api.get_org_id_by_repo_id(repo_id)
-            cache.set(cache_key, org_id, CACHE_TIME_OUT)
-        return int(org_id)
-    
-    def _get_repo_owner_by_repo_id(self, repo_id):
-        cache_key = f"{repo_id}_repo_owner"
-        repo_owner = cache.get(cache_key)
-        if repo_owner:
-            return repo_owner
-        
-        org_id = self._get_org_id_by_repo_id(repo_id)
-        if org_id > 0:
-            # org_user
-            repo_owner = self.seafile_api.get_org_repo_owner(repo_id)
-        else:
-            repo_owner = self.seafile_api.get_repo_owner(repo_id)
-        
-        if repo_owner:
-            cache.set(cache_key, repo_owner, CACHE_TIME_OUT)
-        return repo_owner
-    
-    def get_available_user_info_by_repo_id(self, repo_id):
-        # user usage, user quota
-        org_id = self._get_org_id_by_repo_id(repo_id)
-        repo_owner = self._get_repo_owner_by_repo_id(repo_id)
-        
-        if not repo_owner:
-            logging.warning(f'The repo {repo_id} has no repo_owner when counting quota usage.')
-            return None, None, None, None
-        
-        if '@seafile_group' in repo_owner:
-            # Ignore the repo infomations in department
-            return None, None, None, None
-        
-        if org_id > 0:
-            quota_usage = self.seafile_api.get_org_user_quota_usage(org_id, repo_owner)
-            quota_total = self.seafile_api.get_org_user_quota(org_id, repo_owner)
-        
-        else:
-            quota_usage = self.seafile_api.get_user_self_usage(repo_owner)
-            quota_total = self.seafile_api.get_user_quota(repo_owner)
-        
-        return org_id, repo_owner, quota_usage, quota_total
-    
-    def get_available_org_info_by_repo_id(self, repo_id):
-        # org usage, org quota
-        org_id = self._get_org_id_by_repo_id(repo_id)
-        if org_id > 0:
-            org_quota_usage = self.seafile_api.get_org_quota_usage(org_id)
-            org_quota_total = self.seafile_api.get_org_quota(org_id)
-        else:
-            return None, None, None
-        
-        return org_id, org_quota_usage, org_quota_total
-    
-    def save_user_quota_usage(self, repo_id):
-        org_id, repo_owner, quota_usage, quota_total = self.get_available_user_info_by_repo_id(repo_id)
-        if not repo_owner:
-            return
+        self._workers = workers
 
-        timestamp = datetime.datetime.utcnow()
-        with self._db_session_class() as session:
+    def plan(self, repos):
+        """Return the (org_id, owner) pairs and the org ids to recompute for ``repos``."""
+        repo_owners = self.seafile_api.get_repos_owner(repos)
+        owners = set()
+        org_ids = set()
+        for repo_id in repos:
+            org_id, repo_owner = repo_owners.get(repo_id, (-1, None))
+            if org_id > 0:
+                org_ids.add(org_id)
+            if not repo_owner:
+                logging.warning(f'The repo {repo_id} has no repo_owner when counting quota usage.')
+                continue
+            if '@seafile_group' in repo_owner:
+                # Ignore the repo infomations in department
+                continue
+            owners.add((org_id, repo_owner))
+        return owners, org_ids
+
+    def get_users_quota_usage(self, owners):
+        """Return [(org_id, owner, usage, quota)]."""
+        users = [owner for org_id, owner in owners if org_id <= 0]
+        usages = {(-1, owner): usage for owner, usage in self.seafile_api.get_users_self_usage(users).items()}
+        org_users = {}
+        for org_id, owner in owners:
+            if org_id > 0:
+                org_users.setdefault(org_id, []).append(owner)
+        for org_id, emails in org_users.items():
+            for owner, usage in self.seafile_api.get_org_users_quota_usage(org_id, emails).items():
+                usages[(org_id, owner)] = usage
+
+        def get_quota(item):
+            org_id, owner = item
             try:
-                user_quota_usage_obj = session.query(UserQuotaUsage).filter_by(username=repo_owner).one()
-                user_quota_usage_obj.usage = quota_usage
-                user_quota_usage_obj.quota = quota_total
-                user_quota_usage_obj.timestamp = timestamp
-            except NoResultFound:
-                user_quota_usage_obj = UserQuotaUsage(
-                    org_id = org_id,
-                    username = repo_owner,
-                    usage = quota_usage,
-                    quota = quota_total,
-                    timestamp = timestamp
-                )
-                session.add(user_quota_usage_obj)
-            
-            session.commit()
-    
-    def save_org_quota_usage(self, repo_id):
-        org_id, org_quota_usage, org_quota_total = self.get_available_org_info_by_repo_id(repo_id)
-        if not org_id:
-            return
+                if org_id > 0:
+                    return self.seafile_api.get_org_user_quota(org_id, owner)
+                return self.seafile_api.get_user_quota(owner)
+            except Exception as e:
+                logging.exception(f'Counting quota usage error: {e}, user: {owner}')
+                return None
+
+        owners = sorted(owners)
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            quotas = list(executor.map(get_quota, owners))
+        return [(org_id, owner, usages.get((org_id, owner), 0), quota)
+                for (org_id, owner), quota in zip(owners, quotas) if quota is not None]
+
+    def get_orgs_quota_usage(self, org_ids):
+        """Return [(org_id, usage, quota)]."""
+        def get_quota(org_id):
+            try:
+                return self.seafile_api.get_org_quota(org_id)
+            except Exception as e:
+                logging.exception(f'Counting quota usage error: {e}, org_id: {org_id}')
+                return None
+
+        org_ids = sorted(org_ids)
+        usages = self.seafile_api.get_orgs_quota_usage(org_ids)
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            quotas = list(executor.map(get_quota, org_ids))
+        return [(org_id, usages.get(org_id, 0), quota)
+                for org_id, quota in zip(org_ids, quotas) if quota is not None]
 
+    def save_quota_usages(self, user_usages, org_usages):
         timestamp = datetime.datetime.utcnow()
+        user_sql = """
+            INSERT INTO user_quota_usage (org_id, username, `usage`, quota, timestamp)
+            VALUES (:org_id, :username, :usage, :quota, :timestamp)
+            ON DUPLICATE KEY UPDATE `usage`=VALUES(`usage`), quota=VALUES(quota), timestamp=VALUES(timestamp)
+            """
+        org_sql = """
+            INSERT INTO org_quota_usage (org_id, `usage`, quota, timestamp)
+            VALUES (:org_id, :usage, :quota, :timestamp)
+            ON DUPLICATE KEY UPDATE `usage`=VALUES(`usage`), quota=VALUES(quota), timestamp=VALUES(timestamp)
+            """
+        user_records = [{'org_id': org_id, 'username': owner, 'usage': usage, 'quota': quota, 'timestamp': timestamp}
+                        for org_id, owner, usage, quota in user_usages]
+        org_records = [{'org_id': org_id, 'usage': usage, 'quota': quota, 'timestamp': timestamp}
+                       for org_id, usage, quota in org_usages]
+
         with self._db_session_class() as session:
-            try:
-                org_quota_usage_obj = session.query(OrgQuotaUsage).filter_by(org_id=org_id).one()
-                org_quota_usage_obj.usage = org_quota_usage
-                org_quota_usage_obj.quota = org_quota_total
-                org_quota_usage_obj.timestamp = timestamp
-            except NoResultFound:
-                org_quota_usage_obj= OrgQuotaUsage(
-                    org_id = org_id,
-                    usage = org_quota_usage,
-                    quota = org_quota_total,
-                    timestamp = timestamp
-                )
-                session.add(org_quota_usage_obj)
-                
+            for i in range(0, len(user_records), QUOTA_USAGE_WRITE_CHUNK):
+                session.execute(text(user_sql), user_records[i: i + QUOTA_USAGE_WRITE_CHUNK])
+            for i in range(0, len(org_records), QUOTA_USAGE_WRITE_CHUNK):
+                session.execute(text(org_sql), org_records[i: i + QUOTA_USAGE_WRITE_CHUNK])
             session.commit()
-    
-    def start_count(self):
-        repos = list(storage_changed_repo_ids.keys())
-        if len(repos) > 0:
-            logging.info('Start counting quota usage by repos, current %s repos waiting to count' % len(repos))
-        for repo_id in repos:
-            try:
-                self.save_org_quota_usage(repo_id)
-                self.save_user_quota_usage(repo_id)
-            except Exception as e:
-                logging.exception(f'Counting quota usage error: {e}, repo_id: {repo_id}')
-                continue
-                
+
+    def start_count(self, repos):
+        if not repos:
+            return
+
+        logging.info('Start counting quota usage by repos, current %s repos waiting to count' % len(repos))
+        time_start = time.time()
+        owners, org_ids = self.plan(repos)
+        user_usages = self.get_users_quota_usage(owners)
+        org_usages = self.get_orgs_quota_usage(org_ids)
+        self.save_quota_usages(user_usages, org_usages)
+        logging.info('Finish counting quota usage of %s users and %s orgs for %s repos in %.3f seconds',
+                     len(user_usages), len(org_usages), len(repos), time.time() - time_start)
 
 
 class RepoChangeInfoCollector(Thread):
@@ -174,7 +163,7 @@ class RepoChangeInfoCollector(Thread):
                 if res is not None:
                     key, value = res
                     repo_id = json.loads(value).get('repo_id')
-                    storage_changed_repo_ids[repo_id] = 1
+                    storage_changed_repo_ids.add((repo_id, ), 1)
             
             except Exception as e:
                 logging.error('Failed to collect repo change information: %s' % e)
@@ -196,21 +185,24 @@ class QuotaUsageSaveTimer(Thread):
         while not self.finished.is_set():
             self.finished.wait(self._interval)
             if not self.finished.is_set():
+                repos = list(storage_changed_repo_ids.swap())
                 try:
                     with SeafileDB() as seafile_db:
-                        QuotaUsageCounter(seafile_db).start_count()
-                        
-                    storage_changed_repo_ids.clear()
+                        QuotaUsageCounter(seafile_db).start_count([repo_id for repo_id, in repos])
+                    storage_changed_repo_ids.commit()
                 except Exception as e:
                     logging.exception('Save quota usage error: %s', e)
+                    storage_changed_repo_ids.restore((repo, 1) for repo in repos)
     
     def cancel(self):
         self.finished.set()
 
 
 class QuotaUsageManager(object):
-    def __init__(self):
+    def __init__(self, config):
         self._interval = 30
+        if is_journal_enabled(config):
+            storage_changed_repo_ids.enable_journal()
     
     def start(self):
         logging.info('Starting quota usage saver timer, interval = %s sec', self._interval)
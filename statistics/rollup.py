@@ -0,0 +1,293 @@
+import re
+import copy
+import time
+import logging
+import functools
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+
+from sqlalchemy import func, distinct, select, delete, insert, and_
+
+from .models import UserActivityStat, SysTraffic, FileOpsStat, TotalStorageStat, \
+    StatsDailyRollup, StatsRollupRange
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_STORAGE = 'storage'
+ROLLUP_FILE_OPS = 'file_ops'
+ROLLUP_ACTIVITY = 'activity'
+ROLLUP_TRAFFIC = 'traffic'
+
+# Days before today (in the requested time zone) which may still be updated
+# by the counters, they are always read from the raw tables. FileOpsCounter
+# backfills up to FILE_OPS_BACKFILL_HOURS (7 days) after a downtime.
+ROLLUP_OPEN_DAYS = 8
+ROLLUP_BUILD_CHUNK_DAYS = 31
+ROLLUP_INSERT_CHUNK = 1000
+
+STATS_CACHE_TTL = 300
+STATS_CACHE_SIZE = 1000
+
+_offset_re = re.compile(r'^([+-])(\d{2}):(\d{2})$')
+
+
+def parse_tz_offset(offset):
+    """Return the timedelta of a '+08:00' like offset, None if it is invalid."""
+    match = _offset_re.match(offset or '')
+    if not match:
+        return None
+    delta = timedelta(hours=int(match.group(2)), minutes=int(match.group(3)))
+    return -delta if match.group(1) == '-' else delta
+
+
+def _to_day(value):
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d')
+
+
+def _get_utc_range(start_day, end_day, offset):
+    start_at_0 = datetime.strptime(start_day.strftime('%Y-%m-%d 00:00:00'), '%Y-%m-%d %H:%M:%S')
+    end_at_23 = datetime.strptime(end_day.strftime('%Y-%m-%d 23:59:59'), '%Y-%m-%d %H:%M:%S')
+    return func.convert_tz(start_at_0, offset, '+00:00'), func.convert_tz(end_at_23, offset, '+00:00')
+
+
+def _org(org_id):
+    # NULL is used for the totals of all orgs in the rollup
+    return -1 if org_id is None else org_id
+
+
+def _sum_all_orgs(rows):
+    totals = {}
+    for day, _, op_type, number in rows:
+        totals[(day, op_type)] = totals.get((day, op_type), 0) + number
+    return [(day, None, op_type, number) for (day, op_type), number in totals.items()]
+
+
+def _count_storage(session, start_day, end_day, offset):
+    """Storage of the last hour counted in each day."""
+    start, end = _get_utc_range(start_day, end_day, offset)
+    local_day = func.date(func.convert_tz(TotalStorageStat.timestamp, '+00:00', offset)).label('day')
+
+    last_hours = select(local_day, TotalStorageStat.org_id, func.max(TotalStorageStat.timestamp).label('ts')).where(
+        TotalStorageStat.timestamp.between(start, end)).group_by(local_day, TotalStorageStat.org_id).subquery()
+    stmt = select(last_hours.c.day, last_hours.c.org_id, TotalStorageStat.total_size).join(
+        TotalStorageStat, and_(TotalStorageStat.org_id == last_hours.c.org_id,
+                               TotalStorageStat.timestamp == last_hours.c.ts))
+    rows = [(_to_day(row[0]), _org(row[1]), '', int(row[2])) for row in session.execute(stmt).all()]
+
+    last_hours = select(local_day, func.max(TotalStorageStat.timestamp).label('ts')).where(
+        TotalStorageStat.timestamp.between(start, end)).group_by(local_day).subquery()
+    stmt = select(last_hours.c.day, func.sum(TotalStorageStat.total_size)).join(
+        TotalStorageStat, TotalStorageStat.timestamp == last_hours.c.ts).group_by(last_hours.c.day)
+    rows.extend([(_to_day(row[0]), None, '', int(row[1])) for row in session.execute(stmt).all()])
+    return rows
+
+
+def _count_file_ops(session, start_day, end_day, offset):
+    start, end = _get_utc_range(start_day, end_day, offset)
+    local_day = func.date(func.convert_tz(FileOpsStat.timestamp, '+00:00', offset)).label('day')
+    stmt = select(local_day, FileOpsStat.org_id, FileOpsStat.op_type, func.sum(FileOpsStat.number)).where(
+        FileOpsStat.timestamp.between(start, end)).group_by(local_day, FileOpsStat.org_id, FileOpsStat.op_type)
+    rows = [(_to_day(row[0]), _org(row[1]), row[2], int(row[3])) for row in session.execute(stmt).all()]
+    return rows + _sum_all_orgs(rows)
+
+
+def _count_activity(session, start_day, end_day, offset):
+    # UserActivityStat only has days in UTC
+    start, end = _get_utc_range(start_day, end_day, '+00:00')
+    day = func.date(UserActivityStat.timestamp).label('day')
+    stmt = select(day, UserActivityStat.org_id, func.count(UserActivityStat.username)).where(
+        UserActivityStat.timestamp.between(start, end)).group_by(day, UserActivityStat.org_id)
+    rows = [(_to_day(row[0]), _org(row[1]), '', int(row[2])) for row in session.execute(stmt).all()]
+
+    stmt = select(day, func.count(distinct(UserActivityStat.username))).where(
+        UserActivityStat.timestamp.between(start, end)).group_by(day)
+    rows.extend([(_to_day(row[0]), None, '', int(row[1])) for row in session.execute(stmt).all()])
+    return rows
+
+
+def _count_traffic(session, start_day, end_day, offset):
+    # SysTraffic only has days in UTC
+    start, end = _get_utc_range(start_day, end_day, '+00:00')
+    day = func.date(SysTraffic.timestamp).label('day')
+    stmt = select(day, SysTraffic.org_id, SysTraffic.op_type, func.sum(SysTraffic.size)).where(
+        SysTraffic.timestamp.between(start, end)).group_by(day, SysTraffic.org_id, SysTraffic.op_type)
+    rows = [(_to_day(row[0]), _org(row[1]), row[2], int(row[3])) for row in session.execute(stmt).all()]
+    return rows + _sum_all_orgs(rows)
+
+
+ROLLUP_COUNTERS = {
+    ROLLUP_STORAGE: _count_storage,
+    ROLLUP_FILE_OPS: _count_file_ops,
+    ROLLUP_ACTIVITY: _count_activity,
+    ROLLUP_TRAFFIC: _count_traffic,
+}
+
+
+def get_last_final_day(offset):
+    """The last day in the time zone of ``offset`` which is not updated any more."""
+    today = _to_day(datetime.utcnow() + parse_tz_offset(offset))
+    return today - timedelta(days=ROLLUP_OPEN_DAYS)
+
+
+def build_rollup(session, kind, offset, start_day, end_day):
+    """Replace the rollup of the days from start_day to end_day by the raw tables."""
+    session.execute(delete(StatsDailyRollup).where(
+        StatsDailyRollup.kind == kind,
+        StatsDailyRollup.tz_offset == offset,
+        StatsDailyRollup.timestamp.between(start_day, end_day)))
+
+    records = [{'kind': kind, 'tz_offset': offset, 'timestamp': row_day, 'org_id': org_id,
+                'op_type': op_type, 'number': number}
+               for row_day, org_id, op_type, number in ROLLUP_COUNTERS[kind](session, start_day, end_day, offset)]
+    for i in range(0, len(records), ROLLUP_INSERT_CHUNK):
+        session.execute(insert(StatsDailyRollup).values(records[i: i + ROLLUP_INSERT_CHUNK]))
+
+
+def _get_rollup_range(session, kind, offset):
+    stmt = select(StatsRollupRange).where(StatsRollupRange.kind == kind,
+                                          StatsRollupRange.tz_offset == offset).limit(1)
+    return session.scalars(stmt).first()
+
+
+def request_rollup(session, kind, offset, start_day):
+    """Ask update_rollups to roll up the days of a kind and time zone from
+    start_day, return the StatsRollupRange.
+    """
+    state = _get_rollup_range(session, kind, offset)
+    if state is None:
+        # nothing is rolled up yet, first_day > last_day
+        state = StatsRollupRange(kind, offset, start_day, start_day - timedelta(days=1), start_day)
+        session.add(state)
+    elif start_day < state.requested_day:
+        state.requested_day = start_day
+    else:
+        return state
+    session.commit()
+    return state
+
+
+def update_rollups(session):
+    """Roll up the requested days and the days which became final since the
+    last update, for every kind and time zone the dashboard has asked for.
+
+    Days are rolled up in chunks of ROLLUP_BUILD_CHUNK_DAYS, one transaction
+    each, keeping the rolled up days continuous.
+    """
+    for state in session.scalars(select(StatsRollupRange)).all():
+        if parse_tz_offset(state.tz_offset) is None:
+            continue
+        last_final_day = get_last_final_day(state.tz_offset)
+        chunk = timedelta(days=ROLLUP_BUILD_CHUNK_DAYS)
+        one_day = timedelta(days=1)
+
+        if state.first_day > state.last_day:
+            state.first_day = state.requested_day
+            state.last_day = state.requested_day - one_day
+        if state.requested_day >= state.first_day and state.last_day >= last_final_day:
+            continue
+
+        while state.requested_day < state.first_day:
+            start_day = max(state.requested_day, state.first_day - chunk)
+            build_rollup(session, state.kind, state.tz_offset, start_day, state.first_day - one_day)
+            state.first_day = start_day
+            session.commit()
+        while state.last_day < last_final_day:
+            end_day = min(state.last_day + chunk, last_final_day)
+            build_rollup(session, state.kind, state.tz_offset, state.last_day + one_day, end_day)
+            state.last_day = end_day
+            session.commit()
+        logger.info('Rolled up %s statistics of time zone %s from %s to %s', state.kind, state.tz_offset,
+                    state.first_day.strftime('%Y-%m-%d'), state.last_day.strftime('%Y-%m-%d'))
+
+
+def get_daily_stats(session, kind, start, end, offset='+00:00', org_id=None):
+    """Return [(day, op_type, number)] of the days from start to end, ordered by day.
+
+    Days rolled up by update_rollups are read from the rollup, the others are
+    counted from the raw tables. Days before the rolled up ones are requested
+    for the next update, the request itself never builds the rollup.
+    ``org_id`` None returns the totals of all orgs.
+    """
+    start_day = _to_day(start)
+    end_day = _to_day(end)
+    if parse_tz_offset(offset) is None:
+        logger.warning('Invalid time zone offset "%s" of %s statistics', offset, kind)
+        return []
+
+    state = None
+    try:
+        state = request_rollup(session, kind, offset, min(start_day, get_last_final_day(offset)))
+    except Exception as e:
+        logger.warning('Failed to request rollup of %s statistics: %s', kind, e)
+        session.rollback()
+
+    raw_ranges = [(start_day, end_day)]
+    rows = []
+    if state is not None and state.first_day <= state.last_day:
+        rollup_start = max(start_day, state.first_day)
+        rollup_end = min(end_day, state.last_day)
+        if rollup_start <= rollup_end:
+            stmt = select(StatsDailyRollup.timestamp, StatsDailyRollup.op_type, StatsDailyRollup.number).where(
+                StatsDailyRollup.kind == kind,
+                StatsDailyRollup.tz_offset == offset,
+                StatsDailyRollup.timestamp.between(rollup_start, rollup_end),
+                StatsDailyRollup.org_id.is_(None) if org_id is None else StatsDailyRollup.org_id == org_id)
+            rows = [(row[0], row[1], row[2]) for row in session.execute(stmt).all()]
+            raw_ranges = [(start_day, rollup_start - timedelta(days=1)),
+                          (rollup_end + timedelta(days=1), end_day)]
+
+    for raw_start, raw_end in raw_ranges:
+        if raw_start > raw_end:
+            continue
+        rows.extend([(day, op_type, number)
+                     for day, row_org_id, op_type, number in ROLLUP_COUNTERS[kind](session, raw_start, raw_end, offset)
+                     if row_org_id == org_id])
+
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return rows
+
+
+class StatsCache(object):
+    """TTL + LRU cache of the dashboard queries in this process."""
+    def __init__(self, ttl=STATS_CACHE_TTL, max_size=STATS_CACHE_SIZE):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= time.time():
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time() + self._ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+stats_cache = StatsCache()
+
+
+def cached_stats(func):
+    """Cache the result of a dashboard query by its arguments except the session."""
+    @functools.wraps(func)
+    def wrapper(session, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        value = stats_cache.get(key)
+        if value is None:
+            value = func(session, *args, **kwargs)
+            stats_cache.set(key, value)
+        # callers may modify the result
+        return copy.deepcopy(value)
+    return wrapper
@@ -1,8 +1,6 @@
 import json
 import logging
 import time
-from collections import defaultdict
-from copy import deepcopy
 from datetime import datetime, timedelta
 from threading import Event, Lock, Thread
 
@@ -14,9 +12,13 @@ from seafevents.app.config import AI_PRICES
 from seafevents.app.config import SEAFILE_AI_SECRET_KEY, SEAFILE_AI_SERVER_URL
 from seafevents.app.event_redis import RedisClient
 from seafevents.db import init_db_session_class
+from seafevents.events.metrics import publish_metric
+from seafevents.statistics.accumulator import StatsAccumulator, is_journal_enabled
 
 logger = logging.getLogger(__name__)
 
+AI_STATS_QUERY_CHUNK = 1000
+
 
 class AIScenario:
     IMAGE_CAPTION = 'image-caption'
@@ -42,8 +44,12 @@ class AIScenario:
         }
 
 
+def add_usage(old, new):
+    return [old[0] + new[0], old[1] + new[1]]
+
+
 class AIStatsWorker:
-    def __init__(self):
+    def __init__(self, config):
         self._db_session_class = init_db_session_class()
         self._redis_client = RedisClient()
         self.stats_lock = Lock()
@@ -53,10 +59,10 @@ class AIStatsWorker:
         self.log_none_message_timeout = 60 * 10
         self.stats_interval = 60
         self._repo_info_cache = {}
-        self.reset_stats()
-
-    def reset_stats(self):
-        self.ai_usage_stats = defaultdict(lambda: defaultdict(lambda: {'input_tokens': 0, 'output_tokens': 0}))
+        # {(repo_id, repo_owner, group_id, org_id, model, scenario): [input_tokens, output_tokens]}
+        self.ai_usage_stats = StatsAccumulator('ai_usage_stats', merge=add_usage)
+        if is_journal_enabled(config):
+            self.ai_usage_stats.enable_journal()
 
     def _resolve_repo_info(self, repo_id):
         if repo_id in self._repo_info_cache:
@@ -130,10 +136,8 @@ class AIStatsWorker:
             if not AIScenario.is_valid(scenario):
                 scenario = AIScenario.UNKNOWN
 
-        key = (repo_owner, group_id, org_id, model, scenario)
-        stats = self.ai_usage_stats[repo_id][key]
-        stats['input_tokens'] += input_tokens
-        stats['output_tokens'] += output_tokens
+        key = (repo_id, repo_owner, group_id, org_id, model, scenario)
+        self.ai_usage_stats.add(key, [input_tokens, output_tokens])
 
     def receive(self):
         if not self._redis_client.connection:
@@ -177,32 +181,42 @@ class AIStatsWorker:
         output_cost = output_tokens_price * (output_tokens / 1e6)
         return input_cost + output_cost
 
-    def stats_worker(self):
-        if not self.ai_usage_stats:
-            logger.info('There are no stats')
-            return
+    def get_existing_ids(self, session, date, keys):
+        """Return {(repo_id, repo_owner, group_id, org_id, model, scenario): id}
+        of the rows of ``date`` which have one of ``keys``.
+        """
+        select_sql = '''
+        SELECT `id`, `repo_id`, `repo_owner`, `group_id`, `org_id`, `model`, `scenario`
+        FROM `ai_usage_statistics`
+        WHERE `date`=:date AND %s
+        '''
+        repo_ids = sorted({key[0] for key in keys if key[0] is not None})
+        rows = []
+        for i in range(0, len(repo_ids), AI_STATS_QUERY_CHUNK):
+            rows.extend(session.execute(text(select_sql % '`repo_id` IN :repo_ids'), {
+                'date': date,
+                'repo_ids': tuple(repo_ids[i: i + AI_STATS_QUERY_CHUNK]),
+            }).fetchall())
+        if any(key[0] is None for key in keys):
+            rows.extend(session.execute(text(select_sql % '`repo_id` IS NULL'), {'date': date}).fetchall())
+
+        # compare in python, NULL columns do not match with = in SQL
+        return {tuple(row[1:]): row[0] for row in rows if tuple(row[1:]) in keys}
 
+    def stats_worker(self):
         with self.stats_lock:
-            usage_stats = deepcopy(self.ai_usage_stats)
-            self.reset_stats()
+            usage_stats = self.ai_usage_stats.swap()
             self._repo_info_cache.clear()
 
-        logger.info('There are %s repo stats', len(usage_stats))
+        if not usage_stats:
+            self.ai_usage_stats.commit()
+            logger.info('There are no stats')
+            return
 
+        start = time.time()
         today = datetime.today().date()
         now = datetime.now()
 
-        select_sql = '''
-        SELECT `id` FROM `ai_usage_statistics`
-        WHERE `date`=:date
-          AND `repo_id` <=> :repo_id
-          AND `repo_owner` <=> :repo_owner
-          AND `group_id` <=> :group_id
-          AND `org_id` <=> :org_id
-          AND `model`=:model
-          AND `scenario`=:scenario
-        LIMIT 1
-        '''
         update_sql = '''
         UPDATE `ai_usage_statistics`
         SET `input_tokens`=`input_tokens`+:input_tokens,
@@ -216,68 +230,68 @@ class AIStatsWorker:
         VALUES (:repo_id, :date, :repo_owner, :group_id, :org_id, :model, :scenario, :input_tokens, :output_tokens, :cost, :created_at, :updated_at)
         '''
 
-        records = []
-        for repo_id, stats_dict in usage_stats.items():
-            for (repo_owner, group_id, org_id, model, scenario), usage in stats_dict.items():
-                input_tokens = usage.get('input_tokens') or 0
-                output_tokens = usage.get('output_tokens') or 0
-                cost = self._calculate_cost(model, input_tokens, output_tokens)
-                logger.info(
-                    'repo %s repo_owner %s group_id %s org_id %s model %s scenario %s input_tokens %s output_tokens %s cost %s',
-                    repo_id,
-                    repo_owner,
-                    group_id,
-                    org_id,
-                    model,
-                    scenario,
-                    input_tokens,
-                    output_tokens,
-                    cost,
-                )
-                records.append({
-                    'repo_id': repo_id,
-                    'date': today,
-                    'repo_owner': repo_owner,
-                    'group_id': group_id,
-                    'org_id': org_id,
-                    'model': model,
-                    'scenario': scenario,
-                    'input_tokens': input_tokens,
-                    'output_tokens': output_tokens,
-                    'cost': cost,
-                    'created_at': now,
-                    'updated_at': now,
-                })
-
         session = self._db_session_class()
         try:
-            for data in records:
-                result = session.execute(text(select_sql), {
-                    'date': data['date'],
-                    'repo_id': data['repo_id'],
-                    'repo_owner': data['repo_owner'],
-                    'group_id': data['group_id'],
-                    'org_id': data['org_id'],
-                    'model': data['model'],
-                    'scenario': data['scenario'],
-                }).fetchone()
-
-                if result:
-                    session.execute(text(update_sql), {
-                        'id': result[0],
-                        'input_tokens': data['input_tokens'],
-                        'output_tokens': data['output_tokens'],
-                        'cost': data['cost'],
-                        'updated_at': data['updated_at'],
+            existing_ids = self.get_existing_ids(session, today, usage_stats)
+
+            updates = []
+            inserts = []
+            total_tokens = 0
+            total_cost = 0
+            for key, (input_tokens, output_tokens) in usage_stats.items():
+                repo_id, repo_owner, group_id, org_id, model, scenario = key
+                cost = self._calculate_cost(model, input_tokens, output_tokens)
+                total_tokens += input_tokens + output_tokens
+                total_cost += cost
+                logger.debug('repo %s repo_owner %s group_id %s org_id %s model %s scenario %s '
+                             'input_tokens %s output_tokens %s cost %s', repo_id, repo_owner, group_id,
+                             org_id, model, scenario, input_tokens, output_tokens, cost)
+                if key in existing_ids:
+                    updates.append({
+                        'id': existing_ids[key],
+                        'input_tokens': input_tokens,
+                        'output_tokens': output_tokens,
+                        'cost': cost,
+                        'updated_at': now,
                     })
                 else:
-                    session.execute(text(insert_sql), data)
+                    inserts.append({
+                        'repo_id': repo_id,
+                        'date': today,
+                        'repo_owner': repo_owner,
+                        'group_id': group_id,
+                        'org_id': org_id,
+                        'model': model,
+                        'scenario': scenario,
+                        'input_tokens': input_tokens,
+                        'output_tokens': output_tokens,
+                        'cost': cost,
+                        'created_at': now,
+                        'updated_at': now,
+                    })
+
+            # executemany, the inserts are sent as multi-row INSERT statements
+            if updates:
+                session.execute(text(update_sql), updates)
+            if inserts:
+                session.execute(text(insert_sql), inserts)
             session.commit()
+            self.ai_usage_stats.commit()
         except Exception as error:
             logger.exception(error)
+            # nothing is saved as the transaction is rolled back, count them next time
+            self.ai_usage_stats.restore(usage_stats.items())
+            return
         finally:
             session.close()
 
+        duration = time.time() - start
+        logger.info('Saved ai usage of %s stats, %s updated, %s inserted, %s tokens, cost %s, in %.3f seconds',
+                    len(usage_stats), len(updates), len(inserts), total_tokens, total_cost, duration)
+        publish_metric('ai_stats_flush_seconds', round(duration, 3), 'Time to save buffered ai usage stats')
+        publish_metric('ai_stats_updated_rows', len(updates), 'ai_usage_statistics rows updated by the last flush')
+        publish_metric('ai_stats_inserted_rows', len(inserts), 'ai_usage_statistics rows inserted by the last flush')
+
     def stats(self):
         while not self.finished.is_set():
             self.finished.wait(self.stats_interval)
@@ -326,8 +340,8 @@ class AIStatsWorker:
 
 
 class AIStatsManager:
-    def __init__(self):
-        self.worker = AIStatsWorker()
+    def __init__(self, config):
+        self.worker = AIStatsWorker(config)
 
     def start(self):
         if not SEAFILE_AI_SECRET_KEY or not SEAFILE_AI_SERVER_URL:
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import datetime, timedelta
+from threading import Thread, Event
+
+from seafevents.db import init_db_session_class
+from seafevents.events.metrics import publish_metric
+from seafevents.events.retention import get_retention_policies, is_archive_enabled, apply_retention
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'EventRetentionManager',
+]
+
+
+class EventRetentionManager(object):
+    def __init__(self, config):
+        self._enabled = parse_bool(get_opt_from_conf_or_env(config, 'RETENTION', 'enabled', default=False))
+        self._policies = get_retention_policies(config)
+        self._archive = is_archive_enabled(config)
+
+    def start(self):
+        if not self._enabled or not self._policies:
+            logging.info('Event retention is disabled.')
+            return
+        logging.info('Start event retention, keep days: %s',
+                     ', '.join('%s %d' % (p.table, p.keep_days) for p in self._policies))
+        EventRetentionTask(self._policies, self._archive).start()
+
+
+class EventRetentionTask(Thread):
+    def __init__(self, policies, archive):
+        Thread.__init__(self)
+        self.daemon = True
+        self._finished = Event()
+        self._policies = policies
+        self._archive = archive
+        self._db_session_class = init_db_session_class()
+
+    def apply(self):
+        dropped_partitions = deleted_rows = 0
+        for policy in self._policies:
+            session = self._db_session_class()
+            try:
+                dropped, deleted = apply_retention(session, policy, self._archive)
+                session.commit()
+                dropped_partitions += dropped
+                deleted_rows += deleted
+                logger.info('Applied retention of %s days to %s, %d partitions dropped, %d rows deleted',
+                            policy.keep_days, policy.table, dropped, deleted)
+            except Exception as e:
+                session.rollback()
+                logger.exception('Failed to apply retention to %s: %s', policy.table, e)
+            finally:
+                session.close()
+
+        publish_metric('event_retention_dropped_partitions', dropped_partitions,
+                       'Event table partitions dropped by the last retention run')
+        publish_metric('event_retention_deleted_rows', deleted_rows,
+                       'Event table rows deleted by the last retention run')
+
+    def run(self):
+        while not self._finished.is_set():
+            # run at 1 o'clock in every day, after the daily statistics
+            now = datetime.now()
+            next_run = (now + timedelta(days=1)).replace(hour=1, minute=0, second=0, microsecond=0)
+            if now.hour < 1:
+                next_run -= timedelta(days=1)
+            self._finished.wait(max((next_run - now).total_seconds(), 1))
+            if not self._finished.is_set():
+                self.apply()
+
+    def cancel(self):
+        self._finished.set()
@@ -4,6 +4,8 @@ from threading import Thread, Event
 
 from seafevents.statistics import TotalStorageCounter, FileOpsCounter, TrafficInfoCounter,\
                                   MonthlyTrafficCounter, UserActivityCounter
+from seafevents.statistics.rollup import update_rollups
+from seafevents.db import init_db_session_class
 
 
 def exception_catch(module):
@@ -35,7 +37,8 @@ class Statistics(Thread):
             logging.info("Start data statistics..")
             CountTotalStorage().start()
             CountFileOps().start()
-            CountMonthlyTrafficInfo().start()
+            CountMonthlyTrafficInfo(self.config).start()
+            UpdateStatsRollups().start()
         else:
             logging.info('Can not start data statistics: it is not enabled!')
             return
@@ -71,6 +74,28 @@ class CountFileOps(Thread):
         self.finished.set()
 
 
+class UpdateStatsRollups(Thread):
+    def __init__(self):
+        Thread.__init__(self)
+        self.finished = Event()
+
+    @exception_catch('UpdateStatsRollups')
+    def run(self):
+        session_class = init_db_session_class()
+        while not self.finished.is_set():
+            session = session_class()
+            try:
+                update_rollups(session)
+            except Exception as e:
+                logging.warning('[Statistics] Failed to update daily rollups: %s', e)
+            finally:
+                session.close()
+            self.finished.wait(3600)
+
+    def cancel(self):
+        self.finished.set()
+
+
 class CountTrafficInfo(Thread):
     # This should run at frontend node server.
     def __init__(self, config):
@@ -96,14 +121,19 @@ class CountTrafficInfo(Thread):
 
 
 class CountMonthlyTrafficInfo(Thread):
-    def __init__(self):
+    def __init__(self, config):
         Thread.__init__(self)
+        self.config = config
         self.finished = Event()
 
     @exception_catch('CountMonthlyTrafficInfo')
     def run(self):
+        incremental = False
+        if self.config.has_option('STATISTICS', 'incremental_monthly_traffic'):
+            incremental = self.config.getboolean('STATISTICS', 'incremental_monthly_traffic')
+
         while not self.finished.is_set():
-            MonthlyTrafficCounter().start_count()
+            MonthlyTrafficCounter(incremental).start_count()
             self.finished.wait(3600)
 
     def cancel(self):
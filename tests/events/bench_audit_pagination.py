@@ -0,0 +1,68 @@
+# coding:utf8
+"""Compare OFFSET and keyset pagination of FileAudit at growing page depths.
+
+Run from the tests directory against the TESTDB of db.conf:
+
+    python -m seafevents.tests.events.bench_audit_pagination [rows]
+
+The latency of get_file_audit_events grows with the depth, the one of
+get_file_audit_events_by_cursor stays flat.
+"""
+import sys
+import time
+import datetime
+
+from sqlalchemy import delete, insert, select, desc
+
+from seafevents.tests.conftest import get_db_session
+from seafevents.events.db import get_file_audit_events, get_file_audit_events_by_cursor
+from seafevents.events.models import FileAudit
+
+PAGE_SIZE = 25
+INSERT_CHUNK = 10000
+USERS = ['user%d@test.com' % i for i in range(10)]
+
+
+def fill(session, rows):
+    session.execute(delete(FileAudit))
+    now = datetime.datetime.utcnow()
+    for i in range(0, rows, INSERT_CHUNK):
+        session.execute(insert(FileAudit), [{
+            'timestamp': now, 'etype': 'file-download-web', 'user': USERS[j % len(USERS)],
+            'ip': '127.0.0.1', 'device': '', 'org_id': -1,
+            'repo_id': 'fd62b808-63bf-4ab1-bdee-7fa4a94b85b5', 'file_path': '/test.txt',
+        } for j in range(i, min(i + INSERT_CHUNK, rows))])
+        session.commit()
+
+
+def timeit(func, repeat=5):
+    start = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - start) / repeat * 1000
+
+
+def main(rows):
+    session = get_db_session('TESTDB')
+    try:
+        fill(session, rows)
+        user = USERS[0]
+        print('%10s %12s %12s' % ('depth', 'offset (ms)', 'cursor (ms)'))
+        depth = 0
+        while depth < rows // len(USERS):
+            # the eid right before the page, as returned by the previous page
+            stmt = select(FileAudit.eid).where(FileAudit.user == user).order_by(
+                desc(FileAudit.eid)).offset(depth - 1).limit(1)
+            cursor = session.scalar(stmt) if depth else None
+            offset_ms = timeit(lambda: get_file_audit_events(session, user, -1, None, depth, PAGE_SIZE))
+            cursor_ms = timeit(lambda: get_file_audit_events_by_cursor(session, user, -1, None, cursor, PAGE_SIZE))
+            print('%10d %12.2f %12.2f' % (depth, offset_ms, cursor_ms))
+            depth = depth * 10 if depth else 100
+    finally:
+        session.execute(delete(FileAudit))
+        session.commit()
+        session.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
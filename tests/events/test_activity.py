@@ -1,6 +1,7 @@
 # coding:utf8
 
 import copy
+import json
 import time
 import pytest
 import datetime
@@ -8,8 +9,8 @@ import datetime
 from sqlalchemy import select, delete
 
 from seafevents.tests.utils import EventTest
-from seafevents.events.db import save_user_activity, get_user_activities
-from seafevents.events.models import Activity
+from seafevents.events.db import save_user_activity, save_user_activities_bulk, get_user_activities
+from seafevents.events.models import Activity, UserActivity
 
 
 @pytest.mark.usefixtures("test_db")
@@ -34,6 +35,7 @@ class AcvitityTest(EventTest):
     def tearDown(self):
         session = self.get_session()
         session.execute(delete(Activity))
+        session.execute(delete(UserActivity))
         session.commit()
         session.close()
 
@@ -146,3 +148,87 @@ class AcvitityTest(EventTest):
         rows = get_user_activities(session, 'admin@admin.com', 1, 1)
         self.assertEqual(len(rows), 1)
         session.close()
+
+    def test_save_user_activities_bulk(self):
+        records = []
+        for i in range(3):
+            record = copy.copy(self.record)
+            record['obj_type'] = 'file'
+            record['path'] = '/%s.md' % i
+            record['commit_id'] = 'a' * 40
+            records.append(record)
+        record = copy.copy(self.record)
+        record['op_type'] = 'rename'
+        record['obj_type'] = 'file'
+        record['path'] = '/new.md'
+        record['old_path'] = '/old.md'
+        record['commit_id'] = 'a' * 40
+        records.append(record)
+
+        session = self.get_session()
+        save_user_activities_bulk(session, records)
+        session.close()
+
+        session = self.get_session()
+        rows = session.scalars(select(Activity).order_by(Activity.id)).all()
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].op_type, 'batch_create')
+        self.assertEqual(rows[1].op_type, 'rename')
+        user_activities = session.scalars(select(UserActivity)).all()
+        self.assertEqual(len(user_activities), 4)
+        session.close()
+
+        session = self.get_session()
+        rows = get_user_activities(session, 'admin@admin.com', 0, 2)
+        self.assertEqual(len(rows), 2)
+        session.close()
+
+    def test_save_user_activities_bulk_several_commits(self):
+        records = []
+        for i, commit_id in enumerate(['a' * 40, 'a' * 40, 'b' * 40]):
+            record = copy.copy(self.record)
+            record['op_type'] = 'rename'
+            record['obj_type'] = 'file'
+            record['path'] = '/%s.md' % i
+            record['old_path'] = '/old.md'
+            record['commit_id'] = commit_id
+            records.append(record)
+
+        session = self.get_session()
+        save_user_activities_bulk(session, records)
+        session.close()
+
+        session = self.get_session()
+        rows = session.scalars(select(Activity).order_by(Activity.id)).all()
+        self.assertEqual([(row.commit_id, row.path) for row in rows],
+                         [('a' * 40, '/0.md'), ('a' * 40, '/1.md'), ('b' * 40, '/2.md')])
+        user_activities = session.scalars(select(UserActivity)).all()
+        self.assertEqual(len(user_activities), 6)
+        session.close()
+
+    def test_save_user_activities_bulk_merge_recent(self):
+        record = copy.copy(self.record)
+        record['obj_type'] = 'file'
+        record['path'] = '/0.md'
+        record['commit_id'] = 'a' * 40
+        session = self.get_session()
+        save_user_activity(session, record)
+        session.close()
+
+        records = []
+        for i in range(1, 3):
+            record = copy.copy(self.record)
+            record['obj_type'] = 'file'
+            record['path'] = '/%s.md' % i
+            record['commit_id'] = 'b' * 40
+            records.append(record)
+        session = self.get_session()
+        save_user_activities_bulk(session, records)
+        session.close()
+
+        session = self.get_session()
+        rows = session.scalars(select(Activity)).all()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].op_type, 'batch_create')
+        self.assertEqual(len(json.loads(rows[0].detail)), 3)
+        session.close()
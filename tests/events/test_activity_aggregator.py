@@ -0,0 +1,181 @@
+# coding:utf8
+
+import os
+import copy
+import json
+import time
+import shutil
+import pytest
+import datetime
+import tempfile
+import configparser
+from unittest import mock
+
+from sqlalchemy import select, delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.events import activity_aggregator
+from seafevents.events.activity_aggregator import ActivityAggregator, ACTIVITY_FLUSH_MAX_TRIES
+from seafevents.events.db import BATCH_AGGREGATE_TIME_THRESHOLD, ACTIVITY_MAX_AGGREGATE_ITEMS
+from seafevents.utils.journal import Journal
+from seafevents.events.models import Activity, UserActivity
+
+
+@pytest.mark.usefixtures("test_db")
+class ActivityAggregatorTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+        self.journal_dir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        os.environ['SEAFEVENTS_JOURNAL_DIR'] = self.journal_dir
+
+        self.record = {
+            'op_type': 'create',
+            'obj_type': 'file',
+            'timestamp': datetime.datetime.utcnow(),
+            'repo_id': 'fd62b808-63bf-4ab1-bdee-7fa4a94b85b5',
+            'commit_id': 'a' * 40,
+            'path': '/',
+            'op_user': 'admin@admin.com',
+            'related_users': ['test@test.com', 'admin@admin.com'],
+            'org_id': None,
+        }
+
+    def tearDown(self):
+        self.remove_data()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.journal_dir)
+
+    def remove_data(self):
+        session = self.get_session()
+        session.execute(delete(Activity))
+        session.execute(delete(UserActivity))
+        session.commit()
+        session.close()
+
+    def get_aggregator(self):
+        aggregator = ActivityAggregator()
+        config = configparser.ConfigParser()
+        config.read_dict({'USER ACTIVITY': {'aggregate_in_memory': 'true'}})
+        aggregator.init(config)
+        return aggregator
+
+    def add_records(self, aggregator, count):
+        session = self.get_session()
+        for i in range(count):
+            record = copy.copy(self.record)
+            record['path'] = '/%d.md' % i
+            self.assertTrue(aggregator.add(session, record))
+        session.close()
+
+    def flush_all(self, aggregator):
+        session = self.get_session()
+        aggregator.flush(session, list(aggregator._buffers))
+        session.close()
+
+    def get_activities(self):
+        session = self.get_session()
+        rows = session.scalars(select(Activity)).all()
+        session.close()
+        return rows
+
+    def test_not_aggregated(self):
+        aggregator = self.get_aggregator()
+        record = copy.copy(self.record)
+        record['op_type'] = 'rename'
+        session = self.get_session()
+        self.assertFalse(aggregator.add(session, record))
+        session.close()
+
+    def test_flush_expired(self):
+        aggregator = self.get_aggregator()
+        self.add_records(aggregator, 3)
+
+        session = self.get_session()
+        aggregator.flush_expired(session)
+        session.close()
+        self.assertEqual(len(self.get_activities()), 0)
+
+        for buffer in aggregator._buffers.values():
+            buffer['start'] = time.time() - BATCH_AGGREGATE_TIME_THRESHOLD * 60
+        session = self.get_session()
+        aggregator.flush_expired(session)
+        session.close()
+
+        rows = self.get_activities()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].op_type, 'batch_create')
+        self.assertEqual(len(json.loads(rows[0].detail)), 3)
+        self.assertEqual(aggregator._journal.load(), [])
+
+    def test_replay_journal(self):
+        aggregator = self.get_aggregator()
+        self.add_records(aggregator, 2)
+        aggregator._journal.close()
+
+        aggregator = self.get_aggregator()
+        key = (self.record['repo_id'], self.record['op_user'], 'file', 'create')
+        records = aggregator._buffers[key]['records']
+        self.assertEqual([r['path'] for r in records], ['/0.md', '/1.md'])
+        self.assertEqual(records[0]['timestamp'], self.record['timestamp'])
+
+        session = self.get_session()
+        aggregator.flush(session, [key])
+        session.close()
+        self.assertEqual(len(self.get_activities()), 1)
+
+    def test_flush_max_tries(self):
+        aggregator = self.get_aggregator()
+        self.add_records(aggregator, 3)
+
+        with mock.patch.object(activity_aggregator, 'save_user_activities_bulk', side_effect=Exception('bulk')):
+            for _ in range(ACTIVITY_FLUSH_MAX_TRIES - 1):
+                self.flush_all(aggregator)
+                self.assertEqual(len(aggregator._journal.load()), 3)
+            # saved one by one at the last try
+            self.flush_all(aggregator)
+
+        self.assertEqual(aggregator._buffers, {})
+        self.assertEqual(aggregator._journal.load(), [])
+        rows = self.get_activities()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(len(json.loads(rows[0].detail)), 3)
+
+    def test_flush_failed_journal(self):
+        aggregator = self.get_aggregator()
+        self.add_records(aggregator, 2)
+
+        with mock.patch.object(activity_aggregator, 'save_user_activities_bulk', side_effect=Exception('bulk')), \
+                mock.patch.object(activity_aggregator, 'save_user_activity', side_effect=Exception('single')):
+            for _ in range(ACTIVITY_FLUSH_MAX_TRIES):
+                self.flush_all(aggregator)
+
+        self.assertEqual(aggregator._buffers, {})
+        self.assertEqual(aggregator._journal.load(), [])
+        journal = Journal('activity_aggregator.failed')
+        self.assertEqual([r['path'] for r in journal.load()], ['/0.md', '/1.md'])
+        journal.close()
+        self.assertEqual(len(self.get_activities()), 0)
+
+    def test_replay_journal_full_buffers(self):
+        count = ACTIVITY_MAX_AGGREGATE_ITEMS + 5
+        journal = Journal('activity_aggregator')
+        records = []
+        for i in range(count):
+            record = copy.copy(self.record)
+            record['path'] = '/%d.md' % i
+            # saved by several commits
+            record['commit_id'] = '%040d' % (i // 100)
+            records.append(record)
+        journal.append_many(records)
+        journal.close()
+
+        aggregator = self.get_aggregator()
+        self.assertEqual(sorted(len(b['records']) for b in aggregator._buffers.values()),
+                         [5, ACTIVITY_MAX_AGGREGATE_ITEMS])
+
+        self.flush_all(aggregator)
+        rows = self.get_activities()
+        self.assertEqual(sorted(len(json.loads(row.detail)) for row in rows), [5, ACTIVITY_MAX_AGGREGATE_ITEMS])
+        self.assertEqual(aggregator._journal.load(), [])
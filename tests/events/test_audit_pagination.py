@@ -0,0 +1,51 @@
+# coding:utf8
+
+import pytest
+import datetime
+
+from sqlalchemy import delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.events.db import save_file_audit_events, get_file_audit_events, \
+    get_file_audit_events_by_cursor
+from seafevents.events.models import FileAudit
+
+
+@pytest.mark.usefixtures("test_db")
+class AuditPaginationTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+        self.repo_id = 'fd62b808-63bf-4ab1-bdee-7fa4a94b85b5'
+        self.user = 'admin@admin.com'
+
+    def tearDown(self):
+        self.remove_data()
+
+    def remove_data(self):
+        session = self.get_session()
+        session.execute(delete(FileAudit))
+        session.commit()
+        session.close()
+
+    def test_cursor_paging(self):
+        session = self.get_session()
+        now = datetime.datetime.utcnow()
+        events = [(now, 'file-download-web', self.user, '127.0.0.1', '', -1, self.repo_id, '/%d.txt' % i)
+                  for i in range(25)]
+        events.append((now, 'file-download-web', 'test@test.com', '127.0.0.1', '', -1, self.repo_id, '/other.txt'))
+        save_file_audit_events(session, events)
+        session.close()
+
+        session = self.get_session()
+        pages = []
+        cursor = None
+        while True:
+            rows, cursor = get_file_audit_events_by_cursor(session, self.user, -1, self.repo_id, cursor, 10)
+            pages.append(rows)
+            if cursor is None:
+                break
+        self.assertEqual([len(rows) for rows in pages], [10, 10, 5])
+
+        rows = get_file_audit_events(session, self.user, -1, self.repo_id, 0, 25)
+        self.assertEqual([e.eid for e in rows], [e.eid for page in pages for e in page])
+        session.close()
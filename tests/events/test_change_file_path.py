@@ -5,7 +5,7 @@ import sys
 import pytest
 
 from seafevents.tests.utils import EventTest, ChangeFilePathHandler
-from seafevents.tests.conftest import read_db_conf
+from seafevents.tests.conftest import read_db_conf, get_db_session
 
 
 class seahub_settings():
@@ -167,3 +167,25 @@ class ChangeFilePathTest(EventTest):
         param = {'dir': d, 'filename': fn }
         res = self.query('TESTDB', sql, param, True)
         self.assertEqual(res[0], 1)
+
+    def test_bulk_rewrite(self):
+        from seafevents.events.change_file_path import ChangeFilePathHandler as BulkChangeFilePathHandler
+
+        changed_word = '/Picturesttt2'
+        session = get_db_session('TESTDB')
+        bulk_changer = BulkChangeFilePathHandler(session)
+        bulk_changer.update_db_records_in_bulk('c89409c5-b52c-4469-91ba-b222a5d3efff',
+                                               [('/Pictures', changed_word, 1),
+                                                ('/files/girl.jpg', '/files/boy.jpg', 0)])
+        session.close()
+
+        param = {'path': changed_word + '%'}
+        for sql in ["select count(*) from share_uploadlinkshare where path like :path",
+                    "select count(*) from share_fileshare where path like :path",
+                    "select count(*) from tags_fileuuidmap where parent_path like :path"]:
+            res = self.query('TESTDB', sql, param, True)
+            self.assertEqual(res[0], 3)
+
+        sql = "select count(*) from share_fileshare where path = :path"
+        res = self.query('TESTDB', sql, {'path': '/files/boy.jpg'}, True)
+        self.assertEqual(res[0], 1)
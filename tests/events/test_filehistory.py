@@ -8,7 +8,7 @@ import datetime
 from sqlalchemy import delete
 
 from seafevents.tests.utils import EventTest, save_file_history
-from seafevents.events.db import get_file_history
+from seafevents.events.db import get_file_history, save_filehistories
 from seafevents.events.models import FileHistory
 
 
@@ -126,3 +126,61 @@ class AcvitityTest(EventTest):
         rows, total_count = get_file_history(session, self.repo_id, self.path, 0, 10)
         self.assertEqual(len(rows), 1)
         session.close()
+
+    def test_save_filehistories(self):
+        records = []
+        for path in [self.path, '/other.txt']:
+            record = copy.deepcopy(self.record)
+            record['path'] = path
+            records.append(record)
+
+        session = self.get_session()
+        save_filehistories(session, 5, records)
+        session.close()
+
+        session = self.get_session()
+        record = copy.deepcopy(self.record)
+        record['op_type'] = 'rename'
+        record['old_path'] = self.path
+        record['path'] = '/renamed.txt'
+        record['timestamp'] = datetime.datetime.utcnow()
+        edit_record = copy.deepcopy(self.record)
+        edit_record['op_type'] = 'edit'
+        edit_record['path'] = '/other.txt'
+        edit_record['timestamp'] = datetime.datetime.utcnow()
+        save_filehistories(session, 5, [record, edit_record])
+        session.close()
+
+        session = self.get_session()
+        rows, total_count = get_file_history(session, self.repo_id, '/renamed.txt', 0, 10)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual('rename', rows[0].op_type)
+        self.assertEqual(rows[0].file_uuid, rows[1].file_uuid)
+
+        rows, total_count = get_file_history(session, self.repo_id, '/other.txt', 0, 10)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].file_uuid, records[1]['file_uuid'])
+        session.close()
+
+    def test_save_filehistories_rename_then_edit(self):
+        renamed_path = '/renamed.txt'
+        session = self.get_session()
+        save_filehistories(session, 5, [copy.deepcopy(self.record)])
+        session.close()
+
+        for op_type, path in [('edit', self.path), ('rename', renamed_path), ('edit', renamed_path)]:
+            record = copy.deepcopy(self.record)
+            record['op_type'] = op_type
+            record['path'] = path
+            record['old_path'] = self.path
+            record['timestamp'] = datetime.datetime.utcnow()
+            session = self.get_session()
+            save_filehistories(session, 5, [record])
+            session.close()
+
+        session = self.get_session()
+        rows, total_count = get_file_history(session, self.repo_id, renamed_path, 0, 10)
+        self.assertEqual([r.op_type for r in rows], ['edit', 'rename', 'edit', 'create'])
+        self.assertEqual(len(set(r.file_uuid for r in rows)), 1)
+        self.assertEqual(rows[0].path, renamed_path)
+        session.close()
@@ -0,0 +1,77 @@
+# coding:utf8
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from seafevents.utils.journal import Journal, SegmentedJournal, get_journal_dir, parse_journal_datetime, \
+    remove_journal_segments
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        os.environ['SEAFEVENTS_JOURNAL_DIR'] = self.journal_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.journal_dir)
+
+    def test_no_journal_dir(self):
+        del os.environ['SEAFEVENTS_JOURNAL_DIR']
+        os.environ.pop('SEAFEVENTS_LOG_DIR', None)
+        self.assertRaises(RuntimeError, get_journal_dir)
+
+    def test_append_and_load(self):
+        now = datetime.datetime(2024, 1, 2, 3, 4, 5, 6)
+        journal = Journal('test')
+        journal.append({'n': 1, 'timestamp': now})
+        journal.append_many([{'n': 2}, {'n': 3}])
+        journal.close()
+
+        entries = Journal('test').load()
+        self.assertEqual([e['n'] for e in entries], [1, 2, 3])
+        self.assertEqual(parse_journal_datetime(entries[0]['timestamp']), now)
+
+    def test_load_broken_entry(self):
+        journal = Journal('test')
+        journal.append({'n': 1})
+        journal.close()
+        with open(journal.path, 'a') as fp:
+            fp.write('{"n": ')
+
+        self.assertEqual(Journal('test').load(), [{'n': 1}])
+
+    def test_rewrite(self):
+        journal = Journal('test')
+        journal.append_many([{'n': 1}, {'n': 2}])
+        journal.rewrite([{'n': 2}])
+        journal.append({'n': 3})
+        journal.close()
+
+        self.assertEqual(Journal('test').load(), [{'n': 2}, {'n': 3}])
+        self.assertFalse(os.path.exists(journal.path + '.tmp'))
+
+    def test_segmented_journal(self):
+        journal = SegmentedJournal('test')
+        journal.append([1])
+        journal.append([2])
+        saving = journal.rotate()
+        journal.append([3])
+        journal.close()
+
+        # a restart before the saved segments are removed loads all entries
+        journal = SegmentedJournal('test')
+        self.assertEqual(journal.load(), [[1], [2], [3]])
+        journal.close()
+
+        remove_journal_segments(saving)
+        journal = SegmentedJournal('test')
+        self.assertEqual(journal.load(), [[3]])
+        journal.append([4])
+        # the segments left by the last two runs and the current one
+        self.assertEqual(len(journal.rotate()), 3)
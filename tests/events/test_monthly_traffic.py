@@ -0,0 +1,205 @@
+# coding:utf8
+
+import pytest
+import unittest
+import datetime
+import configparser
+from unittest import mock
+
+from sqlalchemy import select, update, delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.statistics import counter
+from seafevents.statistics.counter import MonthlyTrafficCounter, MONTHLY_TRAFFIC_COLUMNS
+from seafevents.statistics.models import UserTraffic, MonthlyUserTraffic, MonthlySysTraffic
+from seafevents.tasks import statistics as statistics_tasks
+from seafevents.tasks.statistics import CountMonthlyTrafficInfo
+
+
+def day(d):
+    return datetime.datetime(2024, 5, d)
+
+
+@pytest.mark.usefixtures("test_db")
+class MonthlyTrafficCounterTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+        self.first_day = datetime.date(2024, 5, 1)
+        patcher = mock.patch.dict(counter.monthly_traffic_snapshot, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.remove_data()
+
+    def remove_data(self):
+        session = self.get_session()
+        for model in (UserTraffic, MonthlyUserTraffic, MonthlySysTraffic):
+            session.execute(delete(model))
+        session.commit()
+        session.close()
+
+    def add_traffic(self, rows):
+        session = self.get_session()
+        for timestamp, user, op_type, size, org_id in rows:
+            session.add(UserTraffic(user, timestamp, op_type, size, org_id))
+        session.commit()
+        session.close()
+
+    def grow_traffic(self, timestamp, user, op_type, size):
+        # TrafficInfoCounter adds the sizes of a day to the existing row
+        session = self.get_session()
+        session.execute(update(UserTraffic).where(
+            UserTraffic.timestamp == timestamp, UserTraffic.user == user, UserTraffic.op_type == op_type
+        ).values(size=UserTraffic.size + size))
+        session.commit()
+        session.close()
+
+    def make_counter(self, session):
+        monthly_counter = MonthlyTrafficCounter.__new__(MonthlyTrafficCounter)
+        monthly_counter.edb_session = session
+        monthly_counter.incremental = True
+        monthly_counter.user_item_count = 0
+        monthly_counter.sys_item_count = 0
+        return monthly_counter
+
+    def count(self, today, delta):
+        """Count the month up to ``today`` as start_count does."""
+        open_days = [d for d in (today - datetime.timedelta(days=1), today) if d >= self.first_day]
+        session = self.get_session()
+        monthly_counter = self.make_counter(session)
+        if delta:
+            snapshot = monthly_counter.count_delta(self.first_day, open_days)
+        else:
+            snapshot = monthly_counter.count_full(self.first_day, today, open_days)
+        session.commit()
+        session.close()
+        counter.monthly_traffic_snapshot.clear()
+        counter.monthly_traffic_snapshot.update(snapshot)
+        return monthly_counter
+
+    def get_monthly_traffic(self):
+        session = self.get_session()
+        columns = [MonthlyUserTraffic.__table__.c[column] for column in MONTHLY_TRAFFIC_COLUMNS]
+        users = {(row[0], row[1]): tuple(row[2:]) for row in session.execute(
+            select(MonthlyUserTraffic.user, MonthlyUserTraffic.org_id, *columns)).all()}
+        columns = [MonthlySysTraffic.__table__.c[column] for column in MONTHLY_TRAFFIC_COLUMNS]
+        orgs = {row[0]: tuple(row[1:]) for row in session.execute(
+            select(MonthlySysTraffic.org_id, *columns)).all()}
+        session.close()
+        return users, orgs
+
+    def assert_same_as_full_count(self, today):
+        delta_traffic = self.get_monthly_traffic()
+        session = self.get_session()
+        session.execute(delete(MonthlyUserTraffic))
+        session.execute(delete(MonthlySysTraffic))
+        session.commit()
+        session.close()
+        self.count(today, delta=False)
+        self.assertEqual(delta_traffic, self.get_monthly_traffic())
+
+    def test_delta_same_as_full_count(self):
+        self.add_traffic([
+            (day(2), 'a@a.com', 'web-file-upload', 1, -1),
+            (day(19), 'a@a.com', 'sync-file-download', 2, -1),
+            (day(20), 'b@b.com', 'web-file-download', 4, 1),
+        ])
+        self.count(datetime.date(2024, 5, 20), delta=False)
+        users, orgs = self.get_monthly_traffic()
+        self.assertEqual(users[('a@a.com', -1)][MONTHLY_TRAFFIC_COLUMNS.index('sync_file_download')], 2)
+
+        # yesterday and today grow, a new user and org show up
+        self.grow_traffic(day(19), 'a@a.com', 'sync-file-download', 8)
+        self.grow_traffic(day(20), 'b@b.com', 'web-file-download', 16)
+        self.add_traffic([
+            (day(19), 'a@a.com', 'link-file-download', 32, -1),
+            (day(20), 'c@c.com', 'link-file-upload', 64, 2),
+        ])
+        monthly_counter = self.count(datetime.date(2024, 5, 20), delta=True)
+        # only the grown records are written
+        self.assertEqual(monthly_counter.user_item_count, 3)
+        self.assertEqual(monthly_counter.sys_item_count, 3)
+        self.assert_same_as_full_count(datetime.date(2024, 5, 20))
+
+    def test_delta_next_day(self):
+        self.add_traffic([
+            (day(19), 'a@a.com', 'sync-file-download', 2, -1),
+            (day(20), 'a@a.com', 'web-file-download', 4, -1),
+        ])
+        self.count(datetime.date(2024, 5, 20), delta=False)
+
+        # the 20th grows after the last run of the day, the 19th is closed
+        self.grow_traffic(day(20), 'a@a.com', 'web-file-download', 8)
+        self.add_traffic([(day(21), 'a@a.com', 'web-file-download', 16, -1)])
+        self.count(datetime.date(2024, 5, 21), delta=True)
+        self.assertEqual(counter.monthly_traffic_snapshot['days'],
+                         [datetime.date(2024, 5, 20), datetime.date(2024, 5, 21)])
+
+        users, orgs = self.get_monthly_traffic()
+        self.assertEqual(users[('a@a.com', -1)][MONTHLY_TRAFFIC_COLUMNS.index('web_file_download')], 28)
+        self.assert_same_as_full_count(datetime.date(2024, 5, 21))
+
+    def test_save_monthly_records(self):
+        size_dict = dict.fromkeys(MONTHLY_TRAFFIC_COLUMNS, 0)
+        session = self.get_session()
+        monthly_counter = self.make_counter(session)
+        with mock.patch.object(counter, 'MONTHLY_TRAFFIC_WRITE_CHUNK', 2):
+            monthly_counter.save_monthly_records(MonthlyUserTraffic, self.first_day, {
+                ('a@a.com', -1): dict(size_dict, web_file_upload=1),
+                ('b@b.com', -1): dict(size_dict, web_file_upload=2),
+                ('a@a.com', 1): dict(size_dict, web_file_upload=4),
+            })
+            monthly_counter.save_monthly_records(MonthlyUserTraffic, self.first_day, {
+                ('a@a.com', -1): dict(size_dict, web_file_upload=8),
+                ('c@c.com', -1): dict(size_dict, web_file_upload=16),
+            }, increment=True)
+            monthly_counter.save_monthly_records(MonthlyUserTraffic, self.first_day, {
+                ('b@b.com', -1): dict(size_dict, web_file_upload=32),
+            })
+        session.commit()
+        session.close()
+
+        users, orgs = self.get_monthly_traffic()
+        index = MONTHLY_TRAFFIC_COLUMNS.index('web_file_upload')
+        self.assertEqual({key: value[index] for key, value in users.items()}, {
+            ('a@a.com', -1): 9, ('b@b.com', -1): 32, ('a@a.com', 1): 4, ('c@c.com', -1): 16})
+
+    def test_start_count(self):
+        today = datetime.datetime.utcnow().date()
+        self.first_day = today.replace(day=1)
+        self.add_traffic([(datetime.datetime.combine(today, datetime.time()), 'a@a.com', 'web-file-upload', 1, -1)])
+
+        with mock.patch.object(counter, 'init_db_session_class', return_value=self.get_session), \
+                mock.patch.object(counter, 'SeafileDB'), \
+                mock.patch.object(counter, 'reset_rate_limit_dates', []), \
+                mock.patch.object(MonthlyTrafficCounter, 'count_delta', autospec=True,
+                                  side_effect=MonthlyTrafficCounter.count_delta) as count_delta:
+            MonthlyTrafficCounter(incremental=True).start_count()
+            self.assertEqual(counter.monthly_traffic_snapshot['timestamp'], self.first_day)
+            self.grow_traffic(datetime.datetime.combine(today, datetime.time()), 'a@a.com', 'web-file-upload', 2)
+            MonthlyTrafficCounter(incremental=True).start_count()
+            self.assertEqual(count_delta.call_count, 1)
+
+            # not kept by the default mode
+            MonthlyTrafficCounter().start_count()
+            self.assertEqual(counter.monthly_traffic_snapshot, {})
+            self.assertEqual(count_delta.call_count, 1)
+
+        users, orgs = self.get_monthly_traffic()
+        self.assertEqual(users[('a@a.com', -1)][MONTHLY_TRAFFIC_COLUMNS.index('web_file_upload')], 3)
+
+
+class CountMonthlyTrafficInfoTest(unittest.TestCase):
+    def run_task(self, options):
+        config = configparser.ConfigParser()
+        config.read_dict({'STATISTICS': options})
+        task = CountMonthlyTrafficInfo(config)
+        with mock.patch.object(statistics_tasks, 'MonthlyTrafficCounter') as monthly_counter:
+            monthly_counter.return_value.start_count.side_effect = lambda: task.cancel()
+            task.run()
+        return monthly_counter.call_args[0][0]
+
+    def test_incremental_option(self):
+        self.assertFalse(self.run_task({}))
+        self.assertTrue(self.run_task({'incremental_monthly_traffic': 'true'}))
@@ -0,0 +1,117 @@
+# coding:utf8
+
+import json
+import time
+import queue
+import unittest
+from threading import Thread
+from unittest import mock
+
+from seafevents.app import mq_handler
+from seafevents.app.mq_handler import EventsHandler, MessageHandler
+
+CHANNEL = 'seaf_server.event'
+
+
+def make_msg(msg_type, repo_id, seq):
+    return {'content': json.dumps({'msg_type': msg_type, 'repo_id': repo_id, 'seq': seq})}
+
+
+def get_seq(msg):
+    return json.loads(msg['content'])['seq']
+
+
+def make_events_handler(workers=1, batch_size=1):
+    handler = EventsHandler.__new__(EventsHandler)
+    handler._config = None
+    handler._db_session_class = mock.Mock
+    handler._redis_connection = None
+    handler._batch_size = batch_size
+    handler._workers = workers
+    handler._shard_queue_size = 1000
+    handler._metric_interval = 60
+    return handler
+
+
+class MessageHandlerTest(unittest.TestCase):
+    def test_handle_messages_in_order(self):
+        handled = []
+
+        def repo_update(config, session, msg):
+            handled.append(('repo-update', get_seq(msg)))
+
+        def repo_update_batch(config, session, msgs):
+            handled.append(('repo-update batch', [get_seq(msg) for msg in msgs]))
+
+        def file_audit(config, session, msg):
+            handled.append(('file-audit', get_seq(msg)))
+
+        message_handler = MessageHandler()
+        message_handler.add_handler(CHANNEL + ':repo-update', repo_update)
+        message_handler.add_batch_handler(repo_update, repo_update_batch)
+        message_handler.add_handler(CHANNEL + ':file-audit', file_audit)
+
+        msgs = [make_msg('repo-update', 'repo1', 0), make_msg('file-audit', 'repo1', 1),
+                make_msg('repo-update', 'repo1', 2), make_msg('file-audit', 'repo1', 3)]
+        message_handler.handle_messages(None, mock.Mock(), None, CHANNEL, msgs)
+        self.assertEqual(handled, [('repo-update batch', [0, 2]), ('file-audit', 1), ('file-audit', 3)])
+
+    def test_batch_handler_failure(self):
+        handled = []
+
+        def repo_update(config, session, msg):
+            handled.append(get_seq(msg))
+
+        def repo_update_batch(config, session, msgs):
+            raise Exception('deadlock')
+
+        message_handler = MessageHandler()
+        message_handler.add_handler(CHANNEL + ':repo-update', repo_update)
+        message_handler.add_batch_handler(repo_update, repo_update_batch)
+
+        session = mock.Mock()
+        msgs = [make_msg('repo-update', 'repo1', i) for i in range(3)]
+        message_handler.handle_messages(None, session, None, CHANNEL, msgs)
+        # handled again one message at a time
+        self.assertEqual(handled, [0, 1, 2])
+        session.rollback.assert_called_once_with()
+
+
+class EventsHandlerTest(unittest.TestCase):
+    def test_pop_events_partial_failure(self):
+        handler = make_events_handler(batch_size=10)
+        msgs = [make_msg('repo-update', 'repo1', i) for i in range(2)]
+        with mock.patch.object(mq_handler.seafile_api, 'pop_event',
+                               side_effect=msgs + [Exception('connection reset')]):
+            # the popped messages are not lost
+            self.assertEqual(handler.pop_events(CHANNEL), msgs)
+
+        with mock.patch.object(mq_handler.seafile_api, 'pop_event', side_effect=Exception('connection reset')):
+            self.assertRaises(Exception, handler.pop_events, CHANNEL)
+
+    def test_shard_order(self):
+        handler = make_events_handler(workers=4, batch_size=3)
+        msgs = [make_msg('repo-update', 'repo%d' % (i % 3), i) for i in range(30)]
+        for repo_id in ['repo0', 'repo1', 'repo2']:
+            shards = {handler.get_shard(msg) for msg in msgs if json.loads(msg['content'])['repo_id'] == repo_id}
+            self.assertEqual(len(shards), 1)
+
+        handled = []
+        message_handler = mock.Mock()
+        message_handler.handle_messages.side_effect = \
+            lambda config, session, redis_connection, channel, batch: handled.extend(batch)
+        shard_queue = queue.Queue()
+        for msg in msgs:
+            shard_queue.put((msg, time.time()))
+
+        with mock.patch.object(mq_handler, 'message_handler', message_handler):
+            worker = Thread(target=handler.handle_shard, args=(CHANNEL, 0, shard_queue, [0]), daemon=True)
+            worker.start()
+            deadline = time.time() + 10
+            while len(handled) < len(msgs) and time.time() < deadline:
+                time.sleep(0.01)
+
+        self.assertEqual([get_seq(msg) for msg in handled], list(range(30)))
+        # batches of at most batch_size messages
+        for call in message_handler.handle_messages.call_args_list:
+            self.assertLessEqual(len(call[0][4]), 3)
@@ -0,0 +1,151 @@
+# coding:utf8
+
+import json
+import time
+import pytest
+import unittest
+import configparser
+from unittest import mock
+
+from sqlalchemy import select, delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.events import handlers
+from seafevents.events import repo_context_cache as repo_context_cache_module
+from seafevents.events.repo_context_cache import RepoContextCache, OrgLastActivityTimeWriter
+from seafevents.events.models import OrgLastActivityTime
+
+
+def make_config(**options):
+    config = configparser.ConfigParser()
+    config.read_dict({'EVENTS HANDLER': options})
+    return config
+
+
+class RepoContextCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+
+        def load_repo_context(repo_id):
+            self.loaded.append(repo_id)
+            return 1, 'owner@a.com', ['user%d@a.com' % len(self.loaded)]
+
+        patchers = [
+            mock.patch.object(repo_context_cache_module, 'load_repo_context', side_effect=load_repo_context),
+            mock.patch.object(repo_context_cache_module, 'publish_metric'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_cache(self, **options):
+        cache = RepoContextCache()
+        cache.init(make_config(**options))
+        return cache
+
+    def test_disabled(self):
+        cache = self.get_cache()
+        self.assertFalse(cache.enabled)
+        cache.get_repo_context('repo1')
+        cache.get_repo_context('repo1')
+        self.assertEqual(self.loaded, ['repo1', 'repo1'])
+
+    def test_ttl(self):
+        cache = self.get_cache(repo_cache_ttl='60')
+        self.assertEqual(cache.get_repo_context('repo1'), cache.get_repo_context('repo1'))
+        self.assertEqual(self.loaded, ['repo1'])
+
+        with mock.patch.object(repo_context_cache_module.time, 'time', return_value=time.time() + 61):
+            self.assertEqual(cache.get_repo_context('repo1')[2], ['user2@a.com'])
+        self.assertEqual(self.loaded, ['repo1', 'repo1'])
+
+    def test_lru(self):
+        cache = self.get_cache(repo_cache_ttl='60', repo_cache_size='2')
+        for repo_id in ['repo1', 'repo2', 'repo1', 'repo3', 'repo1', 'repo2']:
+            cache.get_repo_context(repo_id)
+        # repo2 is the least recently used one when repo3 is added
+        self.assertEqual(self.loaded, ['repo1', 'repo2', 'repo3', 'repo2'])
+
+    def test_invalidate_handler(self):
+        cache = self.get_cache(repo_cache_ttl='60')
+        cache.get_repo_context('repo1')
+        cache.get_repo_context('repo2')
+
+        with mock.patch.object(handlers, 'repo_context_cache', cache):
+            msg = {'content': json.dumps({'etype': 'modify-repo-perm', 'repo_id': 'repo1'})}
+            handlers.RepoContextInvalidateHandler(None, None, msg)
+            handlers.RepoContextInvalidateHandler(None, None, {'content': 'not json'})
+        cache.get_repo_context('repo1')
+        cache.get_repo_context('repo2')
+        self.assertEqual(self.loaded, ['repo1', 'repo2', 'repo1'])
+
+
+@pytest.mark.usefixtures("test_db")
+class OrgLastActivityTimeWriterTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+
+    def tearDown(self):
+        self.remove_data()
+
+    def remove_data(self):
+        session = self.get_session()
+        session.execute(delete(OrgLastActivityTime))
+        session.commit()
+        session.close()
+
+    def get_writer(self, interval):
+        writer = OrgLastActivityTimeWriter()
+        writer.init(make_config(org_activity_interval=str(interval)))
+        return writer
+
+    def get_times(self):
+        session = self.get_session()
+        rows = session.execute(select(OrgLastActivityTime.org_id, OrgLastActivityTime.timestamp)).all()
+        session.close()
+        return dict(rows)
+
+    def test_update_without_interval(self):
+        writer = self.get_writer(0)
+        session = self.get_session()
+        writer.update(session, 1)
+        first = self.get_times()[1]
+        writer.update(session, 1)
+        session.close()
+        self.assertEqual(len(self.get_times()), 1)
+        self.assertGreaterEqual(self.get_times()[1], first)
+
+    def test_coalesced_updates(self):
+        writer = self.get_writer(60)
+        session = self.get_session()
+        writer.update(session, 1)
+        first = self.get_times()[1]
+
+        # kept as pending within the interval
+        writer.update(session, 1)
+        writer.update(session, 2)
+        writer.flush(session)
+        self.assertEqual(set(self.get_times()), {1, 2})
+        self.assertEqual(self.get_times()[1], first)
+        self.assertIn(1, writer._pending)
+
+        # written by the flusher after the interval
+        with mock.patch.object(repo_context_cache_module.time, 'time', return_value=time.time() + 61):
+            writer.flush(session)
+        session.close()
+        self.assertEqual(writer._pending, {})
+        self.assertGreaterEqual(self.get_times()[1], first)
+
+    def test_write_error(self):
+        writer = self.get_writer(60)
+        session = mock.Mock()
+        session.query.side_effect = Exception('database is down')
+        writer.update(session, 1)
+        session.rollback.assert_called_once_with()
+        # written again by the next flush
+        self.assertIn(1, writer._pending)
+
+        session = self.get_session()
+        writer.flush(session)
+        session.close()
+        self.assertEqual(set(self.get_times()), {1})
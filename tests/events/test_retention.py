@@ -0,0 +1,45 @@
+# coding:utf8
+
+import pytest
+import datetime
+
+from sqlalchemy import delete, select
+
+from seafevents.tests.utils import EventTest
+from seafevents.events.db import save_file_audit_events
+from seafevents.events.models import FileAudit
+from seafevents.events.retention import RetentionPolicy, apply_retention
+
+
+@pytest.mark.usefixtures("test_db")
+class RetentionTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+        self.repo_id = 'fd62b808-63bf-4ab1-bdee-7fa4a94b85b5'
+        self.user = 'admin@admin.com'
+
+    def tearDown(self):
+        self.remove_data()
+
+    def remove_data(self):
+        session = self.get_session()
+        session.execute(delete(FileAudit))
+        session.commit()
+        session.close()
+
+    def test_delete_expired_rows(self):
+        session = self.get_session()
+        now = datetime.datetime.utcnow()
+        events = [(now - datetime.timedelta(days=days), 'file-download-web', self.user, '127.0.0.1', '', -1,
+                   self.repo_id, '/%d.txt' % days) for days in (1, 10, 40, 400)]
+        save_file_audit_events(session, events)
+
+        policy = RetentionPolicy('file_audit', FileAudit, FileAudit.eid, FileAudit.timestamp, 30)
+        # the test table is not partitioned
+        dropped, deleted = apply_retention(session, policy)
+        session.commit()
+        self.assertEqual((dropped, deleted), (0, 2))
+
+        paths = session.scalars(select(FileAudit.file_path).order_by(FileAudit.file_path)).all()
+        self.assertEqual(paths, ['/1.txt', '/10.txt'])
+        session.close()
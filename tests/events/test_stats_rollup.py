@@ -0,0 +1,164 @@
+# coding:utf8
+
+import pytest
+import datetime
+
+from sqlalchemy import select, delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.statistics import db as stats_db
+from seafevents.statistics.rollup import stats_cache, update_rollups, ROLLUP_OPEN_DAYS
+from seafevents.statistics.models import FileOpsStat, TotalStorageStat, UserActivityStat, SysTraffic, \
+    StatsDailyRollup, StatsRollupRange
+
+TODAY = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time())
+
+
+def day(days_ago, hour=0):
+    return TODAY - datetime.timedelta(days=days_ago, hours=-hour)
+
+
+@pytest.mark.usefixtures("test_db")
+class StatsRollupTest(EventTest):
+    """Rows of the dashboard queries are the same whether the days are read
+    from the raw tables or from the rollup, on both sides of the rolled up
+    days. Expected rows are the results of the queries before the rollup.
+    """
+    def setUp(self):
+        self.remove_data()
+        stats_cache.clear()
+        session = self.get_session()
+        for org_id, timestamp, op_type, number in [
+            (-1, day(15), 'Added', 256),
+            (-1, day(13, 1), 'Added', 1),
+            (1, day(13, 2), 'Added', 2),
+            (1, day(12, 23), 'Deleted', 4),
+            (-1, day(10), 'Added', 8),
+            (2, day(10, 5), 'Added', 16),
+            (1, day(9, 12), 'Modified', 32),
+            (-1, day(8, 3), 'Added', 64),
+            (1, day(3, 4), 'Added', 128),
+        ]:
+            session.add(FileOpsStat(org_id, timestamp, op_type, number))
+        for org_id, timestamp, total_size in [
+            (-1, day(13, 1), 10), (1, day(13, 1), 20),
+            (-1, day(13, 5), 11), (1, day(13, 5), 21),
+            (-1, day(10, 2), 30), (1, day(10, 2), 40),
+            (-1, day(3, 2), 50), (1, day(3, 2), 60),
+        ]:
+            session.add(TotalStorageStat(org_id, timestamp, total_size))
+        for org_id, username, timestamp in [
+            (-1, 'a@a.com', day(13)), (1, 'b@b.com', day(13)), (1, 'c@c.com', day(13)),
+            (-1, 'a@a.com', day(9)), (1, 'b@b.com', day(9)),
+            (1, 'c@c.com', day(3)),
+        ]:
+            session.add(UserActivityStat('%s%s' % (username, timestamp.day), org_id, username, timestamp))
+        for timestamp, op_type, size, org_id in [
+            (day(13), 'web-file-download', 1, -1),
+            (day(13), 'web-file-download', 2, 1),
+            (day(11), 'sync-file-upload', 4, 1),
+            (day(3), 'web-file-download', 8, 1),
+        ]:
+            session.add(SysTraffic(timestamp, op_type, size, org_id))
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        self.remove_data()
+        stats_cache.clear()
+
+    def remove_data(self):
+        session = self.get_session()
+        for model in (FileOpsStat, TotalStorageStat, UserActivityStat, SysTraffic, StatsDailyRollup,
+                      StatsRollupRange):
+            session.execute(delete(model))
+        session.commit()
+        session.close()
+
+    def query(self, func, *args):
+        stats_cache.clear()
+        session = self.get_session()
+        rows = func(session, *args)
+        session.close()
+        return rows
+
+    def update_rollups(self):
+        session = self.get_session()
+        update_rollups(session)
+        session.close()
+
+    def get_rollup_range(self, kind):
+        session = self.get_session()
+        state = session.scalars(select(StatsRollupRange).where(StatsRollupRange.kind == kind)).one()
+        session.close()
+        return state.first_day, state.last_day
+
+    def assert_rolled_up(self, func, args, expected, kind):
+        """Check the rows before the rollup, with the rollup in the middle of
+        the range and with the whole final range rolled up.
+        """
+        # only the days from the 11th are requested
+        self.assertEqual(self.query(func, *args[:-2], day(11), day(2)),
+                         [row for row in expected if (row[0] if isinstance(row, tuple) else row['timestamp'])
+                          >= day(11)])
+        self.update_rollups()
+        self.assertEqual(self.get_rollup_range(kind), (day(11), day(ROLLUP_OPEN_DAYS)))
+
+        # the 13th and 12th from the raw tables, then the rollup, then the open days
+        self.assertEqual(self.query(func, *args), expected)
+
+        self.update_rollups()
+        self.assertEqual(self.get_rollup_range(kind), (day(13), day(ROLLUP_OPEN_DAYS)))
+        self.assertEqual(self.query(func, *args), expected)
+
+    def test_file_ops(self):
+        expected = [(day(13), 'Added', 3), (day(12), 'Deleted', 4), (day(10), 'Added', 24),
+                    (day(9), 'Modified', 32), (day(8), 'Added', 64), (day(3), 'Added', 128)]
+        self.assert_rolled_up(stats_db.get_file_ops_stats_by_day, (day(13), day(2)), expected, 'file_ops')
+
+    def test_org_file_ops(self):
+        expected = [(day(13), 'Added', 2), (day(12), 'Deleted', 4), (day(9), 'Modified', 32),
+                    (day(3), 'Added', 128)]
+        expected = [{'timestamp': d, 'op_type': op_type, 'number': number} for d, op_type, number in expected]
+        self.assert_rolled_up(stats_db.get_org_file_ops_stats_by_day, (1, day(13), day(2)), expected, 'file_ops')
+
+    def test_storage(self):
+        expected = [(day(13), 32), (day(10), 70), (day(3), 110)]
+        self.assert_rolled_up(stats_db.get_total_storage_stats_by_day, (day(13), day(2)), expected, 'storage')
+
+    def test_org_storage(self):
+        expected = [{'timestamp': day(13), 'number': 21}, {'timestamp': day(10), 'number': 40},
+                    {'timestamp': day(3), 'number': 60}]
+        self.assert_rolled_up(stats_db.get_org_storage_stats_by_day, (1, day(13), day(2)), expected, 'storage')
+
+    def test_user_activity(self):
+        expected = [(day(13), 3), (day(9), 2), (day(3), 1)]
+        self.assert_rolled_up(stats_db.get_user_activity_stats_by_day, (day(13), day(2)), expected, 'activity')
+
+    def test_org_user_activity(self):
+        expected = [{'timestamp': day(13), 'number': 2}, {'timestamp': day(9), 'number': 1},
+                    {'timestamp': day(3), 'number': 1}]
+        self.assert_rolled_up(stats_db.get_org_user_activity_stats_by_day, (1, day(13), day(2)), expected,
+                              'activity')
+
+    def test_system_traffic(self):
+        expected = [(day(13), 'web-file-download', 3), (day(11), 'sync-file-upload', 4),
+                    (day(3), 'web-file-download', 8)]
+        self.assert_rolled_up(stats_db.get_system_traffic_by_day, (day(13), day(2)), expected, 'traffic')
+
+    def test_org_traffic(self):
+        expected = [(day(13), 'web-file-download', 2), (day(11), 'sync-file-upload', 4),
+                    (day(3), 'web-file-download', 8)]
+        self.assert_rolled_up(stats_db.get_org_traffic_by_day, (1, day(13), day(2)), expected, 'traffic')
+
+    def test_all_orgs_rollup(self):
+        self.query(stats_db.get_file_ops_stats_by_day, day(13), day(2))
+        self.update_rollups()
+
+        # totals of all orgs are kept with a NULL org_id
+        session = self.get_session()
+        rows = session.execute(select(StatsDailyRollup.timestamp, StatsDailyRollup.op_type, StatsDailyRollup.number)
+                               .where(StatsDailyRollup.kind == 'file_ops', StatsDailyRollup.org_id.is_(None))).all()
+        session.close()
+        self.assertEqual(sorted(rows), [(day(13), 'Added', 3), (day(12), 'Deleted', 4), (day(10), 'Added', 24),
+                                        (day(9), 'Modified', 32), (day(8), 'Added', 64)])
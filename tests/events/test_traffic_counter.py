@@ -0,0 +1,156 @@
+# coding:utf8
+
+import pytest
+import unittest
+import datetime
+from unittest import mock
+
+from sqlalchemy import delete
+
+from seafevents.tests.utils import EventTest
+from seafevents.statistics import counter
+from seafevents.statistics.counter import TrafficLimitResolver, TrafficInfoCounter
+from seafevents.statistics.models import UserTraffic, SysTraffic
+
+ROLE_TRAFFIC_LIMITS = {
+    'default': {'monthly_rate_limit': 100, 'monthly_upload_traffic_limit': 50,
+                'monthly_rate_limit_per_user': 10, 'monthly_upload_traffic_limit_per_user': 5},
+    'vip': {'monthly_rate_limit': 1000},
+}
+
+
+class FakeDB(object):
+    def __init__(self, **results):
+        self.results = results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __getattr__(self, name):
+        if name not in self.results:
+            raise AttributeError(name)
+        result = self.results[name]
+        if isinstance(result, Exception):
+            def raise_error(*args):
+                raise result
+            return raise_error
+        return lambda *args: result
+
+
+def make_traffic_counter(session):
+    traffic_counter = TrafficInfoCounter.__new__(TrafficInfoCounter)
+    traffic_counter.edb_session = session
+    traffic_counter.download_type_list = ['web-file-download', 'link-file-download', 'sync-file-download']
+    traffic_counter.upload_type_list = ['web-file-upload', 'link-file-upload', 'sync-file-upload']
+    return traffic_counter
+
+
+class TrafficLimitResolverTest(unittest.TestCase):
+    def load(self, rows, ccnet_db, seahub_db):
+        resolver = TrafficLimitResolver(ROLE_TRAFFIC_LIMITS)
+        with mock.patch.object(counter, 'CcnetDB', return_value=ccnet_db), \
+                mock.patch.object(counter, 'SeahubDB', return_value=seahub_db):
+            resolver.load(rows)
+        return resolver
+
+    def test_thresholds(self):
+        ccnet_db = FakeDB(get_users_role={'a@a.com': 'vip', 'b@b.com': '', 'c@c.com': 'default'})
+        seahub_db = FakeDB(get_orgs_settings={1: ('default', 0), 2: ('', 300)},
+                           get_orgs_member_quota={1: 3, 2: None})
+        rows = [(-1, 'a@a.com', 'web-file-download'), (-1, 'b@b.com', 'web-file-upload'),
+                (1, 'c@c.com', 'sync-file-download'), (2, 'c@c.com', 'sync-file-upload')]
+        resolver = self.load(rows, ccnet_db, seahub_db)
+
+        self.assertEqual(resolver.get_download_threshold(-1, 'a@a.com'), 1000)
+        self.assertIsNone(resolver.get_upload_threshold(-1, 'a@a.com'))
+        self.assertEqual(resolver.get_download_threshold(-1, 'b@b.com'), 100)
+        self.assertEqual(resolver.get_upload_threshold(-1, 'b@b.com'), 50)
+        # member quota times the limit per user
+        self.assertEqual(resolver.get_download_threshold(1, 'c@c.com'), 30)
+        self.assertEqual(resolver.get_upload_threshold(1, 'c@c.com'), 15)
+        # the monthly traffic limit of the org
+        self.assertEqual(resolver.get_download_threshold(2, 'c@c.com'), 300)
+        self.assertIsNone(resolver.get_upload_threshold(2, 'c@c.com'))
+
+    def test_load_error(self):
+        ccnet_db = FakeDB(get_users_role={'a@a.com': 'vip'})
+        seahub_db = FakeDB(get_orgs_settings=Exception('seahub database is down'))
+        self.assertRaises(Exception, self.load, [(1, 'a@a.com', 'web-file-download')], ccnet_db, seahub_db)
+
+    def test_start_count_restores_traffic(self):
+        today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        key = (today, -1, 'a@a.com', 'web-file-download')
+        session = mock.Mock()
+        traffic_counter = make_traffic_counter(session)
+
+        with mock.patch.object(counter, 'traffic_info', counter.StatsAccumulator('traffic_info')) as traffic_info, \
+                mock.patch.object(counter, 'get_role_traffic_limit_dict', return_value=ROLE_TRAFFIC_LIMITS), \
+                mock.patch.object(counter, 'CcnetDB', side_effect=Exception('ccnet database is down')):
+            traffic_info.add(key, 10)
+            traffic_counter.start_count()
+            # counted again in the next run
+            self.assertEqual(traffic_info.swap(), {key: 10})
+        session.rollback.assert_called_once_with()
+        session.commit.assert_not_called()
+
+
+@pytest.mark.usefixtures("test_db")
+class MonthlyTrafficQueryTest(EventTest):
+    def setUp(self):
+        self.remove_data()
+        self.first_day = datetime.datetime(2024, 5, 1)
+        self.today = datetime.datetime(2024, 5, 20)
+        session = self.get_session()
+        for day, user, op_type, size, org_id in [
+            (datetime.datetime(2024, 4, 30), 'a@a.com', 'web-file-download', 1000, -1),
+            (datetime.datetime(2024, 5, 1), 'a@a.com', 'web-file-download', 1, -1),
+            (datetime.datetime(2024, 5, 2), 'a@a.com', 'sync-file-download', 2, -1),
+            (datetime.datetime(2024, 5, 20), 'a@a.com', 'link-file-upload', 4, -1),
+            (datetime.datetime(2024, 5, 21), 'a@a.com', 'web-file-upload', 1000, -1),
+            (datetime.datetime(2024, 5, 3), 'b@b.com', 'web-file-upload', 8, -1),
+            (datetime.datetime(2024, 5, 3), 'b@b.com', 'web-file-download', 16, 1),
+            (datetime.datetime(2024, 5, 3), 'c@c.com', 'web-file-download', 32, -1),
+        ]:
+            session.add(UserTraffic(user, day, op_type, size, org_id))
+        for day, op_type, size, org_id in [
+            (datetime.datetime(2024, 4, 30), 'web-file-download', 1000, 1),
+            (datetime.datetime(2024, 5, 1), 'web-file-download', 1, 1),
+            (datetime.datetime(2024, 5, 2), 'sync-file-download', 2, 1),
+            (datetime.datetime(2024, 5, 3), 'web-file-upload', 4, 1),
+            (datetime.datetime(2024, 5, 3), 'web-file-upload', 8, 2),
+            (datetime.datetime(2024, 5, 3), 'web-file-upload', 16, 3),
+        ]:
+            session.add(SysTraffic(day, op_type, size, org_id))
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        self.remove_data()
+
+    def remove_data(self):
+        session = self.get_session()
+        session.execute(delete(UserTraffic))
+        session.execute(delete(SysTraffic))
+        session.commit()
+        session.close()
+
+    def test_get_monthly_user_traffic(self):
+        session = self.get_session()
+        traffic_counter = make_traffic_counter(session)
+        with mock.patch.object(counter, 'TRAFFIC_QUERY_CHUNK', 1):
+            monthly_traffic = traffic_counter.get_monthly_user_traffic(
+                ['a@a.com', 'b@b.com'], -1, self.first_day, self.today)
+        session.close()
+        self.assertEqual(monthly_traffic, {('a@a.com', 'download'): 3, ('a@a.com', 'upload'): 4,
+                                           ('b@b.com', 'upload'): 8})
+
+    def test_get_monthly_org_traffic(self):
+        session = self.get_session()
+        traffic_counter = make_traffic_counter(session)
+        with mock.patch.object(counter, 'TRAFFIC_QUERY_CHUNK', 1):
+            monthly_traffic = traffic_counter.get_monthly_org_traffic([1, 2], self.first_day, self.today)
+        session.close()
+        self.assertEqual(monthly_traffic, {(1, 'download'): 3, (1, 'upload'): 4, (2, 'upload'): 8})
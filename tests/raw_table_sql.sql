@@ -75,7 +75,9 @@ CREATE TABLE `FileAudit` (
   KEY `idx_file_audit_repo_org_eid` (`repo_id`,`org_id`,`eid`),
   KEY `idx_file_audit_user_orgid_eid` (`user`,`org_id`,`eid`),
   KEY `ix_FileAudit_timestamp` (`timestamp`),
-  KEY `idx_file_audit_orgid_eid` (`org_id`,`eid`)
+  KEY `idx_file_audit_orgid_eid` (`org_id`,`eid`),
+  KEY `idx_file_audit_user_eid` (`user`,`eid`),
+  KEY `idx_file_audit_repo_eid` (`repo_id`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=803 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
@@ -125,7 +127,9 @@ CREATE TABLE `FileUpdate` (
   KEY `ix_FileUpdate_timestamp` (`timestamp`),
   KEY `idx_file_update_repo_org_eid` (`repo_id`,`org_id`,`eid`),
   KEY `idx_file_update_user_orgid_eid` (`user`,`org_id`,`eid`),
-  KEY `idx_file_update_orgid_eid` (`org_id`,`eid`)
+  KEY `idx_file_update_orgid_eid` (`org_id`,`eid`),
+  KEY `idx_file_update_user_eid` (`user`,`eid`),
+  KEY `idx_file_update_repo_eid` (`repo_id`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1600 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
@@ -176,11 +180,41 @@ CREATE TABLE `PermAudit` (
   PRIMARY KEY (`eid`),
   KEY `idx_perm_audit_orgid_eid` (`org_id`,`eid`),
   KEY `idx_perm_audit_repo_org_eid` (`repo_id`,`org_id`,`eid`),
-  KEY `idx_perm_audit_user_orgid_eid` (`from_user`,`org_id`,`eid`)
+  KEY `idx_perm_audit_user_orgid_eid` (`from_user`,`org_id`,`eid`),
+  KEY `idx_perm_audit_user_eid` (`from_user`,`eid`),
+  KEY `idx_perm_audit_repo_eid` (`repo_id`,`eid`),
+  KEY `idx_perm_audit_to_eid` (`to`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=40 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `StatsDailyRollup` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `tz_offset` varchar(6) NOT NULL,
+  `timestamp` datetime NOT NULL,
+  `org_id` int(11) DEFAULT NULL,
+  `op_type` varchar(48) NOT NULL,
+  `number` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_rollup_kind_offset_time_org` (`kind`,`tz_offset`,`timestamp`,`org_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `StatsRollupRange` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `tz_offset` varchar(6) NOT NULL,
+  `first_day` datetime NOT NULL,
+  `last_day` datetime NOT NULL,
+  `requested_day` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `idx_rollup_range_kind_offset` (`kind`,`tz_offset`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
 CREATE TABLE `SysTraffic` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `org_id` int(11) DEFAULT NULL,
@@ -846,6 +880,16 @@ CREATE TABLE `options_useroptions` (
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `org_last_active_time` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `org_id` int(11) NOT NULL,
+  `timestamp` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_org_last_active_time_org_id` (`org_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
 CREATE TABLE `organizations_orgmemberquota` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `org_id` int(11) NOT NULL,
@@ -1589,7 +1633,9 @@ CREATE TABLE `FileAudit` (
   KEY `idx_file_audit_repo_org_eid` (`repo_id`,`org_id`,`eid`),
   KEY `idx_file_audit_user_orgid_eid` (`user`,`org_id`,`eid`),
   KEY `ix_FileAudit_timestamp` (`timestamp`),
-  KEY `idx_file_audit_orgid_eid` (`org_id`,`eid`)
+  KEY `idx_file_audit_orgid_eid` (`org_id`,`eid`),
+  KEY `idx_file_audit_user_eid` (`user`,`eid`),
+  KEY `idx_file_audit_repo_eid` (`repo_id`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=803 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
@@ -1639,7 +1685,9 @@ CREATE TABLE `FileUpdate` (
   KEY `ix_FileUpdate_timestamp` (`timestamp`),
   KEY `idx_file_update_repo_org_eid` (`repo_id`,`org_id`,`eid`),
   KEY `idx_file_update_user_orgid_eid` (`user`,`org_id`,`eid`),
-  KEY `idx_file_update_orgid_eid` (`org_id`,`eid`)
+  KEY `idx_file_update_orgid_eid` (`org_id`,`eid`),
+  KEY `idx_file_update_user_eid` (`user`,`eid`),
+  KEY `idx_file_update_repo_eid` (`repo_id`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1600 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
@@ -1690,11 +1738,41 @@ CREATE TABLE `PermAudit` (
   PRIMARY KEY (`eid`),
   KEY `idx_perm_audit_orgid_eid` (`org_id`,`eid`),
   KEY `idx_perm_audit_repo_org_eid` (`repo_id`,`org_id`,`eid`),
-  KEY `idx_perm_audit_user_orgid_eid` (`from_user`,`org_id`,`eid`)
+  KEY `idx_perm_audit_user_orgid_eid` (`from_user`,`org_id`,`eid`),
+  KEY `idx_perm_audit_user_eid` (`from_user`,`eid`),
+  KEY `idx_perm_audit_repo_eid` (`repo_id`,`eid`),
+  KEY `idx_perm_audit_to_eid` (`to`,`eid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=40 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `StatsDailyRollup` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `tz_offset` varchar(6) NOT NULL,
+  `timestamp` datetime NOT NULL,
+  `org_id` int(11) DEFAULT NULL,
+  `op_type` varchar(48) NOT NULL,
+  `number` bigint(20) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_rollup_kind_offset_time_org` (`kind`,`tz_offset`,`timestamp`,`org_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `StatsRollupRange` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `tz_offset` varchar(6) NOT NULL,
+  `first_day` datetime NOT NULL,
+  `last_day` datetime NOT NULL,
+  `requested_day` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `idx_rollup_range_kind_offset` (`kind`,`tz_offset`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
 CREATE TABLE `SysTraffic` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `org_id` int(11) DEFAULT NULL,
@@ -2360,6 +2438,16 @@ CREATE TABLE `options_useroptions` (
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `org_last_active_time` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `org_id` int(11) NOT NULL,
+  `timestamp` datetime NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_org_last_active_time_org_id` (`org_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
 CREATE TABLE `organizations_orgmemberquota` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `org_id` int(11) NOT NULL,
@@ -0,0 +1,55 @@
+# coding:utf8
+
+
+class FakeSeaSearchAPI(object):
+    """Keeps the documents of SeaSearchAPI in memory and counts the requests
+    made to it, only the calls used by the index stores are supported.
+    """
+    def __init__(self):
+        self.indexes = {}
+        self.requests = []
+
+    def _index(self, index_name):
+        return self.indexes.setdefault(index_name, {})
+
+    def create_index(self, index_name, data):
+        self.requests.append(('create_index', index_name))
+        self._index(index_name)
+        return data
+
+    def check_index_mapping(self, index_name):
+        return {'is_exist': index_name in self.indexes}
+
+    def create_document_by_id(self, index_name, doc_id, data):
+        self.requests.append(('create_document', index_name))
+        self._index(index_name)[doc_id] = dict(data)
+        return data
+
+    def get_document_by_id(self, index_name, doc_id):
+        self.requests.append(('get_document', index_name))
+        doc = self._index(index_name).get(doc_id)
+        if doc is None:
+            return {'error': 'document not found'}
+        return {'_id': doc_id, '_source': dict(doc)}
+
+    def delete_document_by_id(self, index_name, doc_id):
+        self.requests.append(('delete_document', index_name))
+        self._index(index_name).pop(doc_id, None)
+        return {}
+
+    def bulk(self, index_name, data):
+        self.requests.append(('bulk', index_name))
+        for action, doc in zip(data[::2], data[1::2]):
+            op = action['index']
+            self._index(op['_index'])[op['_id']] = dict(doc)
+        return data
+
+    def normal_search(self, index_name, data):
+        self.requests.append(('search', index_name))
+        docs = sorted(self._index(index_name).items())
+        start = data.get('from', 0)
+        hits = [{'_id': doc_id, '_source': dict(doc)} for doc_id, doc in docs[start: start + data.get('size', 10)]]
+        return {'hits': {'total': {'value': len(docs)}, 'hits': hits}}
+
+    def count(self, request):
+        return sum(1 for r in self.requests if r[0] == request)
@@ -0,0 +1,162 @@
+# coding:utf8
+
+import hashlib
+import unittest
+from unittest import mock
+
+from seafevents.seasearch import utils as seasearch_utils
+from seafevents.seasearch.utils import get_commit_ctime
+from seafevents.seasearch.utils.commit_differ import CommitDiffer, make_path
+from seafevents.virus_scanner.commit_differ import CommitDiffer as ScanCommitDiffer
+
+FILE = 1
+DIR = 3
+
+
+class Dirent(object):
+    def __init__(self, name, type, id, mtime, size):
+        self.name = name
+        self.type = type
+        self.id = id
+        self.mtime = mtime
+        self.size = size
+
+
+class Dir(object):
+    def __init__(self, dirents):
+        self.dirents = dict((d.name, d) for d in dirents)
+
+    def get_files_list(self):
+        return [d for d in self.dirents.values() if d.type == FILE]
+
+    def get_subdirs_list(self):
+        return [d for d in self.dirents.values() if d.type == DIR]
+
+    def lookup_dent(self, name):
+        return self.dirents.get(name)
+
+    def remove_entry(self, name):
+        self.dirents.pop(name, None)
+
+
+class FakeFsManager(object):
+    def __init__(self):
+        self.dirs = {}
+
+    def add_tree(self, tree):
+        """Store a tree of {name: content or subtree}, return its id."""
+        dirents = []
+        for name, value in sorted(tree.items()):
+            if isinstance(value, dict):
+                dirents.append((name, DIR, self.add_tree(value), 0, 0))
+            else:
+                obj_id = hashlib.sha1(value.encode()).hexdigest()
+                dirents.append((name, FILE, obj_id, 100, len(value)))
+        dir_id = hashlib.sha1(repr(dirents).encode()).hexdigest()
+        self.dirs[dir_id] = dirents
+        return dir_id
+
+    def load_seafdir(self, repo_id, version, obj_id):
+        return Dir([Dirent(*d) for d in self.dirs[obj_id]])
+
+
+def baseline_diff(fs_mgr, root1, root2, root2_time):
+    """The breadth first differ used before the prefetching walk."""
+    added_files, deleted_files, deleted_dirs, modified_files, added_dirs = [], [], [], [], []
+    new_dirs = []
+    queued_dirs = []
+    if not root1:
+        new_dirs.append(('/', root2, root2_time, None))
+    elif not root2:
+        deleted_dirs.append('/')
+    else:
+        queued_dirs.append(('/', root1, root2))
+
+    while queued_dirs:
+        path, old_id, new_id = queued_dirs.pop(0)
+        dir1 = fs_mgr.load_seafdir(None, 1, old_id)
+        dir2 = fs_mgr.load_seafdir(None, 1, new_id)
+        for dent in dir1.get_files_list():
+            new_dent = dir2.lookup_dent(dent.name)
+            if not new_dent or new_dent.type != dent.type:
+                deleted_files.append((make_path(path, dent.name), ))
+            else:
+                dir2.remove_entry(dent.name)
+                if new_dent.id != dent.id:
+                    modified_files.append((make_path(path, dent.name), new_dent.id, new_dent.mtime, new_dent.size))
+        added_files.extend([(make_path(path, d.name), d.id, d.mtime, d.size) for d in dir2.get_files_list()])
+        for dent in dir1.get_subdirs_list():
+            new_dent = dir2.lookup_dent(dent.name)
+            if not new_dent or new_dent.type != dent.type:
+                deleted_dirs.append(make_path(path, dent.name))
+            else:
+                dir2.remove_entry(dent.name)
+                if new_dent.id != dent.id:
+                    queued_dirs.append((make_path(path, dent.name), dent.id, new_dent.id))
+        new_dirs.extend([(make_path(path, d.name), d.id, d.mtime, d.size) for d in dir2.get_subdirs_list()])
+
+    while new_dirs:
+        path, obj_id, mtime, size = new_dirs.pop(0)
+        added_dirs.append((path, obj_id, mtime, size))
+        d = fs_mgr.load_seafdir(None, 1, obj_id)
+        added_files.extend([(make_path(path, e.name), e.id, e.mtime, e.size) for e in d.get_files_list()])
+        new_dirs.extend([(make_path(path, e.name), e.id, e.mtime, e.size) for e in d.get_subdirs_list()])
+
+    return (added_files, deleted_files, added_dirs, deleted_dirs, modified_files)
+
+
+class CommitDifferTest(unittest.TestCase):
+    def setUp(self):
+        self.fs_mgr = FakeFsManager()
+        self.root1 = self.fs_mgr.add_tree({
+            'a.md': 'a',
+            'same.md': 'same',
+            'deleted.md': 'deleted',
+            'file_to_dir': 'x',
+            'docs': {'b.md': 'b', 'old': {'c.md': 'c'}, 'keep': {'k.md': 'k'}},
+            'removed': {'r.md': 'r', 'sub': {'s.md': 's'}},
+            'dir_to_file': {'d.md': 'd'},
+        })
+        self.root2 = self.fs_mgr.add_tree({
+            'a.md': 'a2',
+            'same.md': 'same',
+            'new.md': 'new',
+            'file_to_dir': {'x.md': 'x'},
+            'docs': {'b.md': 'b2', 'old': {'c.md': 'c', 'c2.md': 'c2'}, 'keep': {'k.md': 'k'}},
+            'added': {'n.md': 'n', 'deep': {'e.md': 'e', 'deeper': {'f.md': 'f'}}},
+            'dir_to_file': 'd',
+        })
+        patcher = mock.patch('seafevents.seasearch.utils.commit_differ.fs_mgr', self.fs_mgr)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_same_diff(self, root1, root2):
+        expected = baseline_diff(self.fs_mgr, root1, root2, 1000)
+        for workers in (1, 4):
+            result = CommitDiffer('repo', 1, root1, root2, workers=workers)._diff(1000)
+            self.assertEqual([sorted(r) for r in result], [sorted(r) for r in expected])
+
+    def test_diff(self):
+        self.assert_same_diff(self.root1, self.root2)
+
+    def test_diff_added_root(self):
+        self.assert_same_diff(None, self.root2)
+
+    def test_diff_deleted_root(self):
+        self.assert_same_diff(self.root1, None)
+
+    def test_scan_files(self):
+        added_files, _, _, _, modified_files = baseline_diff(self.fs_mgr, self.root1, self.root2, None)
+        expected = [(path, obj_id, size) for path, obj_id, _, size in modified_files + added_files]
+        result = ScanCommitDiffer('repo', 1, self.root1, self.root2).diff()
+        self.assertEqual(sorted(result), sorted(expected))
+
+
+class GetCommitCtimeTest(unittest.TestCase):
+    def test_get_commit_ctime(self):
+        commit = mock.Mock(ctime=100)
+        with mock.patch.object(seasearch_utils.commit_mgr, 'load_commit', return_value=commit):
+            self.assertEqual(get_commit_ctime('repo', 'c1'), 100)
+        # the commit is missing from the object store
+        with mock.patch.object(seasearch_utils.commit_mgr, 'load_commit', return_value=None):
+            self.assertIsNone(get_commit_ctime('repo', 'c1'))
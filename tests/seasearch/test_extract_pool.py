@@ -0,0 +1,55 @@
+# coding:utf8
+
+import time
+import unittest
+from unittest import mock
+
+from seafevents.seasearch.utils import extract_pool
+from seafevents.seasearch.utils.extract_pool import ContentExtractPool, ExtractTimeout
+
+
+def _echo_worker(conn):
+    # stands for _extract_worker, sleeps the seconds in the content
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        suffix, content = task
+        time.sleep(float(content))
+        conn.send((True, suffix))
+
+
+class ContentExtractPoolTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(extract_pool, '_extract_worker', _echo_worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_extract(self):
+        pool = ContentExtractPool(2, 30, 1024)
+        futures = [pool.submit('pdf%d' % i, b'0') for i in range(4)]
+        self.assertEqual([f.result(30) for f in futures], ['pdf0', 'pdf1', 'pdf2', 'pdf3'])
+
+    def test_timeout(self):
+        pool = ContentExtractPool(1, 1, 1024)
+        slow = pool.submit('pdf', b'60')
+        fast = pool.submit('docx', b'0')
+        self.assertRaises(ExtractTimeout, slow.result, 30)
+        # the killed worker is replaced
+        self.assertEqual(fast.result(30), 'docx')
+        self.assertEqual(pool._stats['pdf'][3], 1)
+        self.assertEqual(pool._memory, 0)
+
+    def test_dispatcher_failure(self):
+        pool = ContentExtractPool(1, 30, 1024)
+        with mock.patch.object(extract_pool, '_Worker', side_effect=OSError('no more processes')):
+            future = pool.submit('pdf', b'0')
+            self.assertRaises(RuntimeError, future.result, 30)
+        self.assertIsNone(pool._thread)
+        self.assertEqual(pool._memory, 0)
+
+        # the next submit starts the dispatcher again
+        self.assertEqual(pool.submit('pdf', b'0').result(30), 'pdf')
@@ -0,0 +1,246 @@
+# coding:utf8
+
+import json
+import time
+import unittest
+import threading
+from unittest import mock
+
+from seafevents.seasearch.index_store import index_manager as index_manager_module
+from seafevents.seasearch.index_store import repo_file_index as repo_file_index_module
+from seafevents.seasearch.index_store.index_manager import IndexManager
+from seafevents.seasearch.index_store.repo_file_index import RepoFileIndex
+from seafevents.seasearch.index_store.repo_status_index import RepoStatusIndex, RepoStatusStore
+from seafevents.seasearch.index_task import file_index_updater
+from seafevents.seasearch.index_task.file_index_updater import sort_repos_by_staleness, index_repos, \
+    update_dirty_repo_file_indexes, DirtyRepoSet, RepoUpdateSubscriber
+from seafevents.seasearch.utils.commit_differ import ADDED_FILE, DELETED_FILE
+from seafevents.seasearch.utils.constants import ZERO_OBJ_ID, REPO_TYPE_WIKI
+from seafevents.tests.seasearch.seasearch_test_helper import FakeSeaSearchAPI
+
+STATUS_INDEX = 'repo_status'
+
+
+class FakeRepoData(object):
+    def __init__(self, mtime_sizes):
+        self.mtime_sizes = mtime_sizes
+
+    def get_repos_mtime_size(self, repo_ids):
+        return [(repo_id,) + self.mtime_sizes[repo_id] for repo_id in repo_ids if repo_id in self.mtime_sizes]
+
+
+class FakeRepoFileIndex(object):
+    """Returns the given checkpoints from ``update`` one after another."""
+    def __init__(self, checkpoints):
+        self.checkpoints = list(checkpoints)
+        self.updates = []
+
+    def create_index_if_missing(self, index_name):
+        pass
+
+    def update_repo_name(self, index_name, repo_id):
+        pass
+
+    def update(self, index_name, repo_id, old_commit_id, new_commit_id, metadata_rows, metadata_server_api,
+               need_index_metadata, deadline=None, checkpoint=0):
+        self.updates.append((old_commit_id, new_commit_id, checkpoint))
+        return self.checkpoints.pop(0)
+
+
+def make_status_store(statuses):
+    seasearch_api = FakeSeaSearchAPI()
+    status_index = RepoStatusIndex(seasearch_api, STATUS_INDEX)
+    for repo_id, commit_id, updatingto in statuses:
+        status_index.add_repo_status(repo_id, commit_id, updatingto, None)
+    store = RepoStatusStore(status_index)
+    store.load()
+    return store
+
+
+class SortReposTest(unittest.TestCase):
+    def test_sort_repos_by_staleness(self):
+        now = time.time()
+        store = make_status_store([
+            ('repo1', 'c1', None),
+            ('repo4', 'c4', None),
+            ('repo5', 'c5', None),
+        ])
+        repo_data = FakeRepoData({
+            'repo1': (now, 1000),
+            'repo2': (now - 5 * 3600, 100),
+            'repo3': (now - 5 * 3600, 10),
+            'repo4': (now, 1000),
+            'repo5': (now, 1000),
+        })
+        ctimes = {'c1': now - 5 * 3600, 'c5': now - 50 * 3600}
+        repos = [('repo1', 'c2', now), ('repo2', 'c3', now), ('repo3', 'c7', now),
+                 ('repo4', 'c4', now), ('repo5', 'c6', now)]
+
+        with mock.patch.object(file_index_updater, 'get_commit_ctime',
+                               side_effect=lambda repo_id, commit_id: ctimes[commit_id]):
+            repos, backlog = sort_repos_by_staleness(repos, store, repo_data)
+
+        # the oldest indexed commit first, then the smallest change of the same hour
+        self.assertEqual([repo[0] for repo in repos], ['repo5', 'repo1', 'repo3', 'repo2', 'repo4'])
+        self.assertEqual(backlog, 4)
+
+
+class IndexReposTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(file_index_updater, 'publish_metric')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_index_repos(self):
+        workers = 3
+        # every worker waits for the others, so the repos must be indexed in parallel
+        barrier = threading.Barrier(workers)
+        results = {'repo1': True, 'repo2': False, 'repo3': None, 'repo4': True, 'repo5': False, 'repo6': True}
+        deadlines = {}
+
+        class FakeIndexManager(object):
+            def update_library_file_index(self, repo_id, commit_id, repo_file_index, repo_status_file_index,
+                                          metadata_query_time, deadline=None):
+                barrier.wait(10)
+                deadlines[repo_id] = deadline
+                return results[repo_id]
+
+        repos = [(repo_id, 'commit', 0) for repo_id in sorted(results)]
+        start = time.time()
+        stopped = index_repos(repos, len(repos), None, None, FakeIndexManager(), workers, 60)
+
+        self.assertEqual([repo[0] for repo in stopped], ['repo2', 'repo5'])
+        for deadline in deadlines.values():
+            self.assertTrue(start + 60 <= deadline <= time.time() + 60)
+
+    def test_index_repos_without_time_budget(self):
+        index_manager = mock.Mock()
+        index_manager.update_library_file_index.return_value = True
+
+        stopped = index_repos([('repo1', 'commit', 0)], 1, None, None, index_manager, 1, None)
+        self.assertEqual(stopped, [])
+        self.assertIsNone(index_manager.update_library_file_index.call_args[0][5])
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        patchers = [
+            mock.patch.object(index_manager_module, 'need_index_metadata_info', return_value=False),
+            mock.patch.object(index_manager_module.time, 'sleep'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.index_manager = IndexManager.__new__(IndexManager)
+        self.index_manager.session = None
+        self.index_manager.metadata_server_api = None
+
+    def test_resume_from_checkpoint(self):
+        store = make_status_store([])
+        repo_file_index = FakeRepoFileIndex([5, None, None])
+
+        # stopped by the time budget after 5 differences
+        self.assertIs(self.index_manager.update_library_file_index(
+            'repo1', 'c1', repo_file_index, store, None, time.time() + 60), False)
+        status = store.get_repo_status_by_id('repo1')
+        self.assertEqual((status.from_commit, status.to_commit, status.checkpoint), (ZERO_OBJ_ID, 'c1', 5))
+
+        # the library got a new commit in the meantime
+        self.assertIs(self.index_manager.update_library_file_index(
+            'repo1', 'c2', repo_file_index, store, None, time.time() + 60), True)
+        self.assertEqual(repo_file_index.updates, [(ZERO_OBJ_ID, 'c1', 0), (ZERO_OBJ_ID, 'c1', 5), ('c1', 'c2', 0)])
+        status = store.get_repo_status_by_id('repo1')
+        self.assertEqual((status.from_commit, status.to_commit, status.checkpoint), ('c2', None, 0))
+
+    def test_update_by_stream_checkpoint(self):
+        entries = [(ADDED_FILE if i % 3 else DELETED_FILE, '/%d' % i) for i in range(10)]
+        applied = []
+        repo_file_index = RepoFileIndex.__new__(RepoFileIndex)
+        repo_file_index.apply_diff_entries = \
+            lambda index_name, repo_id, entry_type, buffer, version: applied.extend(buffer)
+
+        clock = mock.Mock()
+        clock.time.side_effect = range(100)
+        with mock.patch.object(repo_file_index_module, 'iter_library_diff', return_value=(iter(entries), 1)), \
+                mock.patch.object(repo_file_index_module, 'time', clock):
+            checkpoint = repo_file_index.update_by_stream('index', 'repo1', 'c1', 'c2', deadline=3)
+        self.assertEqual(checkpoint, 4)
+
+        with mock.patch.object(repo_file_index_module, 'iter_library_diff', return_value=(iter(entries), 1)):
+            checkpoint = repo_file_index.update_by_stream('index', 'repo1', 'c1', 'c2', None, checkpoint)
+        self.assertIsNone(checkpoint)
+        # every difference is sent once
+        self.assertEqual(sorted(applied), sorted(entry for _, entry in entries))
+
+
+class FakeSubscriber(object):
+    """Returns the given messages, then cancels the subscriber thread."""
+    def __init__(self, messages, thread):
+        self.messages = list(messages)
+        self.thread = thread
+
+    def get_message(self):
+        if not self.messages:
+            self.thread.cancel()
+            return None
+        return self.messages.pop(0)
+
+
+class DirtyReposTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(file_index_updater, 'publish_metric')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dirty_repo_set(self):
+        dirty_repos = DirtyRepoSet()
+        for repo_id in ['repo2', 'repo1', 'repo2', 'repo3']:
+            dirty_repos.add(repo_id)
+        self.assertEqual(len(dirty_repos), 3)
+        self.assertEqual(dirty_repos.take(), ['repo2', 'repo1', 'repo3'])
+        self.assertEqual(dirty_repos.take(), [])
+
+    def test_repo_update_subscriber(self):
+        dirty_repos = DirtyRepoSet()
+        redis_client = mock.Mock()
+        subscriber = RepoUpdateSubscriber(redis_client, dirty_repos)
+        messages = [
+            {'data': json.dumps({'msg_type': 'repo-update', 'repo_id': 'repo1'})},
+            {'data': 'not json'},
+            {'data': json.dumps({'msg_type': 'repo-update'})},
+            {'data': json.dumps({'msg_type': 'repo-update', 'repo_id': 'repo2'})},
+            {'data': json.dumps({'msg_type': 'repo-update', 'repo_id': 'repo1'})},
+        ]
+        redis_client.get_subscriber.return_value = FakeSubscriber(messages, subscriber)
+
+        with mock.patch.object(file_index_updater.time, 'sleep'):
+            subscriber.run()
+        self.assertEqual(dirty_repos.take(), ['repo1', 'repo2'])
+
+    def test_update_dirty_repo_file_indexes(self):
+        dirty_repos = DirtyRepoSet()
+        for repo_id in ['repo1', 'repo2', 'repo3', 'wiki1', 'virtual1']:
+            dirty_repos.add(repo_id)
+        repo_data = mock.Mock()
+        repo_data.get_repos_id_commit_id.side_effect = lambda repo_ids: [
+            (repo_id, 'commit', REPO_TYPE_WIKI if repo_id.startswith('wiki') else None) for repo_id in repo_ids]
+        repo_data.get_virtual_repo_in_repos.return_value = [('virtual1', 'repo1', '/dir')]
+        results = {'repo1': True, 'repo2': False, 'repo3': None}
+        index_manager = mock.Mock()
+        index_manager.update_library_file_index.side_effect = lambda repo_id, *args: results[repo_id]
+
+        update_dirty_repo_file_indexes(None, None, index_manager, repo_data, dirty_repos, 2, 60)
+        indexed = sorted(call[0][0] for call in index_manager.update_library_file_index.call_args_list)
+        self.assertEqual(indexed, ['repo1', 'repo2', 'repo3'])
+        # the library stopped by the time budget is continued in the next run
+        self.assertEqual(dirty_repos.take(), ['repo2'])
+
+    def test_update_dirty_repo_file_indexes_error(self):
+        dirty_repos = DirtyRepoSet()
+        dirty_repos.add('repo1')
+        repo_data = mock.Mock()
+        repo_data.get_repos_id_commit_id.side_effect = Exception('database is down')
+
+        self.assertRaises(Exception, update_dirty_repo_file_indexes, None, None, mock.Mock(), repo_data,
+                          dirty_repos)
+        self.assertEqual(dirty_repos.take(), ['repo1'])
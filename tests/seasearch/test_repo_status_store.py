@@ -0,0 +1,84 @@
+# coding:utf8
+
+import unittest
+
+from seafevents.seasearch.index_store.repo_status_index import RepoStatusIndex, RepoStatusStore
+from seafevents.tests.seasearch.seasearch_test_helper import FakeSeaSearchAPI
+
+STATUS_INDEX = 'repo_status'
+
+
+class RepoStatusStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.seasearch_api = FakeSeaSearchAPI()
+        self.status_index = RepoStatusIndex(self.seasearch_api, STATUS_INDEX)
+        self.status_index.add_repo_status('repo1', 'c1', None, '100')
+        self.status_index.add_repo_status('repo2', 'c2', 'c3', '100', 7)
+        self.store = RepoStatusStore(self.status_index, page_size=2)
+        self.store.load()
+        self.seasearch_api.requests = []
+
+    def get_doc(self, repo_id):
+        return self.seasearch_api.indexes[STATUS_INDEX].get(repo_id)
+
+    def test_load(self):
+        status = self.store.get_repo_status_by_id('repo2')
+        self.assertEqual((status.from_commit, status.to_commit, status.metadata_updated_time, status.checkpoint),
+                         ('c2', 'c3', '100', 7))
+        status = self.store.get_repo_status_by_id('repo3')
+        self.assertEqual((status.from_commit, status.to_commit), (None, None))
+        self.assertEqual(sorted(e['repo_id'] for e in self.store.get_all_repos_from_index()), ['repo1', 'repo2'])
+        # read from memory
+        self.assertEqual(self.seasearch_api.requests, [])
+
+    def test_begin_update_repo_unchanged(self):
+        self.store.begin_update_repo('repo1', 'c1', None, '100')
+        self.store.flush()
+        self.assertEqual(self.seasearch_api.count('bulk'), 0)
+
+        # the checkpoint is reset
+        self.store.begin_update_repo('repo2', 'c2', 'c3', '100')
+        self.assertEqual(self.seasearch_api.count('bulk'), 1)
+        self.assertEqual(self.get_doc('repo2')['checkpoint'], 0)
+
+    def test_begin_update_repo_written_at_once(self):
+        self.store.begin_update_repo('repo1', 'c1', 'c4', '100')
+        self.assertEqual(self.seasearch_api.count('bulk'), 1)
+        self.assertEqual(self.get_doc('repo1')['updatingto'], 'c4')
+
+        # an empty diff has nothing to recover
+        self.store.begin_update_repo('repo3', 'c5', 'c5', '100')
+        self.assertEqual(self.seasearch_api.count('bulk'), 1)
+        self.assertIsNone(self.get_doc('repo3'))
+        self.store.flush()
+        self.assertEqual(self.get_doc('repo3')['updatingto'], 'c5')
+
+    def test_bulk_write(self):
+        self.store.checkpoint_update_repo('repo2', 'c2', 'c3', '100', 9)
+        self.assertEqual(self.seasearch_api.count('bulk'), 0)
+        self.assertEqual(self.store.get_repo_status_by_id('repo2').checkpoint, 9)
+
+        # page_size changes are written in one request
+        self.store.finish_update_repo('repo1', 'c4', '200')
+        self.assertEqual(self.seasearch_api.count('bulk'), 1)
+        self.assertEqual(self.get_doc('repo2')['checkpoint'], 9)
+        self.assertEqual((self.get_doc('repo1')['commit_id'], self.get_doc('repo1')['updatingto']), ('c4', None))
+
+        self.store.finish_update_repo('repo2', 'c3', '200')
+        self.store.flush()
+        self.assertEqual(self.seasearch_api.count('bulk'), 2)
+        self.store.flush()
+        self.assertEqual(self.seasearch_api.count('bulk'), 2)
+
+        store = RepoStatusStore(self.status_index)
+        store.load()
+        status = store.get_repo_status_by_id('repo2')
+        self.assertEqual((status.from_commit, status.to_commit, status.checkpoint), ('c3', None, 0))
+
+    def test_delete_documents_by_repo(self):
+        self.store.checkpoint_update_repo('repo2', 'c2', 'c3', '100', 9)
+        self.store.delete_documents_by_repo('repo2')
+        self.store.flush()
+        self.assertEqual(self.seasearch_api.count('bulk'), 0)
+        self.assertIsNone(self.get_doc('repo2'))
+        self.assertIsNone(self.store.get_repo_status_by_id('repo2').from_commit)
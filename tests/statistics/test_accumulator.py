@@ -0,0 +1,78 @@
+# coding:utf8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from seafevents.statistics.accumulator import StatsAccumulator, replace_value
+
+
+class StatsAccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        os.environ['SEAFEVENTS_JOURNAL_DIR'] = self.journal_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.journal_dir)
+
+    def get_accumulator(self, **kwargs):
+        accumulator = StatsAccumulator('test', shards=4, **kwargs)
+        accumulator.enable_journal()
+        return accumulator
+
+    def test_swap_and_restore(self):
+        accumulator = StatsAccumulator('test', shards=4)
+        accumulator.add(('2024-01-01', 'a'), 1)
+        accumulator.add(('2024-01-01', 'a'), 2)
+        items = accumulator.swap()
+        self.assertEqual(items, {('2024-01-01', 'a'): 3})
+        self.assertEqual(len(accumulator), 0)
+
+        accumulator.add(('2024-01-01', 'a'), 4)
+        accumulator.restore(items.items())
+        self.assertEqual(accumulator.swap(), {('2024-01-01', 'a'): 7})
+
+    def test_max_size(self):
+        accumulator = StatsAccumulator('test', shards=1, max_size=1)
+        self.assertTrue(accumulator.add(('a', ), 1))
+        self.assertFalse(accumulator.add(('b', ), 1))
+        self.assertTrue(accumulator.add(('a', ), 1))
+
+    def test_replay_journal(self):
+        accumulator = self.get_accumulator()
+        for i in range(10):
+            accumulator.add(('2024-01-01', -1, 'user%d' % (i % 3), 'web-file-upload'), i)
+
+        accumulator = self.get_accumulator()
+        self.assertEqual(accumulator.swap(), {
+            ('2024-01-01', -1, 'user0', 'web-file-upload'): 0 + 3 + 6 + 9,
+            ('2024-01-01', -1, 'user1', 'web-file-upload'): 1 + 4 + 7,
+            ('2024-01-01', -1, 'user2', 'web-file-upload'): 2 + 5 + 8,
+        })
+
+    def test_replay_replace_value(self):
+        accumulator = self.get_accumulator(merge=replace_value)
+        accumulator.add(('user', '2024-01-01'), 1)
+        accumulator.add(('user', '2024-01-01'), 2)
+
+        self.assertEqual(self.get_accumulator(merge=replace_value).swap(), {('user', '2024-01-01'): 2})
+
+    def test_commit(self):
+        accumulator = self.get_accumulator()
+        accumulator.add(('a', ), 1)
+        accumulator.swap()
+        accumulator.add(('b', ), 2)
+        accumulator.commit()
+        self.assertEqual(self.get_accumulator().swap(), {('b', ): 2})
+
+    def test_restore_not_committed(self):
+        accumulator = self.get_accumulator()
+        accumulator.add(('a', ), 1)
+        items = accumulator.swap()
+        # saving failed, the values stay in the journal until the next commit
+        accumulator.restore(items.items())
+        self.assertEqual(self.get_accumulator().swap(), {('a', ): 1})
@@ -0,0 +1,80 @@
+# coding:utf8
+
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+from threading import Thread
+from unittest import mock
+
+from seafevents.utils.diff_cache import DiffCache
+
+
+class DiffCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = self.get_cache('1mb')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_cache(self, max_size):
+        config = configparser.ConfigParser()
+        config.read_dict({'DIFF CACHE': {'enabled': 'true', 'max_size': max_size, 'dir': self.cache_dir}})
+        cache = DiffCache()
+        cache.init(config)
+        return cache
+
+    def test_get_or_diff(self):
+        calls = []
+
+        def diff():
+            calls.append(1)
+            return [['/a.md'], [], []]
+
+        self.assertEqual(self.cache.get_or_diff('tree', 'repo', None, 'b' * 40, diff), [['/a.md'], [], []])
+        self.assertEqual(self.cache.get_or_diff('tree', 'repo', None, 'b' * 40, diff), [['/a.md'], [], []])
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(self.cache.get('other', 'repo', None, 'b' * 40))
+
+    def test_evict(self):
+        for i in range(40):
+            self.cache.set('tree', 'repo', 'a' * 40, '%040d' % i, os.urandom(50 * 1024))
+        size = sum(os.path.getsize(os.path.join(self.cache_dir, name)) for name in os.listdir(self.cache_dir))
+        self.assertLessEqual(size, 1024 * 1024)
+        self.assertIsNotNone(self.cache.get('tree', 'repo', 'a' * 40, '%040d' % 39))
+
+        # the size is counted again from the files when the cache is loaded
+        self.assertEqual(self.get_cache('1mb')._size, size)
+
+    def test_concurrent_set(self):
+        results = [list(range(i, i + 1000)) for i in range(8)]
+        threads = [Thread(target=self.cache.set, args=('tree', 'repo', None, 'b' * 40, r)) for r in results]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertIn(self.cache.get('tree', 'repo', None, 'b' * 40), results)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_relative_dir(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'DIFF CACHE': {'enabled': 'true', 'dir': 'diff_cache'}})
+        cache = DiffCache()
+        cache.init(config)
+        self.assertFalse(cache.enabled)
+
+        # neither dir nor SEAFEVENTS_LOG_DIR is set
+        config.remove_option('DIFF CACHE', 'dir')
+        with mock.patch.dict(os.environ, clear=True):
+            cache = DiffCache()
+            cache.init(config)
+        self.assertFalse(cache.enabled)
+
+        with mock.patch.dict(os.environ, {'SEAFEVENTS_LOG_DIR': self.cache_dir}):
+            cache = DiffCache()
+            cache.init(config)
+        self.assertTrue(cache.enabled)
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'diff_cache')))
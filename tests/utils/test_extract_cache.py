@@ -0,0 +1,59 @@
+# coding:utf8
+
+import os
+import shutil
+import tempfile
+import unittest
+import configparser
+
+from seafevents.utils.extract_cache import ExtractCache
+
+
+class ExtractCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_cache(self, compress='true'):
+        config = configparser.ConfigParser()
+        config.read_dict({'EXTRACT CACHE': {'enabled': 'true', 'max_size': '1mb',
+                                            'dir': self.cache_dir, 'compress': compress}})
+        cache = ExtractCache()
+        cache.init(config)
+        return cache
+
+    def test_get_or_extract(self):
+        obj_id = 'ab' * 20
+        calls = []
+
+        def extract():
+            calls.append(1)
+            return 'текст ' * 100
+
+        for compress in ('true', 'false'):
+            cache = self.get_cache(compress)
+            self.assertEqual(cache.get_or_extract(compress, obj_id, extract), 'текст ' * 100)
+            self.assertEqual(cache.get_or_extract(compress, obj_id, extract), 'текст ' * 100)
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'ab', 'true_' + obj_id)))
+
+    def test_not_cache_none(self):
+        cache = self.get_cache()
+        calls = []
+
+        def extract():
+            calls.append(1)
+
+        cache.get_or_extract('pdf', 'ab' * 20, extract)
+        cache.get_or_extract('pdf', 'ab' * 20, extract)
+        self.assertEqual(len(calls), 2)
+
+    def test_evict(self):
+        cache = self.get_cache('false')
+        for i in range(40):
+            cache.set('pdf', '%040x' % i, 'x' * 50 * 1024)
+        self.assertLessEqual(sum(size for _, _, size in cache._list_files()), 1024 * 1024)
+        self.assertIsNotNone(cache.get('pdf', '%040x' % 39))
+        self.assertIsNone(cache.get('pdf', '%040x' % 0))
@@ -56,3 +56,13 @@ class CcnetDB(object):
         result = self.session.execute(text(sql), {'email': email})
         row = result.fetchone()
         return row[0] if row else 'default'
+
+    def get_users_role(self, emails, chunk_size=1000):
+        emails = list(emails)
+        roles = {email: 'default' for email in emails}
+        sql = "SELECT email, role FROM UserRole WHERE email IN :emails"
+        for i in range(0, len(emails), chunk_size):
+            result = self.session.execute(text(sql), {'emails': tuple(emails[i: i + chunk_size])})
+            for email, role in result.fetchall():
+                roles[email] = role
+        return roles
@@ -0,0 +1,50 @@
+import zlib
+import pickle
+import logging
+
+from seafevents.utils.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+ZERO_OBJ_ID = '0000000000000000000000000000000000000000'
+
+
+class DiffCache(DiskCache):
+    """Results of diffing two fs trees, shared on local disk by all consumers of a commit.
+
+    A result is stored in one file named after (kind, repo_id, old_root, new_root),
+    ``kind`` tells apart differs which return different results.
+    """
+    def __init__(self):
+        DiskCache.__init__(self, 'DIFF CACHE', 'diff_cache', '512mb')
+
+    def _get_name(self, kind, repo_id, old_root, new_root):
+        return '%s_%s_%s_%s' % (kind, repo_id, old_root or ZERO_OBJ_ID, new_root or ZERO_OBJ_ID)
+
+    def get(self, kind, repo_id, old_root, new_root):
+        name = self._get_name(kind, repo_id, old_root, new_root)
+        data = self.read(name)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data))
+        except Exception as e:
+            logger.warning('Failed to load diff cache %s: %s', name, e)
+            return None
+
+    def set(self, kind, repo_id, old_root, new_root, result):
+        self.write(self._get_name(kind, repo_id, old_root, new_root), zlib.compress(pickle.dumps(result)))
+
+    def get_or_diff(self, kind, repo_id, old_root, new_root, diff):
+        """Return the cached result of ``diff()``, call it on a miss."""
+        if not self.enabled:
+            return diff()
+
+        result = self.get(kind, repo_id, old_root, new_root)
+        if result is None:
+            result = diff()
+            self.set(kind, repo_id, old_root, new_root, result)
+        return result
+
+
+diff_cache = DiffCache()
@@ -0,0 +1,127 @@
+import os
+import time
+import logging
+import tempfile
+from threading import Lock
+
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool, parse_max_size
+
+logger = logging.getLogger(__name__)
+
+# temp files left by a crashed writer are evicted after this many seconds
+TMP_FILE_MAX_AGE = 3600
+
+
+class DiskCache(object):
+    """Files in a local directory shared by several processes, with the least
+    recently used ones removed once the directory grows beyond ``max_size``.
+
+    Files are written to a unique temp file and renamed, so concurrent writers
+    of the same key in any thread or process never see a partial file. The
+    mtime of a file is used as its access time.
+    """
+    def __init__(self, section_name, dir_name, max_size):
+        self.enabled = False
+        self._section_name = section_name
+        self._dir_name = dir_name
+        self._dir = ''
+        self._max_size = parse_max_size(max_size, 0)
+        self._default_max_size = max_size
+        self._size = 0
+        self._lock = Lock()
+
+    def init(self, config):
+        enabled = get_opt_from_conf_or_env(config, self._section_name, 'enabled', default=False)
+        self.enabled = parse_bool(enabled)
+        if not self.enabled:
+            return
+
+        max_size = get_opt_from_conf_or_env(config, self._section_name, 'max_size', default=self._default_max_size)
+        self._max_size = parse_max_size(max_size, self._max_size)
+        self._dir = get_opt_from_conf_or_env(config, self._section_name, 'dir', default='') or \
+            os.path.join(os.environ.get('SEAFEVENTS_LOG_DIR', ''), self._dir_name)
+        if not os.path.isabs(self._dir):
+            # a dir relative to the cwd would be left behind on a restart from elsewhere
+            logger.warning('%s dir %s is not an absolute path, set dir or SEAFEVENTS_LOG_DIR, '
+                           '%s is disabled', self._section_name.lower(), self._dir, self._section_name.lower())
+            self.enabled = False
+            return
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+        except OSError as e:
+            logger.warning('Failed to create %s dir %s: %s', self._section_name.lower(), self._dir, e)
+            self.enabled = False
+            return
+        self._size = sum(size for _, _, size in self._list_files())
+
+    def _list_files(self):
+        files = []
+        now = time.time()
+        for dirpath, _, names in os.walk(self._dir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # removed by another process
+                    continue
+                if name.endswith('.tmp') and st.st_mtime > now - TMP_FILE_MAX_AGE:
+                    # being written
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+        return files
+
+    def read(self, name):
+        """Return the content of the file ``name`` in the cache dir, None on a miss."""
+        path = os.path.join(self._dir, name)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            # mtime is used as the access time for eviction
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Failed to read %s %s: %s', self._section_name.lower(), path, e)
+            return None
+
+    def write(self, name, data):
+        if len(data) > self._max_size // 10:
+            # a huge entry would evict most of the other entries
+            return
+
+        path = os.path.join(self._dir, name)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning('Failed to write %s %s: %s', self._section_name.lower(), path, e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+
+        with self._lock:
+            self._size += len(data)
+            if self._size > self._max_size:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._list_files())
+        # other processes write to the same dir, so count again
+        self._size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._size <= self._max_size * 0.8:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._size -= size
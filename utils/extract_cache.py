@@ -0,0 +1,71 @@
+import os
+import zlib
+import logging
+
+from seafevents.utils import get_opt_from_conf_or_env, parse_bool
+from seafevents.utils.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# First byte of a cache file
+_RAW = b'0'
+_COMPRESSED = b'1'
+
+
+class ExtractCache(DiskCache):
+    """Text extracted from file objects, shared on local disk by all indexers.
+
+    A file object never changes, so the text is stored in one file named after
+    (kind, obj_id) whichever library or path the object is found in. ``kind``
+    tells apart extractors which return different texts for the same object,
+    e.g. the suffix of the file. Files are spread over 256 dirs by the first
+    two chars of obj_id.
+    """
+    def __init__(self):
+        DiskCache.__init__(self, 'EXTRACT CACHE', 'extract_cache', '1024mb')
+        self._compress = True
+
+    def init(self, config):
+        DiskCache.init(self, config)
+        compress = get_opt_from_conf_or_env(config, 'EXTRACT CACHE', 'compress', default=True)
+        self._compress = parse_bool(compress)
+
+    def _get_name(self, kind, obj_id):
+        return os.path.join(obj_id[:2], '%s_%s' % (kind, obj_id))
+
+    def get(self, kind, obj_id):
+        """Return the cached text, None on a miss."""
+        if not self.enabled:
+            return None
+        name = self._get_name(kind, obj_id)
+        data = self.read(name)
+        if data is None:
+            return None
+        try:
+            if data[:1] == _COMPRESSED:
+                return zlib.decompress(data[1:]).decode('utf-8')
+            return data[1:].decode('utf-8')
+        except Exception as e:
+            logger.warning('Failed to load extract cache %s: %s', name, e)
+            return None
+
+    def set(self, kind, obj_id, text):
+        if not self.enabled or text is None:
+            return
+        data = text.encode('utf-8')
+        data = _COMPRESSED + zlib.compress(data) if self._compress else _RAW + data
+        self.write(self._get_name(kind, obj_id), data)
+
+    def get_or_extract(self, kind, obj_id, extract):
+        """Return the cached text of the object, call ``extract()`` on a miss."""
+        if not self.enabled:
+            return extract()
+
+        text = self.get(kind, obj_id)
+        if text is None:
+            text = extract()
+            self.set(kind, obj_id, text)
+        return text
+
+
+extract_cache = ExtractCache()
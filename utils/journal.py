@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import logging
+import datetime
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def get_journal_dir():
+    """Directory of the local journals, ``SEAFEVENTS_JOURNAL_DIR`` or a ``journal``
+    directory next to the seafevents logs.
+    """
+    journal_dir = os.environ.get('SEAFEVENTS_JOURNAL_DIR', '')
+    if not journal_dir:
+        log_dir = os.environ.get('SEAFEVENTS_LOG_DIR', '')
+        if not log_dir:
+            # a dir relative to the cwd would lose the journals on a restart from elsewhere
+            raise RuntimeError('Neither SEAFEVENTS_JOURNAL_DIR nor SEAFEVENTS_LOG_DIR is set, '
+                               'can not find the journal dir')
+        journal_dir = os.path.join(log_dir, 'journal')
+    if not os.path.exists(journal_dir):
+        os.makedirs(journal_dir, exist_ok=True)
+    return journal_dir
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def parse_journal_datetime(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+
+
+def load_journal_entries(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # the last line may be cut off by a crash
+                logger.warning('Skip broken entry in journal %s', path)
+    return entries
+
+
+class Journal(object):
+    """Append-only file of json lines which keeps in-memory buffers across restarts.
+
+    Writers append an entry for every change of their buffer, and rewrite the
+    journal with the remaining entries once the buffer has been saved to the
+    database. On startup the entries are loaded back to rebuild the buffer.
+    """
+    def __init__(self, name, fsync=False):
+        self.path = os.path.join(get_journal_dir(), '%s.journal' % name)
+        self._fsync = fsync
+        self._lock = Lock()
+        self._fp = open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, entries):
+        for entry in entries:
+            self._fp.write(json.dumps(entry, default=_json_default) + '\n')
+        self._fp.flush()
+        if self._fsync:
+            os.fsync(self._fp.fileno())
+
+    def append(self, entry):
+        with self._lock:
+            self._write([entry])
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        with self._lock:
+            self._write(entries)
+
+    def load(self):
+        with self._lock:
+            return load_journal_entries(self.path)
+
+    def rewrite(self, entries):
+        """Replace the content of the journal with ``entries`` atomically."""
+        tmp_path = self.path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                for entry in entries:
+                    fp.write(json.dumps(entry, default=_json_default) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            self._fp.close()
+            os.replace(tmp_path, self.path)
+            self._fp = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class SegmentedJournal(object):
+    """Journal split into numbered segment files, for buffers which are saved
+    to the database all at once.
+
+    Entries are appended to the last segment. When the buffer is taken for
+    saving, ``rotate`` starts a new segment and returns the closed ones, which
+    are removed once the buffer has been saved. Unlike ``Journal.rewrite``,
+    entries appended while saving are never rewritten.
+    """
+    def __init__(self, name, fsync=False):
+        self.name = name
+        self._fsync = fsync
+        self._lock = Lock()
+        self._closed = self._list_segments()
+        seq = max([s for s, _ in self._closed], default=0) + 1
+        self._journal = Journal('%s.%d' % (name, seq), fsync)
+        self._seq = seq
+
+    def _list_segments(self):
+        journal_dir = get_journal_dir()
+        pattern = re.compile(r'^%s\.(\d+)\.journal$' % re.escape(self.name))
+        segments = []
+        for file_name in os.listdir(journal_dir):
+            match = pattern.match(file_name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(journal_dir, file_name)))
+        return sorted(segments)
+
+    def load(self):
+        """Return the entries left by the last run, in the order they were written."""
+        entries = []
+        with self._lock:
+            for _, path in self._closed:
+                entries.extend(load_journal_entries(path))
+        return entries
+
+    def append(self, entry):
+        with self._lock:
+            self._journal.append(entry)
+
+    def rotate(self):
+        """Start a new segment, return the paths of all the closed segments."""
+        with self._lock:
+            self._journal.close()
+            self._closed.append((self._seq, self._journal.path))
+            self._seq += 1
+            self._journal = Journal('%s.%d' % (self.name, self._seq), self._fsync)
+            closed, self._closed = self._closed, []
+        return [path for _, path in closed]
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+
+
+def remove_journal_segments(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning('Failed to remove journal segment %s: %s', path, e)
@@ -141,6 +141,75 @@ class SeafileDB(object):
             return -1
         return rows[0]
 
+    def get_repos_owner(self, repo_ids, chunk_size=1000):
+        """Return {repo_id: (org_id, owner)}, org_id is -1 for repos out of orgs."""
+        repos = {}
+        for i in range(0, len(repo_ids), chunk_size):
+            params = {'repo_ids': tuple(repo_ids[i: i + chunk_size])}
+            sql = "SELECT repo_id, owner_id FROM RepoOwner WHERE repo_id IN :repo_ids"
+            for row in self.session.execute(text(sql), params).fetchall():
+                repos[row[0]] = (-1, row[1])
+            sql = "SELECT repo_id, org_id, user FROM OrgRepo WHERE repo_id IN :repo_ids"
+            for row in self.session.execute(text(sql), params).fetchall():
+                repos[row[0]] = (row[1], row[2])
+        return repos
+
+    def get_users_self_usage(self, emails, chunk_size=1000):
+        """Return {email: usage} of the users owning at least one repo."""
+        usages = {}
+        for i in range(0, len(emails), chunk_size):
+            sql = """
+                    SELECT owner_id, SUM(size)
+                    FROM RepoOwner o
+                    LEFT JOIN VirtualRepo v ON o.repo_id = v.repo_id
+                    JOIN RepoSize rs ON o.repo_id = rs.repo_id
+                    WHERE owner_id IN :emails
+                    AND v.repo_id IS NULL
+                    GROUP BY owner_id
+                    """
+            result = self.session.execute(text(sql), {'emails': tuple(emails[i: i + chunk_size])})
+            for row in result.fetchall():
+                usages[row[0]] = int(row[1] or 0)
+        return usages
+
+    def get_org_users_quota_usage(self, org_id, emails, chunk_size=1000):
+        """Return {email: usage} of the org users owning at least one repo."""
+        usages = {}
+        for i in range(0, len(emails), chunk_size):
+            sql = """
+                    SELECT user, SUM(size)
+                    FROM OrgRepo o
+                    LEFT JOIN VirtualRepo v ON o.repo_id = v.repo_id
+                    JOIN RepoSize rs ON o.repo_id = rs.repo_id
+                    WHERE org_id = :org_id
+                    AND user IN :emails
+                    AND v.repo_id IS NULL
+                    GROUP BY user
+                    """
+            result = self.session.execute(text(sql), {'org_id': org_id,
+                                                      'emails': tuple(emails[i: i + chunk_size])})
+            for row in result.fetchall():
+                usages[row[0]] = int(row[1] or 0)
+        return usages
+
+    def get_orgs_quota_usage(self, org_ids, chunk_size=1000):
+        """Return {org_id: usage} of the orgs owning at least one repo."""
+        usages = {}
+        for i in range(0, len(org_ids), chunk_size):
+            sql = """
+                    SELECT org_id, SUM(size)
+                    FROM OrgRepo o
+                    LEFT JOIN VirtualRepo v ON o.repo_id = v.repo_id
+                    JOIN RepoSize rs ON o.repo_id = rs.repo_id
+                    WHERE org_id IN :org_ids
+                    AND v.repo_id IS NULL
+                    GROUP BY org_id
+                    """
+            result = self.session.execute(text(sql), {'org_ids': tuple(org_ids[i: i + chunk_size])})
+            for row in result.fetchall():
+                usages[row[0]] = int(row[1] or 0)
+        return usages
+
     def get_org_quota_usage(self, org_id):
         sql = """
                 SELECT SUM(size)
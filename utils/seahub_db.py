@@ -56,3 +56,34 @@ class SeahubDB(object):
         if not rows:
             return 'default'
         return rows[0]
+
+    def get_orgs_member_quota(self, org_ids):
+        if not ORG_MEMBER_QUOTA_ENABLED:
+            return {org_id: None for org_id in org_ids}
+        quotas = {org_id: ORG_MEMBER_QUOTA_DEFAULT for org_id in org_ids}
+        if not quotas:
+            return quotas
+        sql = """
+                SELECT org_id, quota
+                FROM organizations_orgmemberquota
+                WHERE org_id IN :org_ids
+                """
+        result = self.session.execute(text(sql), {'org_ids': tuple(quotas)})
+        for org_id, quota in result.fetchall():
+            quotas[org_id] = quota
+        return quotas
+
+    def get_orgs_settings(self, org_ids):
+        """Return {org_id: (role, monthly_traffic_limit)}."""
+        settings = {org_id: ('default', 0) for org_id in org_ids}
+        if not settings:
+            return settings
+        sql = """
+                SELECT org_id, role, monthly_traffic_limit
+                FROM organizations_orgsettings
+                WHERE org_id IN :org_ids
+                """
+        result = self.session.execute(text(sql), {'org_ids': tuple(settings)})
+        for org_id, role, monthly_traffic_limit in result.fetchall():
+            settings[org_id] = (role, monthly_traffic_limit or 0)
+        return settings